@@ -0,0 +1,115 @@
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+def stub_answer(system_instruction: str, prompt: str) -> str:
+    """A plausible answer for each LLMService generator"""
+    columns = re.findall(
+        r"(?:Available Columns|Data Headers): \[(.*?)\]",
+        system_instruction + "\n" + prompt,
+    )
+    first_column = None
+    if columns:
+        names = re.findall(r"'([^']*)'", columns[0])
+        first_column = names[0] if names else None
+
+    if "'regex', 'column', and 'replacement'" in system_instruction:
+        return json.dumps(
+            {"regex": "^N.*", "column": first_column, "replacement": "X"}
+        )
+    if ".query() method" in system_instruction:
+        return f"`{first_column}` == `{first_column}`" if first_column \
+            else "index >= 0"
+    return f"Stub = `{first_column}`" if first_column else "Stub = 1"
+
+
+def stub_server(host='127.0.0.1', port=8765, latency=0.0,
+                error_rate=0.0) -> ThreadingHTTPServer:
+    """The stub's HTTP server (port 0 picks a free one), not started yet"""
+    counter = {'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            counter['requests'] += 1
+
+            if not self.path.endswith('/chat/completions'):
+                return self._send(404, {"error": "not found"})
+
+            time.sleep(latency)
+            if error_rate and \
+                    (counter['requests'] * error_rate) % 1 < error_rate:
+                return self._send(503, {"error": "stub overloaded"})
+
+            messages = body.get('messages', [])
+            system = next((m['content'] for m in messages
+                           if m['role'] == 'system'), '')
+            prompt = next((m['content'] for m in messages
+                           if m['role'] == 'user'), '')
+            content = stub_answer(system, prompt)
+
+            self._send(200, {
+                "id": f"stub-{counter['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get('model', 'stub'),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": len((system + prompt).split()),
+                    "completion_tokens": len(content.split()),
+                    "total_tokens": len((system + prompt + content)
+                                        .split()),
+                },
+            })
+
+        def _send(self, code, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class Command(BaseCommand):
+    help = ("Serve a fake OpenAI Chat Completions API for local tests and "
+            "benchmarks (set LLM_BASE_URL=http://HOST:PORT/v1)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help="Seconds to wait before answering",
+        )
+        parser.add_argument(
+            '--error-rate', type=float, default=0.0,
+            help="Fraction of requests answered with HTTP 503",
+        )
+
+    def handle(self, *args, **options):
+        server = stub_server(
+            options['host'], options['port'],
+            latency=options['latency'], error_rate=options['error_rate'],
+        )
+        self.stdout.write(
+            f"LLM stub on http://{options['host']}:{options['port']}/v1"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.services.jobs import JobQueue
+
+
+class Command(BaseCommand):
+    help = "Worker process that runs queued Apply* jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Waiting for jobs...")
+
+        while True:
+            close_old_connections()
+            job = JobQueue.claim_next()
+
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            job = JobQueue.run(job)
+            self.stdout.write(f"{job} ({job.operation.get('op')})")
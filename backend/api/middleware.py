@@ -0,0 +1,169 @@
+# api/middleware.py
+import cProfile
+import logging
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .services import metrics
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # Optional: cProfile is used instead
+    Profiler = None
+
+logger = logging.getLogger('api.metrics')
+
+
+class MetricsMiddleware:
+    """
+    Times every request. The stages (see services/metrics.py) and the
+    database queries end up in the Server-Timing header, the api.metrics
+    log and the Prometheus metrics of MetricsView.
+
+    With PROFILE_REQUESTS on, ?profile=1 saves a profile of the request to
+    PROFILE_DIR and names the file in the X-Profile header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        trace = metrics.start_trace()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_time_query):
+                response = self._respond(request)
+        finally:
+            metrics.end_trace()
+        elapsed = time.perf_counter() - started
+
+        timings = trace.summary()
+        response['Server-Timing'] = _server_timing(timings, elapsed)
+
+        if response.streaming and not getattr(response, 'is_async', False):
+            # The body is produced while it is sent, after we return
+            def done(sent, sending):
+                metrics.record('send', sending, bytes_written=sent)
+                self._finish(request, response, elapsed + sending, sent,
+                             {**timings, 'send': sending}, trace)
+
+            response.streaming_content = _counted(
+                response.streaming_content, done
+            )
+        else:
+            sent = 0 if response.streaming else len(response.content)
+            self._finish(request, response, elapsed, sent, timings, trace)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (to JSON) after the view returns
+        started = time.perf_counter()
+
+        def rendered(response):
+            metrics.record('render', time.perf_counter() - started,
+                           bytes_written=len(response.content))
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def _respond(self, request):
+        mode = request.GET.get('profile')
+        if not settings.PROFILE_REQUESTS or mode in (None, '', '0'):
+            return self.get_response(request)
+
+        directory = Path(settings.PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9}" \
+               f"-{request.method}-{slug or 'root'}"
+
+        if Profiler is not None and mode != 'cprofile':
+            profiler = Profiler()
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            path = directory / f"{stem}.html"
+            path.write_text(profiler.output_html())
+        else:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            path = directory / f"{stem}.prof"
+            profiler.dump_stats(path)
+
+        logger.info("Profile of %s %s saved to %s", request.method,
+                    request.path, path)
+        response['X-Profile'] = path.name
+        return response
+
+    def _finish(self, request, response, elapsed, sent, timings, trace):
+        view = _view_name(request)
+        code = str(response.status_code)
+        metrics.registry.inc(
+            'http_requests_total', help="Requests by view and status",
+            view=view, method=request.method, status=code,
+        )
+        metrics.registry.observe(
+            'http_request_seconds', elapsed, help="Request latency",
+            view=view, method=request.method,
+        )
+        metrics.registry.inc(
+            'http_response_bytes_total', sent, help="Response body bytes",
+            view=view,
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            stages = ' '.join(
+                f"{name}={seconds * 1000:.1f}ms"
+                for name, seconds in timings.items()
+            )
+            logger.debug(
+                "%s %s %s %.1fms %dB %d queries %s", request.method,
+                request.path, code, elapsed * 1000, sent, trace.queries,
+                stages,
+            )
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(time.perf_counter() - started)
+
+
+def _counted(chunks, done):
+    """Pass the chunks through, then done(bytes sent, seconds)"""
+    started = time.perf_counter()
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        done(sent, time.perf_counter() - started)
+
+
+def _view_name(request) -> str:
+    # The view class, so the number of label values stays bounded
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = getattr(match.func, 'view_class', match.func)
+    return view.__name__
+
+
+def _server_timing(timings: dict, elapsed: float) -> str:
+    entries = [
+        f"{name};dur={seconds * 1000:.1f}"
+        for name, seconds in timings.items()
+    ]
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    return ', '.join(entries)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadeddocument',
+            name='filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='uploadeddocument',
+            name='working_file',
+            field=models.FileField(blank=True, upload_to='working/'),
+        ),
+        migrations.AlterField(
+            model_name='uploadeddocument',
+            name='file',
+            field=models.FileField(blank=True, upload_to='uploads/'),
+        ),
+    ]
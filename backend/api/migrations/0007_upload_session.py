@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('multipart_id', models.CharField(blank=True, max_length=255)),
+                ('parts', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('completed', 'Completed'), ('aborted', 'Aborted')], default='open', max_length=10)),
+                ('parsed_parts', models.IntegerField(default=0)),
+                ('parsed_bytes', models.BigIntegerField(default=0)),
+                ('columns', models.JSONField(blank=True, null=True)),
+                ('tail', models.BinaryField(default=b'')),
+                ('segments', models.JSONField(default=list)),
+                ('accumulator', models.BinaryField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.uploadeddocument')),
+            ],
+        ),
+    ]
@@ -2,8 +2,168 @@ from django.db import models
 
 
 class UploadedDocument(models.Model):
-    file = models.FileField(upload_to='uploads/')
+    # Original upload (empty for versions derived by the Apply* views)
+    file = models.FileField(upload_to='uploads/', blank=True)
+    # Typed Parquet copy that every transform reads and writes
+    working_file = models.FileField(upload_to='working/', blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    # Worksheet of an Excel original the working copy was read from
+    # (blank: the first)
+    sheet = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Column statistics (see services/profile.py), computed at upload and
+    # on first use for derived versions
+    profile = models.JSONField(null=True, blank=True)
+    # SHA-256 of the original upload and of the working copy: documents with
+    # the same content share the stored objects, cached frame and profile
+    source_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Column-level delta: the working copy only holds the columns that
+    # differ from this version (rewritten or added), see DocumentStore.load()
+    delta_base = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='deltas',
+    )
+
+    @property
+    def display_name(self):
+        return self.filename or self.file.name.split('/')[-1]
+
+    @property
+    def is_materialized(self):
+        # Lazy versions only have an Operation until downloaded/checkpointed
+        return bool(self.working_file or self.file)
 
     def __str__(self):
         return f"Document {self.id} - {self.uploaded_at}"
+
+
+class Operation(models.Model):
+    """
+    How a lazy version is derived: its parent plus the operation spec
+    (see services/transforms.py). Kept after materialization as lineage.
+    """
+    document = models.OneToOneField(
+        UploadedDocument, on_delete=models.CASCADE, related_name='operation'
+    )
+    # Lazy children can't be computed without their parent
+    parent = models.ForeignKey(
+        UploadedDocument, on_delete=models.PROTECT, related_name='children'
+    )
+    spec = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Operation {self.spec.get('op')} {self.parent_id} -> " \
+               f"{self.document_id}"
+
+
+class Recipe(models.Model):
+    """A saved list of operation specs that can be replayed on any file"""
+    name = models.CharField(max_length=255)
+    operations = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Recipe {self.id} - {self.name}"
+
+
+class Job(models.Model):
+    """
+    An Apply* operation, or the materialization of a lazy version, queued
+    to run outside the request
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    document = models.ForeignKey(
+        UploadedDocument, on_delete=models.CASCADE, related_name='jobs'
+    )
+    # Operation spec (see services/transforms.py), or {"op": "materialize"}
+    operation = models.JSONField()
+    mode = models.CharField(max_length=10, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True
+    )
+    rows_processed = models.BigIntegerField(default=0)
+    total_rows = models.BigIntegerField(null=True, blank=True)
+    result = models.ForeignKey(
+        UploadedDocument,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    preview = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Written while the job runs: a running job that stops updating it had
+    # its worker die, and is queued again (see JobQueue.requeue_stale())
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Job {self.id} - {self.status}"
+
+
+class UploadSession(models.Model):
+    """
+    A chunked upload in progress (see services/uploads.py). On S3 the parts
+    go straight into a multipart upload of the original file.
+    """
+    OPEN = 'open'
+    COMPLETED = 'completed'
+    ABORTED = 'aborted'
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (COMPLETED, 'Completed'),
+        (ABORTED, 'Aborted'),
+    ]
+
+    filename = models.CharField(max_length=255)
+    # Storage name the original will have once complete
+    name = models.CharField(max_length=255)
+    # S3 multipart upload id (blank on other storages)
+    multipart_id = models.CharField(max_length=255, blank=True)
+    # part number (as text) -> {"size", "etag"[, "name"]}
+    parts = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=OPEN
+    )
+
+    # CSV is parsed as the parts arrive, in order: parts 1..parsed_parts
+    # are done except for their last, incomplete line (tail)
+    parsed_parts = models.IntegerField(default=0)
+    parsed_bytes = models.BigIntegerField(default=0)
+    columns = models.JSONField(null=True, blank=True)
+    tail = models.BinaryField(default=b'')
+    # Storage names of the parsed rows, one Parquet file per part
+    segments = models.JSONField(default=list)
+    # Pickled ProfileAccumulator of the parsed rows
+    accumulator = models.BinaryField(null=True, blank=True)
+
+    document = models.ForeignKey(
+        UploadedDocument,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} - {self.filename} ({self.status})"
@@ -1,8 +1,22 @@
 from rest_framework import serializers
-from .models import UploadedDocument
+from .models import Recipe, UploadedDocument
+from .services.transforms import TransformError, build_pipeline
 
 
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = UploadedDocument
         fields = '__all__'
+
+
+class RecipeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Recipe
+        fields = ['id', 'name', 'operations', 'created_at']
+
+    def validate_operations(self, value):
+        try:
+            build_pipeline(value)
+        except TransformError as e:
+            raise serializers.ValidationError(f"Invalid operations: {e}")
+        return value
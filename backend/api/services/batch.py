@@ -0,0 +1,177 @@
+# api/services/batch.py
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import metrics
+from .transforms import TransformError, build_transform
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_workers = None
+# Request threads share the pool: one of them starts or replaces it
+_pool_lock = threading.Lock()
+
+
+class BatchApply:
+    """
+    One operation spec (the same the Apply* views take) over many versions,
+    each stored as its own new version. A failing file doesn't stop the
+    others.
+
+    The files are spread over a pool of BATCH_WORKERS processes, one file
+    per task, when there is enough work to pay for starting them (seconds):
+    versions are computed now (not lazy) and the files hold at least
+    BATCH_PARALLEL_MIN_BYTES together. Otherwise they run one after the
+    other in the request.
+    """
+
+    @staticmethod
+    def run(document_ids: list, spec: dict, mode: str = None) -> dict:
+        """
+        Returns {document_id: result} in the order given, where result is
+        {"status": "ok", "new_file_id": ..., "seconds": ...} or
+        {"status": "failed", "error": ..., "seconds": ...}.
+        Raises TransformError for an invalid spec, before any file is read.
+        """
+        # Checked once here (unknown op, unsafe regex, bad recipe); the
+        # workers compile the pattern / plan once each and keep it cached
+        build_transform(spec)
+
+        ids = list(dict.fromkeys(document_ids))
+        results = {}
+        with metrics.span('batch'):
+            pool = None
+            if _worth_a_pool(ids, mode):
+                pool = _get_pool(settings.BATCH_WORKERS)
+
+            if pool is None:
+                for document_id in ids:
+                    results[document_id] = _apply_one(document_id, spec, mode)
+            else:
+                futures = {
+                    document_id: pool.submit(
+                        _apply_one, document_id, spec, mode
+                    )
+                    for document_id in ids
+                }
+                for document_id, future in futures.items():
+                    try:
+                        results[document_id] = future.result()
+                    except BrokenProcessPool:
+                        # A worker died (e.g. out of memory): the pool can't
+                        # be used again
+                        _discard_pool()
+                        results[document_id] = {
+                            "status": "failed",
+                            "error": "Worker process died",
+                            "seconds": None,
+                        }
+        return results
+
+
+def _worth_a_pool(document_ids, mode) -> bool:
+    from ..models import UploadedDocument
+    from .store import DocumentStore
+
+    if settings.BATCH_WORKERS <= 1 or len(document_ids) < 2:
+        return False
+    if mode == 'lazy' or (mode is None and settings.LAZY_VERSIONS):
+        # Only the operation and a preview are stored: milliseconds each
+        return False
+
+    size = 0
+    for document in UploadedDocument.objects.filter(id__in=document_ids):
+        base, _ = DocumentStore.resolve(document)
+        if base.working_file or base.file:
+            size += DocumentStore.stored_size(base)
+        if size >= settings.BATCH_PARALLEL_MIN_BYTES:
+            return True
+    return False
+
+
+def _apply_one(document_id, spec, mode):
+    """Runs in the pool workers (or inline): one file, never raises"""
+    # Imported here: spawned workers import this module before
+    # _init_worker() has set Django up, and these need the models
+    from ..models import UploadedDocument
+    from .engine import TransformEngine
+    from .profile import profile_columns
+    from .store import UnsupportedFileType
+
+    started = time.perf_counter()
+    try:
+        document = UploadedDocument.objects.filter(id=document_id).first()
+        if document is None:
+            raise TransformError(f"File {document_id} not found")
+
+        # Same early check as ApplyRegexView, per file
+        column = spec.get('column') if spec.get('op') == 'regex' else None
+        columns = profile_columns(document.profile)
+        if column and columns and column not in columns:
+            raise TransformError(f"Column '{column}' not found in file")
+
+        new_document, _ = TransformEngine.apply(document, spec, mode=mode)
+    except (UnsupportedFileType, TransformError) as e:
+        error = str(e)
+    except Exception as e:
+        logger.exception("Batch apply failed on file %s", document_id)
+        error = str(e)
+    else:
+        return {
+            "status": "ok",
+            "new_file_id": new_document.id,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+    return {
+        "status": "failed",
+        "error": error,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # The files are what runs in parallel here: no nested regex pools
+    settings.REGEX_WORKERS = 1
+
+
+def _get_pool(max_workers):
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+                _pool = None
+            try:
+                # Fresh interpreters: forked workers would share the
+                # parent's database connections and S3 clients
+                _pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+                _pool_workers = max_workers
+            except (OSError, NotImplementedError):
+                # e.g. serverless runtimes without /dev/shm: stay
+                # single-process
+                return None
+        return _pool
+
+
+def _discard_pool():
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+        _pool_workers = None
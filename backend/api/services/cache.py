@@ -0,0 +1,128 @@
+# api/services/cache.py
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+
+from .dtypes import compact_frame
+
+
+class FrameCache:
+    """
+    In-process LRU cache of parsed DataFrames keyed by frame_key(document),
+    bounded by an approximate memory budget in bytes.
+
+    If a shared Django cache alias is configured, the Parquet working copy
+    bytes are also stored there so other workers can skip the S3 download.
+    """
+
+    def __init__(self, max_bytes: int, shared_alias: str = None):
+        self.max_bytes = max_bytes
+        self.shared_alias = shared_alias
+        self._frames = OrderedDict()  # key -> (df, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._frames
+
+    def get(self, key, copy: bool = True):
+        """
+        copy=False returns the cached frame itself, which the caller must
+        treat as read-only.
+        """
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                # Callers mutate their frame, never hand out the cached one
+                return entry[0].copy() if copy else entry[0]
+
+        df = self._get_shared(key)
+        with self._lock:
+            # Counted under the lock: requests run on several threads
+            if df is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        self._put_local(key, df)
+        return df.copy() if copy else df
+
+    def put(self, key, df: pd.DataFrame, working_bytes: bytes = None):
+        self._put_local(key, df)
+        if self.shared_alias and working_bytes is not None:
+            caches[self.shared_alias].set(_shared_key(key), working_bytes)
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._frames.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+        if self.shared_alias:
+            caches[self.shared_alias].delete(_shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def _put_local(self, key, df):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._frames[key] = (df, nbytes)
+            self._bytes += nbytes
+
+            # Evict least recently used frames until we are within budget
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self._bytes -= evicted
+
+    def _get_shared(self, key):
+        if not self.shared_alias:
+            return None
+
+        payload = caches[self.shared_alias].get(_shared_key(key))
+        if payload is None:
+            return None
+        # Working copies are stored in plain dtypes, as in
+        # DocumentStore.load()
+        return compact_frame(pd.read_parquet(BytesIO(payload)))
+
+
+def frame_key(document):
+    """
+    Versions with a working copy are cached by content, so documents with
+    identical content share one entry; lazy versions by id
+    """
+    return document.content_hash or document.id
+
+
+def _shared_key(key):
+    return f"frame:{key}"
+
+
+frame_cache = FrameCache(
+    max_bytes=settings.FRAME_CACHE_MAX_BYTES,
+    shared_alias=settings.FRAME_CACHE_SHARED_ALIAS,
+)
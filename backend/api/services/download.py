@@ -0,0 +1,284 @@
+# api/services/download.py
+import io
+import re
+import tempfile
+import zlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from openpyxl import Workbook
+
+from .dtypes import logical_frame
+from .engine import TransformEngine, _output_schema
+from .store import (
+    CSV_CONTENT_TYPE, PARQUET_CONTENT_TYPE, XLSX_CONTENT_TYPE, DocumentStore,
+)
+
+# Size of the pieces stored files and conversions are streamed in
+CHUNK_BYTES = 1024 * 1024
+
+# format -> (extension, content type)
+FORMATS = {
+    'csv': ('.csv', CSV_CONTENT_TYPE),
+    'xlsx': ('.xlsx', XLSX_CONTENT_TYPE),
+    'parquet': ('.parquet', PARQUET_CONTENT_TYPE),
+}
+# XLSX and Parquet are compressed already
+COMPRESSIBLE = {'csv'}
+# Preferred first
+ENCODINGS = ('zstd', 'gzip')
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class DownloadError(ValueError):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class Download:
+    """
+    A file ready to be sent: either a stored object (size known, can serve
+    byte ranges and be redirected to) or a conversion streamed as it is
+    produced.
+    """
+
+    def __init__(self, filename, fmt, stored=None, chunks=None):
+        self.filename = filename
+        self.format = fmt
+        self.content_type = FORMATS[fmt][1]
+        self.stored = stored  # FieldFile
+        self._chunks = chunks
+        self.size = stored.size if stored else None
+
+    @property
+    def compressible(self):
+        return self.format in COMPRESSIBLE
+
+    def iter_bytes(self, start: int = 0, end: int = None):
+        """Body (or inclusive byte range of a stored file) in chunks"""
+        if self.stored is None:
+            yield from self._chunks
+            return
+
+        end = self.size - 1 if end is None else end
+        with DocumentStore.open_ranged(self.stored) as handle:
+            handle.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = handle.read(min(CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def redirect_url(self):
+        """Presigned S3 URL for large stored files, else None"""
+        if self.stored is None \
+                or self.size < settings.DOWNLOAD_REDIRECT_MIN_BYTES:
+            return None
+        return DocumentStore.presigned_url(
+            self.stored,
+            expire=settings.DOWNLOAD_URL_EXPIRY,
+            ResponseContentDisposition=(
+                f'attachment; filename="{self.filename}"'
+            ),
+            ResponseContentType=self.content_type,
+        )
+
+
+class DownloadService:
+    @staticmethod
+    def prepare(document, fmt: str = None) -> Download:
+        """
+        fmt: 'csv', 'xlsx', 'parquet' or None (the format of the original
+        upload). The document must be materialized.
+        """
+        name = document.display_name
+        stem, dot, extension = name.rpartition('.')
+        if not dot:
+            stem, extension = name, ''
+
+        if fmt is None:
+            fmt = 'csv' if extension.lower() == 'csv' else 'xlsx'
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise DownloadError(
+                f"Unknown format '{fmt}', use one of {sorted(FORMATS)}"
+            )
+        filename = stem + FORMATS[fmt][0]
+
+        # Original uploads and working copies are served as stored (but not
+        # a workbook for a version of another sheet than the first, or a
+        # delta's columns without its base)
+        if document.file and not document.sheet and \
+                document.file.name.lower().endswith(FORMATS[fmt][0]):
+            return Download(filename, fmt, stored=document.file)
+        if fmt == 'parquet' and document.working_file \
+                and document.delta_base_id is None:
+            return Download(filename, fmt, stored=document.working_file)
+
+        converters = {
+            'csv': _iter_csv,
+            'xlsx': _iter_xlsx,
+            'parquet': _iter_parquet,
+        }
+        return Download(filename, fmt, chunks=converters[fmt](document))
+
+    @staticmethod
+    def negotiate_encoding(download, accept_encoding: str):
+        """Content-Encoding to apply for an Accept-Encoding header, or None"""
+        if not download.compressible or not accept_encoding:
+            return None
+
+        accepted = {}
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            quality = 1.0
+            match = re.search(r"q=([0-9.]+)", params)
+            if match:
+                quality = float(match.group(1))
+            accepted[coding.strip().lower()] = quality
+
+        for coding in ENCODINGS:
+            if accepted.get(coding, accepted.get('*', 0)) > 0:
+                return coding
+        return None
+
+    @staticmethod
+    def encode(chunks, encoding: str):
+        """Compress a stream of chunks on the fly"""
+        if encoding == 'gzip':
+            # wbits=31: gzip container
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+            return
+
+        # zstd through Arrow's streaming codec
+        sink = _DrainSink()
+        stream = pa.CompressedOutputStream(
+            pa.PythonFile(sink, mode='w'), 'zstd'
+        )
+        for chunk in chunks:
+            stream.write(chunk)
+            stream.flush()
+            yield from sink.drain()
+        stream.close()
+        yield from sink.drain()
+
+    @staticmethod
+    def parse_range(header: str, size: int):
+        """
+        (start, end) inclusive for a single-range "bytes=" header, None to
+        send the whole file. Raises RangeNotSatisfiable.
+        """
+        if not header:
+            return None
+        match = _RANGE.match(header.strip())
+        if match is None or not any(match.groups()):
+            # Multiple ranges or other units: send everything
+            return None
+
+        first, last = match.groups()
+        if not first:
+            # Suffix: the last N bytes
+            length = int(last)
+            if length == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            raise RangeNotSatisfiable()
+        return start, end
+
+
+class _DrainSink(io.RawIOBase):
+    """Write-only sink whose content is handed out as it arrives"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return [chunk for chunk in chunks if chunk]
+
+
+def _iter_csv(document):
+    header = True
+    for batch in TransformEngine.iter_batches(document):
+        yield batch.to_csv(index=False, header=header).encode()
+        header = False
+
+    if header:
+        # No rows: still send the header line
+        yield TransformEngine.preview(document, 0) \
+            .to_csv(index=False).encode()
+
+
+def _iter_parquet(document):
+    sink = _DrainSink()
+    writer = None
+    schema = None
+    for batch in TransformEngine.iter_batches(document):
+        batch = logical_frame(batch)
+        if writer is None:
+            schema = _output_schema(batch, None)
+            writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        if len(batch):
+            writer.write_table(pa.Table.from_pandas(
+                batch, schema=schema, preserve_index=False
+            ), row_group_size=settings.WORKING_ROW_GROUP_ROWS)
+        yield from sink.drain()
+
+    if writer is None:
+        empty = logical_frame(TransformEngine.preview(document, 0))
+        schema = _output_schema(empty, None)
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        writer.write_table(schema.empty_table())
+    writer.close()
+    yield from sink.drain()
+
+
+def _iter_xlsx(document):
+    # XLSX is a zip, so it can only be sent once complete; rows are written
+    # to disk as they come so memory stays bounded
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = False
+    for batch in TransformEngine.iter_batches(document):
+        if not header:
+            sheet.append([str(column) for column in batch.columns])
+            header = True
+        values = batch.astype(object).where(batch.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            sheet.append(row)
+
+    if not header:
+        sheet.append([str(column) for column in
+                      TransformEngine.preview(document, 0).columns])
+
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
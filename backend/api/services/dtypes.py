@@ -0,0 +1,129 @@
+# api/services/dtypes.py
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+# Rows looked at to rule out text columns with mostly distinct values
+# (ids, emails) before factorizing the whole column
+CATEGORY_SAMPLE_ROWS = 10_000
+
+_NARROW_INTS = (np.int8, np.int16, np.int32)
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The same values in smaller dtypes: integers in the narrowest int type
+    holding them, text columns with few distinct values as categoricals
+    (stored once per value instead of once per row). Floats are left alone,
+    float32 would change the values. Returns df itself if nothing changes.
+    """
+    if not settings.COMPACT_DTYPES:
+        return df
+
+    compacted = {}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series, pd.DataFrame):
+            continue  # Duplicate column names
+        values = _compact_series(series)
+        if values is not None:
+            compacted[col] = values
+
+    if not compacted:
+        return df
+    out = df.copy(deep=False)
+    for col, values in compacted.items():
+        out[col] = values
+    return out
+
+
+def widen_columns(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """
+    df with the compacted ones among columns back in int64 / plain values,
+    for code that relies on the usual dtypes (e.g. int8 * int8 overflows).
+    Returns df itself if there are none.
+    """
+    widened = {}
+    for col in columns:
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if isinstance(series, pd.DataFrame):
+            continue
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            widened[col] = series.astype(dtype.categories.dtype)
+        elif _is_narrow_int(dtype):
+            widened[col] = series.astype(np.int64)
+
+    if not widened:
+        return df
+    out = df.copy(deep=False)
+    for col, values in widened.items():
+        out[col] = values
+    return out
+
+
+def logical_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    df in the dtypes it has without compaction: what gets stored and
+    downloaded, so the schema doesn't depend on how a version was computed
+    """
+    return widen_columns(df, df.columns)
+
+
+def mentioned_columns(df: pd.DataFrame, text: str) -> list:
+    """Columns whose name appears in an expression (may over-report)"""
+    return [col for col in df.columns if str(col) in text]
+
+
+def widen_array(values: np.ndarray) -> np.ndarray:
+    return values.astype(np.int64) if _is_narrow_int(values.dtype) \
+        else values
+
+
+def logical_dtype(dtype) -> str:
+    """The dtype a column has without compaction, e.g. for the profile"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if _is_narrow_int(dtype):
+        dtype = np.dtype(np.int64)
+    return str(dtype)
+
+
+def _compact_series(series: pd.Series):
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind == 'i' \
+            and dtype.itemsize > 1:
+        if not len(series):
+            return None
+        low, high = series.min(), series.max()
+        for candidate in _NARROW_INTS:
+            if candidate().itemsize >= dtype.itemsize:
+                return None
+            info = np.iinfo(candidate)
+            if info.min <= low and high <= info.max:
+                return series.astype(candidate)
+        return None
+
+    if dtype != object or not len(series):
+        return None
+    limit = len(series) * settings.CATEGORY_MAX_RATIO
+    sample = series.iloc[:CATEGORY_SAMPLE_ROWS]
+    if sample.nunique() > len(sample) * settings.CATEGORY_MAX_RATIO:
+        return None
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return None
+    # Sorted categories: sorting the column still sorts the text
+    codes, categories = pd.factorize(series, sort=True)
+    if len(categories) > limit:
+        return None
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=categories),
+        index=series.index, name=series.name,
+    )
+
+
+def _is_narrow_int(dtype) -> bool:
+    return isinstance(dtype, np.dtype) and dtype.kind == 'i' \
+        and dtype.itemsize < 8
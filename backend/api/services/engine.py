@@ -0,0 +1,553 @@
+# api/services/engine.py
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+
+from . import metrics
+from .cache import frame_cache, frame_key
+from .dtypes import logical_frame
+from .filter_plan import FilterPlan, row_group_statistics
+from .profile import ProfileAccumulator, profile_frame
+from .store import DocumentStore
+from .transforms import (
+    PREVIEW_ROWS, VERSION_PREFIXES, apply_filter, build_transform,
+    fuse_operations, written_columns,
+)
+
+# Missing values turned into text by str(), e.g. in older versions
+_NULL_TEXT = ('nan', 'NaN')
+
+
+class TransformEngine:
+    """
+    Runs a row-local operation (see transforms.py) over a version and stores
+    the result as a new version, in one of three modes:
+
+    - 'lazy': only record parent + operation and compute the preview; the
+      full result is materialized on download or explicit checkpoint.
+    - 'memory': transform the whole frame in memory.
+    - 'chunked': read the working copy in row batches, transform each batch
+      and write it straight to S3 as a Parquet row group, so peak memory is
+      bounded by the chunk size rather than the file size.
+
+    Operations that only rewrite or add some columns (see written_columns())
+    store just those, as a delta on top of the version they were applied to.
+    """
+
+    @staticmethod
+    def apply(document, spec: dict, mode: str = None, progress=None):
+        """
+        mode: 'lazy', 'memory', 'chunked' or None (LAZY_VERSIONS setting,
+        then the file size decides)
+        progress: optional callable(rows_processed, total_rows)
+        Returns (new_document, preview_df).
+        """
+        op = spec.get('op')
+        transform = build_transform(spec)
+        filename = f"{VERSION_PREFIXES.get(op, 'v_')}{document.display_name}"
+        preview_rows = PREVIEW_ROWS.get(op, 50)
+
+        if mode is None and settings.LAZY_VERSIONS:
+            mode = 'lazy'
+
+        if mode == 'lazy':
+            # Computing the preview also surfaces invalid operations
+            preview = TransformEngine.preview(
+                document, preview_rows, [spec]
+            )
+            new_document = DocumentStore.create_lazy_version(
+                document, spec, filename
+            )
+            return new_document, preview
+
+        if TransformEngine.should_stream(document, mode):
+            writer = DocumentStore.open_version_writer(filename)
+            preview, base = TransformEngine._stream(
+                document, [spec], writer, preview_rows, progress
+            )
+            new_document = DocumentStore.create_version_from_writer(
+                writer, filename, base
+            )
+            return new_document, preview
+
+        source = DocumentStore.load(document)
+        total_rows = len(source)
+        names = list(source.columns)
+        before = source.copy(deep=False)  # math assigns into source
+        with metrics.span('transform') as stage:
+            df = transform(source)
+            stage.add(rows=total_rows)
+        columns = _delta_columns(document, [spec], names, df.columns)
+        if columns and _unchanged(before, df, columns):
+            # Same content as the parent: stored once, see save_working_copy
+            columns = None
+        new_document = DocumentStore.create_version(
+            df, filename, document if columns else None, columns
+        )
+
+        if progress:
+            progress(total_rows, total_rows)
+        return new_document, df.head(preview_rows)
+
+    @staticmethod
+    def materialize(document, progress=None):
+        """Compute and store the full working copy of a lazy version"""
+        if document.is_materialized:
+            return document
+
+        if not TransformEngine.should_stream(document):
+            base, specs = DocumentStore.resolve(document)
+            df = DocumentStore.load(document)
+            names = DocumentStore.working_schema(base).names \
+                if base.working_file else []
+            columns = _delta_columns(base, specs, names, df.columns)
+            if columns:
+                parent = frame_cache.get(frame_key(base), copy=False)
+                if parent is None:
+                    parent = DocumentStore.load(base)
+                if _unchanged(parent, df, columns):
+                    columns = None
+            DocumentStore.save_working_copy(
+                document, df, base if columns else None, columns
+            )
+            if progress:
+                progress(len(df), len(df))
+            return document
+
+        writer = DocumentStore.open_version_writer(document.display_name)
+        _, base = TransformEngine._stream(document, [], writer, 0, progress)
+        DocumentStore.save_working_copy_from_writer(document, writer, base)
+        return document
+
+    @staticmethod
+    def preview(document, rows: int, specs: list = ()) -> pd.DataFrame:
+        """
+        First `rows` rows of a version (+ further operation specs), reading
+        only as much as needed
+        """
+        previews = []
+        count = 0
+        for batch in TransformEngine.iter_batches(document, specs=specs):
+            previews.append(batch.head(rows - count))
+            count += len(previews[-1])
+            if count >= rows:
+                break
+
+        if not previews:
+            # Empty source: run it once anyway to get the columns/validate
+            return _apply_specs(DocumentStore.load(document), specs)
+        return pd.concat(previews)
+
+    @staticmethod
+    def profile(document) -> dict:
+        """
+        Column statistics of a version. Uploads are profiled when they are
+        parsed; other versions once, on first use.
+        """
+        if document.profile is not None:
+            return document.profile
+
+        # Same content as a version profiled already
+        match = DocumentStore.find_content(document.content_hash)
+        if match is not None and match.profile is not None:
+            profile = match.profile
+        elif TransformEngine.should_stream(document):
+            accumulator = ProfileAccumulator()
+            for batch in TransformEngine.iter_batches(document):
+                accumulator.update(batch)
+            profile = accumulator.result()
+        else:
+            profile = profile_frame(DocumentStore.load(document))
+
+        document.profile = profile
+        document.save(update_fields=['profile'])
+        return profile
+
+    @staticmethod
+    def should_stream(document, mode: str = None) -> bool:
+        if mode in ('chunked', 'memory'):
+            return mode == 'chunked'
+
+        base, _ = DocumentStore.resolve(document)
+
+        # Already parsed, nothing to gain from streaming
+        if frame_key(base) in frame_cache:
+            return False
+
+        return DocumentStore.stored_size(base) \
+            >= settings.STREAMING_THRESHOLD_BYTES
+
+    @staticmethod
+    def iter_batches(document, chunk_rows: int = None, specs: list = ()):
+        """
+        Yields the version, followed by `specs`, as consecutive DataFrame row
+        batches. For lazy versions the whole chain of operations is applied
+        to each batch. batch.attrs['source_rows'] is the number of stored
+        rows each batch was computed from.
+        Batches keep the row labels of the whole frame (the row numbers of
+        the stored version the chain starts from), so queries on the index
+        match as they do in memory.
+        """
+        chunk_rows = chunk_rows or settings.STREAMING_CHUNK_ROWS
+        base, chain = DocumentStore.resolve(document)
+        chain = fuse_operations(_flatten(chain + list(specs)))
+
+        # A leading filter is pushed down into the Parquet read
+        if chain and chain[0].get('op') == 'filter' \
+                and base.working_file and base.delta_base_id is None \
+                and frame_key(base) not in frame_cache:
+            batches = _iter_filtered_batches(
+                base, chain[0]['filter_query'], chunk_rows
+            )
+            chain = chain[1:]
+        else:
+            batches = _iter_base_batches(base, chunk_rows)
+
+        transforms = [build_transform(spec) for spec in chain]
+        for batch in batches:
+            source_rows = batch.attrs.get('source_rows', len(batch))
+            for transform in transforms:
+                batch = transform(batch)
+            batch.attrs['source_rows'] = source_rows
+            yield batch
+
+    @staticmethod
+    def _stream(document, specs, writer, preview_rows, progress):
+        """
+        Write the version (+ operation specs) into writer batch by batch,
+        only the written columns if it can be a delta.
+        Returns (the first preview_rows rows, delta base or None).
+        """
+        base, chain = DocumentStore.resolve(document)
+        source_schema = None
+        total_rows = None
+        if base.working_file:
+            with DocumentStore.open_working_copy(base) as handle:
+                metadata = pq.read_metadata(handle)
+            source_schema = metadata.schema.to_arrow_schema()
+            if base.delta_base_id is not None:
+                source_schema = DocumentStore.working_schema(base)
+            total_rows = metadata.num_rows
+        elif frame_key(base) in frame_cache:
+            total_rows = len(frame_cache.get(frame_key(base), copy=False))
+
+        parquet_writer = None
+        schema = None
+        columns = None
+        previews = []
+        preview_count = 0
+        rows_processed = 0
+
+        try:
+            with metrics.span('stream') as stage:
+                for out in TransformEngine.iter_batches(document, specs=specs):
+                    # attrs would end up in the Parquet metadata, and identical
+                    # content must give identical bytes
+                    rows_processed += out.attrs.pop('source_rows')
+                    # Cached batches are compact: store the plain dtypes
+                    out = logical_frame(out)
+
+                    if parquet_writer is None:
+                        columns = _delta_columns(
+                            base, chain + list(specs),
+                            source_schema.names if source_schema else [],
+                            out.columns,
+                        )
+                        schema = _output_schema(
+                            out[columns] if columns else out, source_schema
+                        )
+                        parquet_writer = pq.ParquetWriter(
+                            writer, schema, compression='zstd'
+                        )
+
+                    stored = out[columns] if columns else out
+                    writer.digest.update(stored)
+                    if len(out):
+                        parquet_writer.write_table(pa.Table.from_pandas(
+                            stored, schema=schema, preserve_index=False,
+                        ), row_group_size=settings.WORKING_ROW_GROUP_ROWS)
+
+                    if preview_count < preview_rows:
+                        previews.append(out.head(preview_rows - preview_count))
+                        preview_count += len(previews[-1])
+
+                    if progress:
+                        progress(rows_processed, total_rows)
+
+                if parquet_writer is None:
+                    # Empty source: still produce a valid (empty) version
+                    empty = logical_frame(
+                        _apply_specs(DocumentStore.load(document), specs)
+                    )
+                    schema = _output_schema(empty, source_schema)
+                    parquet_writer = pq.ParquetWriter(
+                        writer, schema, compression='zstd'
+                    )
+                    parquet_writer.write_table(schema.empty_table())
+                    writer.digest.update(empty)
+                    previews.append(empty)
+
+                parquet_writer.close()
+                stage.add(rows=rows_processed)
+        except Exception:
+            writer.abort()
+            raise
+
+        preview = pd.concat(previews) if previews else None
+        return preview, base if columns else None
+
+
+def preview_records(df: pd.DataFrame) -> list:
+    """JSON-safe list of row dicts for a (small) preview frame"""
+    with metrics.span('serialize'):
+        names = list(df.columns)
+        return [
+            dict(zip(names, row)) for row in zip(*_json_columns(df))
+        ]
+
+
+def preview_columns(df: pd.DataFrame) -> dict:
+    """
+    The same preview column by column: the names once instead of once per
+    row, {"columns": [...], "values": [[first column], ...]}
+    """
+    with metrics.span('serialize'):
+        return {
+            'columns': list(df.columns),
+            'values': _json_columns(df),
+        }
+
+
+def _json_columns(df: pd.DataFrame) -> list:
+    """
+    One list of JSON-safe values per column, with None for NaN, NaT, +-inf
+    and the text 'nan'. Callers slice first: this converts every cell.
+    """
+    columns = []
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        kind = series.dtype.kind if isinstance(series.dtype, np.dtype) \
+            else None
+        if kind in ('i', 'u', 'b'):
+            columns.append(series.to_numpy().tolist())
+            continue
+        if kind == 'f':
+            values = series.to_numpy()
+            cells = values.tolist()
+            for index in np.flatnonzero(~np.isfinite(values)).tolist():
+                cells[index] = None
+            columns.append(cells)
+            continue
+
+        missing = series.isna().to_numpy()
+        cells = series.to_numpy(dtype=object).tolist()
+        for index, value in enumerate(cells):
+            if missing[index] or value in _NULL_TEXT or (
+                isinstance(value, float) and not math.isfinite(value)
+            ):
+                cells[index] = None
+        columns.append(cells)
+    return columns
+
+
+def _delta_columns(parent, specs, names, result_columns):
+    """
+    The columns to store when the result of `specs` over `parent` (columns
+    `names`) can be kept as a delta on top of it, else None
+    """
+    if not settings.DELTA_VERSIONS or not parent.working_file or not specs:
+        return None
+    columns = written_columns(_flatten(specs))
+    if columns is None or set(names) <= set(columns):
+        # Every column is rewritten anyway
+        return None
+    # Composing keeps parent's columns in place and appends the new ones
+    if list(result_columns) != \
+            names + [column for column in columns if column not in names]:
+        return None
+    if DocumentStore.delta_depth(parent) >= settings.DELTA_MAX_DEPTH:
+        return None
+    return columns
+
+
+def _unchanged(before, after, columns) -> bool:
+    """Whether a delta's columns are the same as before (a no-op edit)"""
+    if before is None:
+        return False
+    return all(
+        column in before and after[column].equals(before[column])
+        for column in columns
+    )
+
+
+def _apply_specs(df, specs):
+    for spec in specs:
+        df = build_transform(spec)(df)
+    return df
+
+
+def _flatten(specs):
+    # Recipes are spelled out so their filters can be fused and pushed down
+    flat = []
+    for spec in specs:
+        if spec.get('op') == 'recipe':
+            flat.extend(_flatten(spec.get('operations') or []))
+        else:
+            flat.append(spec)
+    return flat
+
+
+def _iter_filtered_batches(document, query, chunk_rows):
+    """
+    The rows of a materialized version matching a query() filter. Row
+    groups whose statistics rule out a match are skipped; for the others
+    only the filtered columns are read to find the matching rows, and the
+    full row group only if there are any.
+    """
+    plan = FilterPlan.compile(query)
+    skipped_rows = 0
+    offset = 0  # first row of the row group
+
+    with DocumentStore.open_working_copy(document) as handle:
+        parquet = pq.ParquetFile(handle, pre_buffer=True)
+        metadata = parquet.metadata
+        names = parquet.schema_arrow.names
+        columns = plan.columns_in(names)
+
+        for index in range(metadata.num_row_groups):
+            rows = metadata.row_group(index).num_rows
+            start, offset = offset, offset + rows
+            if not plan.may_match(row_group_statistics(metadata, index)):
+                skipped_rows += rows
+                continue
+
+            if columns is None or len(columns) == len(names):
+                # Needs every column (or something other than columns)
+                table = parquet.read_row_group(index)
+                matches = _query(_numbered(table, start), query)
+                if not len(matches):
+                    skipped_rows += rows
+                    continue
+            else:
+                keys = parquet.read_row_group(index, columns=columns)
+                labels = _query(_numbered(keys, start), query).index
+                if not len(labels):
+                    skipped_rows += rows
+                    continue
+                table = parquet.read_row_group(index) \
+                    .take(labels.to_numpy() - start)
+                matches = table.to_pandas().set_axis(labels)
+
+            # Row groups can be bigger than a batch (older working copies)
+            for start in range(0, len(matches), chunk_rows):
+                batch = matches.iloc[start:start + chunk_rows]
+                batch.attrs['source_rows'] = skipped_rows + (
+                    rows if start == 0 else 0
+                )
+                skipped_rows = 0
+                yield batch
+
+    if skipped_rows:
+        # Nothing matched in the last row groups: still report progress
+        batch = parquet.schema_arrow.empty_table().to_pandas()
+        batch.attrs['source_rows'] = skipped_rows
+        yield batch
+
+
+def _numbered(table, start) -> pd.DataFrame:
+    """Parquet rows as a frame labelled with their row numbers in the file"""
+    df = table.to_pandas()
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+def _query(df, query):
+    # Same evaluation (compact dtypes widened) and errors as the
+    # non-pushed-down path
+    return apply_filter(df, query)
+
+
+def _iter_base_batches(document, chunk_rows):
+    cached = frame_cache.get(frame_key(document), copy=False)
+    if cached is not None:
+        for start in range(0, len(cached), chunk_rows):
+            yield cached.iloc[start:start + chunk_rows].copy()
+        return
+
+    if document.delta_base_id is not None:
+        yield from _iter_delta_batches(document, chunk_rows)
+        return
+
+    if document.working_file:
+        with document.working_file.open('rb') as handle:
+            parquet = pq.ParquetFile(handle)
+            start = 0
+            for batch in parquet.iter_batches(batch_size=chunk_rows):
+                yield _numbered(batch, start)
+                start += batch.num_rows
+        return
+
+    if document.file and document.file.name.lower().endswith('.csv'):
+        # Documents uploaded before working copies existed
+        document.file.open()
+        yield from pd.read_csv(document.file, chunksize=chunk_rows)
+        return
+
+    # Excel can't be read incrementally by pandas; lazy versions whose
+    # cached data was evicted in the meantime are recomputed
+    yield DocumentStore.load(document)
+
+
+def _iter_delta_batches(document, chunk_rows):
+    """The base version's batches with the delta's columns composed in"""
+    with document.working_file.open('rb') as handle:
+        parquet = pq.ParquetFile(handle)
+        delta = parquet.iter_batches(batch_size=chunk_rows)
+        pending = parquet.schema_arrow.empty_table()
+        for batch in _iter_base_batches(document.delta_base, chunk_rows):
+            # Row batches of the two files needn't line up
+            while pending.num_rows < len(batch):
+                pending = pa.concat_tables([
+                    pending, pa.Table.from_batches([next(delta)])
+                ])
+            yield DocumentStore.compose(
+                batch, pending.slice(0, len(batch)).to_pandas()
+            )
+            pending = pending.slice(len(batch))
+
+
+def _output_schema(first_batch: pd.DataFrame, source_schema) -> pa.Schema:
+    """
+    The first batch decides the output schema. Object columns that happen to
+    be all null in that batch keep their source type, or become text, so
+    later batches still fit. Categoricals are written as their values:
+    every batch has its own categories.
+    """
+    inferred = pa.Schema.from_pandas(first_batch, preserve_index=False)
+    fields = []
+    for field in inferred:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(field.type.value_type)
+        if pa.types.is_null(field.type):
+            source_type = None
+            if source_schema is not None and field.name in source_schema.names:
+                source_type = source_schema.field(field.name).type
+
+            # Numbers only reach object dtype once a transform made them text
+            if source_type is None or _is_numeric(source_type):
+                source_type = pa.string()
+            field = field.with_type(source_type)
+        fields.append(field)
+    # Keep the pandas metadata so versions written here and by
+    # DataFrame.to_parquet() match byte for byte when the content does
+    return pa.schema(fields, metadata=inferred.metadata)
+
+
+def _is_numeric(arrow_type) -> bool:
+    return (pa.types.is_integer(arrow_type)
+            or pa.types.is_floating(arrow_type)
+            or pa.types.is_boolean(arrow_type))
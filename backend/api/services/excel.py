@@ -0,0 +1,157 @@
+# api/services/excel.py
+import zipfile
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+try:
+    import python_calamine
+except ImportError:  # optional, openpyxl's read-only mode is used instead
+    python_calamine = None
+
+# Rows the openpyxl reader turns into a DataFrame at a time
+EXCEL_BATCH_ROWS = 50_000
+
+
+class InvalidSheet(ValueError):
+    pass
+
+
+class ExcelReader:
+    """
+    Reads one worksheet of an Excel upload (the first unless named).
+
+    With python-calamine installed, pandas' calamine engine (Rust) parses
+    the sheet. Otherwise .xlsx rows are streamed with openpyxl's read-only
+    mode and converted to DataFrames EXCEL_BATCH_ROWS at a time, instead of
+    first building one Python list of every cell in the sheet as
+    pd.read_excel() does. Values come out as pd.read_excel() would give
+    them.
+    """
+
+    @staticmethod
+    def sheet_names(file_obj, filename: str) -> list:
+        """Worksheets in workbook order"""
+        try:
+            if filename.lower().endswith(('.xlsx', '.xlsm')):
+                # Only the workbook part: opening the workbook itself
+                # would parse every shared string first
+                return _xlsx_sheet_names(file_obj)
+            with pd.ExcelFile(file_obj, engine=_engine()) as book:
+                return list(book.sheet_names)
+        finally:
+            file_obj.seek(0)
+
+    @staticmethod
+    def pick_sheet(names: list, sheet: str = None) -> str:
+        """
+        Name of the requested sheet (a name or a 0-based position, default
+        the first). Raises InvalidSheet.
+        """
+        return _resolve(names, sheet)
+
+    @staticmethod
+    def read(file_obj, filename: str, sheet: str = None) -> pd.DataFrame:
+        if python_calamine is not None \
+                or not filename.lower().endswith('.xlsx'):
+            with pd.ExcelFile(file_obj, engine=_engine()) as book:
+                return book.parse(_resolve(book.sheet_names, sheet))
+
+        workbook = load_workbook(
+            file_obj, read_only=True, data_only=True, keep_links=False
+        )
+        try:
+            worksheet = workbook[_resolve(workbook.sheetnames, sheet)]
+            # Stored dimensions are often wrong, read to the last cell
+            worksheet.reset_dimensions()
+            return _read_rows(worksheet.iter_rows())
+        finally:
+            workbook.close()
+
+
+def _engine():
+    # None: pandas' default for the extension (openpyxl, xlrd)
+    return 'calamine' if python_calamine is not None else None
+
+
+def _xlsx_sheet_names(file_obj):
+    with zipfile.ZipFile(file_obj) as archive:
+        root = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    return [
+        element.get('name') for element in root.iter()
+        if element.tag.rpartition('}')[2] == 'sheet'
+    ]
+
+
+def _resolve(names, sheet):
+    if not names:
+        raise InvalidSheet("The workbook has no sheets")
+    if sheet is None or sheet == '':
+        return names[0]
+    if sheet in names:
+        return sheet
+    if str(sheet).isdigit() and int(sheet) < len(names):
+        return names[int(sheet)]
+    raise InvalidSheet(f"Sheet '{sheet}' not found, the workbook has "
+                       f"{names}")
+
+
+def _read_rows(rows) -> pd.DataFrame:
+    batches = []
+    columns = None
+    pending = []
+    blank = 0  # empty rows held back: trailing ones are dropped
+    for cells in rows:
+        row = [_convert_cell(cell) for cell in cells]
+        while row and row[-1] == '':
+            row.pop()
+        if not row:
+            blank += 1
+            continue
+
+        pending.extend([] for _ in range(blank))
+        blank = 0
+        pending.append(row)
+        if len(pending) >= EXCEL_BATCH_ROWS:
+            batches.append(_parse(pending, columns))
+            columns = list(batches[-1].columns)
+            pending = []
+
+    if pending:
+        batches.append(_parse(pending, columns))
+    if not batches:
+        return pd.DataFrame()
+    if len(batches) == 1:
+        return batches[0]
+    return pd.concat(batches, ignore_index=True)
+
+
+def _parse(rows, columns):
+    # As pd.read_excel(): short rows are padded, the first row is the header
+    width = max(len(row) for row in rows)
+    if columns is not None:
+        width = max(width, len(columns))
+    rows = [row + [''] * (width - len(row)) for row in rows]
+
+    if columns is None:
+        return TextParser(rows, header=0).read()
+    names = columns + [f"Unnamed: {i}" for i in range(len(columns), width)]
+    return TextParser(rows, header=None, names=names).read()
+
+
+def _convert_cell(cell):
+    # Same conversions as pandas' openpyxl reader
+    if cell.value is None:
+        return ''
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
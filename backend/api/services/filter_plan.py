@@ -0,0 +1,194 @@
+# api/services/filter_plan.py
+import ast
+import re
+from functools import lru_cache
+
+_BACKTICKED = re.compile(r"`([^`]*)`")
+_PLACEHOLDER = re.compile(r"__col_(\d+)__")
+
+# Comparison of a column against a constant, as a test on the column's
+# (min, max) statistics: False means no row of the row group can match
+_RANGE_TESTS = {
+    ast.Eq: lambda low, high, value: low <= value <= high,
+    ast.NotEq: lambda low, high, value: not (low == high == value),
+    ast.Lt: lambda low, high, value: low < value,
+    ast.LtE: lambda low, high, value: low <= value,
+    ast.Gt: lambda low, high, value: high > value,
+    ast.GtE: lambda low, high, value: high >= value,
+}
+# "5 < col" is "col > 5"
+_MIRRORED = {
+    ast.Eq: ast.Eq, ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt, ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt, ast.GtE: ast.LtE,
+}
+
+
+class FilterPlan:
+    """
+    What a DataFrame.query() string needs from the file: the columns it
+    references, and a conservative test on row-group min/max statistics.
+    Queries Python can't parse get a plan that reads everything.
+    """
+
+    def __init__(self, columns=None, predicate=None):
+        self.columns = columns  # referenced names, None if unknown
+        self._predicate = predicate
+
+    @staticmethod
+    def compile(query: str) -> 'FilterPlan':
+        return _compile(query)
+
+    def columns_in(self, names) -> list:
+        """
+        The subset of `names` (in file order) the query needs, or None when
+        it references something that isn't a column (e.g. the index).
+        """
+        if self.columns is None or not self.columns <= set(names):
+            return None
+        return [name for name in names if name in self.columns]
+
+    def may_match(self, statistics: dict) -> bool:
+        """
+        statistics: column -> (min, max) for one row group; columns without
+        usable statistics are left out.
+        """
+        if self._predicate is None:
+            return True
+        try:
+            return _may_match(self._predicate, statistics)
+        except TypeError:
+            # e.g. text statistics against a number in the query
+            return True
+
+
+def row_group_statistics(metadata, index: int) -> dict:
+    """column -> (min, max) of one Parquet row group"""
+    row_group = metadata.row_group(index)
+    statistics = {}
+    for position in range(row_group.num_columns):
+        column = row_group.column(position)
+        stats = column.statistics
+        if stats is not None and stats.has_min_max:
+            statistics[column.path_in_schema] = (stats.min, stats.max)
+    return statistics
+
+
+def parse_query(query: str):
+    """
+    (Python expression tree of a query() string, backticked names in the
+    order their __col_<n>__ placeholders are numbered). Raises SyntaxError.
+    """
+    columns = []
+
+    def placeholder(match):
+        columns.append(match.group(1))
+        return f"__col_{len(columns) - 1}__"
+
+    tree = ast.parse(_BACKTICKED.sub(placeholder, query.strip()),
+                     mode='eval')
+    return tree, columns
+
+
+@lru_cache(maxsize=256)
+def _compile(query: str) -> FilterPlan:
+    try:
+        tree, columns = parse_query(query)
+    except SyntaxError:
+        return FilterPlan()
+
+    # '@variable' references and anything else we can't see through
+    if '@' in query:
+        return FilterPlan()
+
+    def name_of(identifier):
+        match = _PLACEHOLDER.fullmatch(identifier)
+        return columns[int(match.group(1))] if match else identifier
+
+    called = {
+        id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)
+    }
+    referenced = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if id(node) in called:
+                return FilterPlan()
+            node.id = name_of(node.id)
+            referenced.add(node.id)
+
+    return FilterPlan(frozenset(referenced), tree.body)
+
+
+def _may_match(node, statistics) -> bool:
+    if isinstance(node, ast.BoolOp):
+        results = [_may_match(value, statistics) for value in node.values]
+        return all(results) if isinstance(node.op, ast.And) else any(results)
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op,
+                                                  (ast.BitAnd, ast.BitOr)):
+        left = _may_match(node.left, statistics)
+        right = _may_match(node.right, statistics)
+        return (left and right) if isinstance(node.op, ast.BitAnd) \
+            else (left or right)
+
+    if isinstance(node, ast.Compare):
+        # a < b < c is (a < b) and (b < c)
+        operands = [node.left] + node.comparators
+        return all(
+            _compare_may_match(left, op, right, statistics)
+            for left, op, right in zip(operands, node.ops, operands[1:])
+        )
+
+    return True
+
+
+def _compare_may_match(left, op, right, statistics) -> bool:
+    left, right = _fold(left), _fold(right)
+    if isinstance(right, ast.Name) and isinstance(left, ast.Constant):
+        left, right = right, left
+        op = _MIRRORED.get(type(op), type(op))()
+
+    if not isinstance(left, ast.Name) or left.id not in statistics:
+        return True
+    low, high = statistics[left.id]
+
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if isinstance(op, ast.NotIn) \
+                or not isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+            return True
+        values = [item.value for item in right.elts
+                  if isinstance(item, ast.Constant)]
+        if len(values) != len(right.elts):
+            return True
+        return any(_in_range(low, high, value) for value in values)
+
+    test = _RANGE_TESTS.get(type(op))
+    if test is None or not isinstance(right, ast.Constant) \
+            or not _comparable(low, right.value):
+        return True
+    return test(low, high, right.value)
+
+
+def _fold(node):
+    # "-5" parses as USub(5)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) \
+            and isinstance(node.operand, ast.Constant) \
+            and _comparable(0, node.operand.value):
+        return ast.Constant(-node.operand.value)
+    return node
+
+
+def _in_range(low, high, value):
+    return not _comparable(low, value) or low <= value <= high
+
+
+def _comparable(stat, value) -> bool:
+    # bool is an int; strings only compare to strings
+    numbers = (int, float)
+    if isinstance(value, bool) or isinstance(stat, bool):
+        return isinstance(value, bool) and isinstance(stat, bool)
+    if isinstance(value, numbers):
+        return isinstance(stat, numbers)
+    if isinstance(value, str):
+        return isinstance(stat, str)
+    return False
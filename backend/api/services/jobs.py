@@ -0,0 +1,213 @@
+# api/services/jobs.py
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import Job
+from .engine import TransformEngine, preview_records
+from .transforms import build_transform
+
+logger = logging.getLogger(__name__)
+
+# Don't write progress to the database more often than this (seconds)
+PROGRESS_INTERVAL = 1.0
+
+# Job.operation of a job computing a lazy version's working copy
+MATERIALIZE = {'op': 'materialize'}
+
+
+class JobQueue:
+    """
+    Broker-free job queue: jobs are rows in the database and are claimed by
+    `manage.py run_jobs` worker processes. With JOB_EXECUTION='thread' the
+    web process runs each job in a background thread instead, for setups
+    that have no worker.
+    """
+
+    @staticmethod
+    def enqueue(document, operation: dict, mode: str = None) -> Job:
+        """Raises TransformError for an invalid operation, before queueing"""
+        build_transform(operation)
+        job = Job.objects.create(
+            document=document, operation=operation, mode=mode or ''
+        )
+
+        if settings.JOB_EXECUTION == 'thread':
+            JobQueue._start_thread(job.id)
+        return job
+
+    @staticmethod
+    def enqueue_materialize(document) -> Job:
+        """
+        Queue computing a lazy version (download, checkpoint), or return
+        the job already doing it
+        """
+        pending = Job.objects.filter(
+            document=document,
+            operation__op=MATERIALIZE['op'],
+            status__in=(Job.QUEUED, Job.RUNNING),
+        ).order_by('id').first()
+        if pending is not None:
+            return pending
+
+        job = Job.objects.create(
+            document=document, operation=dict(MATERIALIZE)
+        )
+        if settings.JOB_EXECUTION == 'thread':
+            JobQueue._start_thread(job.id)
+        return job
+
+    @staticmethod
+    def claim_next():
+        """Atomically take the oldest queued job, or None"""
+        JobQueue.requeue_stale()
+        queued = Job.objects.filter(status=Job.QUEUED).order_by('id')
+        for job_id in queued.values_list('id', flat=True)[:10]:
+            # Another worker may have claimed it in the meantime
+            job = JobQueue._claim(job_id)
+            if job:
+                return job
+        return None
+
+    @staticmethod
+    def requeue_stale() -> list:
+        """
+        Queue running jobs whose worker stopped sending heartbeats again,
+        or fail them after JOB_MAX_ATTEMPTS. Returns the requeued ids.
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=settings.JOB_STALE_SECONDS)
+        stale = Job.objects.filter(status=Job.RUNNING).filter(
+            Q(heartbeat_at__lt=cutoff)
+            | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        )
+
+        stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+            status=Job.FAILED,
+            error="The worker running this job stopped",
+            finished_at=now,
+        )
+        job_ids = list(stale.values_list('id', flat=True))
+        if job_ids:
+            # Filtered again: a heartbeat may have come in meanwhile
+            stale.filter(id__in=job_ids).update(
+                status=Job.QUEUED, rows_processed=0
+            )
+            logger.warning("Requeued stale jobs %s", job_ids)
+            if settings.JOB_EXECUTION == 'thread':
+                for job_id in job_ids:
+                    JobQueue._start_thread(job_id)
+        return job_ids
+
+    @staticmethod
+    def run(job: Job):
+        last_write = 0.0
+
+        def report(rows_processed, total_rows):
+            nonlocal last_write
+            job.rows_processed = rows_processed
+            job.total_rows = total_rows
+
+            now = time.monotonic()
+            if now - last_write < PROGRESS_INTERVAL:
+                return
+            last_write = now
+            Job.objects.filter(id=job.id).update(
+                rows_processed=rows_processed, total_rows=total_rows,
+                heartbeat_at=timezone.now(),
+            )
+
+        try:
+            with _heartbeat(job.id):
+                if job.operation == MATERIALIZE:
+                    new_document = TransformEngine.materialize(
+                        job.document, progress=report
+                    )
+                    preview = None
+                else:
+                    new_document, preview = TransformEngine.apply(
+                        job.document,
+                        job.operation,
+                        mode=_job_mode(job),
+                        progress=report,
+                    )
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.status = Job.FAILED
+            job.error = str(e)
+        else:
+            job.status = Job.SUCCEEDED
+            job.result = new_document
+            if preview is not None:
+                job.preview = preview_records(preview)
+
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+    @staticmethod
+    def _claim(job_id):
+        now = timezone.now()
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=now, heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        return Job.objects.get(id=job_id) if claimed else None
+
+    @staticmethod
+    def _start_thread(job_id):
+        threading.Thread(
+            target=JobQueue._run_in_thread, args=(job_id,), daemon=True
+        ).start()
+
+    @staticmethod
+    def _run_in_thread(job_id):
+        try:
+            job = JobQueue._claim(job_id)
+            if job:
+                JobQueue.run(job)
+        finally:
+            close_old_connections()
+
+
+def _job_mode(job):
+    if job.mode:
+        return job.mode
+    # The work is what the job is for: computed now, not recorded as a lazy
+    # version for a later request to compute
+    return 'chunked' if TransformEngine.should_stream(job.document) \
+        else 'memory'
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """
+    Mark the job alive every JOB_HEARTBEAT_SECONDS from a side thread: a
+    single in-memory transform can run for minutes without progress calls
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+                Job.objects.filter(id=job_id, status=Job.RUNNING).update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            # This thread's own connection
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
@@ -1,27 +1,58 @@
 # api/services/llm.py
-import openai
-import os
+import hashlib
 import json
+import logging
+import re
+import threading
+from concurrent.futures import Future
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from django.core.cache import caches
+
+from . import metrics
+from .llm_client import LLMClient
+from .profile import profile_columns
+
+logger = logging.getLogger(__name__)
+
+# Initialize the LLM client (pooled connections, deadlines, retries and a
+# concurrency cap, see llm_client.py and the LLM_* settings)
+client = LLMClient.from_settings()
+
+MODEL = "gpt-4-turbo"
+
+# Identical prompts over the same context (headers, sample rows, profile)
+# give identical answers at temperature 0, so completions are cached (see
+# CACHES['llm'] in settings) and concurrent identical requests share a
+# single upstream call.
+_inflight = {}
+_inflight_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0}
 
 
 class LLMService:
+    @staticmethod
+    def cache_stats() -> dict:
+        with _inflight_lock:
+            stats = dict(_stats)
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = round(stats["hits"] / lookups, 4) if lookups else None
+        return {**stats, "hit_rate": hit_rate}
+
     @staticmethod
     def generate_regex(
         natural_language_prompt: str,
         data_context: list = None,
+        profile: dict = None,
             ) -> dict:
 
         # Prepare Context
         context_str = ""
-        headers = []
-        if data_context and len(data_context) > 0:
-            context_str = (
-                f"Data Headers: {headers}\n"
-                f"Sample Data: {str(data_context)}\n"
-            )
+        headers = _headers(data_context, profile)
+        if headers:
+            context_str = f"Data Headers: {headers}\n"
+        if data_context:
+            context_str += f"Sample Data: {str(data_context)}\n"
+        context_str += _profile_summary(profile)
 
         # Update System Prompt to request JSON
         system_instruction = (
@@ -57,16 +88,9 @@ class LLMService:
         )
 
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": natural_language_prompt}
-                ],
-                temperature=0.0,  # Keep it deterministic
-            )
-
-            regex_pattern = response.choices[0].message.content.strip()
+            regex_pattern = _complete(
+                "regex", natural_language_prompt, system_instruction,
+            ).strip()
 
             # Safety cleanup: remove markdown code blocks if the LLM adds them
             if (
@@ -82,28 +106,29 @@ class LLMService:
             return json.loads(regex_pattern)
 
         except json.JSONDecodeError:
-            print(f"LLM failed to return JSON: {regex_pattern}")
+            logger.warning("LLM failed to return JSON: %s", regex_pattern)
             # Fallback if LLM creates bad JSON
             return {"regex": regex_pattern, "column": None}
 
-        except Exception as e:
-            print(f"LLM Error: {e}")
-            raise e
+        except Exception:
+            logger.exception("LLM regex generation failed")
+            raise
 
     @staticmethod
     def generate_pandas_filter(
         natural_language_prompt: str,
         data_context: list = None,
+        profile: dict = None,
             ) -> str:
         # Context is crucial here so LLM knows column names
         # (e.g., "Units Sold" vs "units_sold")
         context_str = ""
+        headers = _headers(data_context, profile)
+        if headers:
+            context_str = f"Available Columns: {headers}\n"
         if data_context:
-            headers = list(data_context[0].keys())
-            context_str = (
-                f"Available Columns: {headers}\n"
-                f"Sample Row: {str(data_context[0])}"
-                )
+            context_str += f"Sample Row: {str(data_context[0])}\n"
+        context_str += _profile_summary(profile)
 
         system_instruction = (
             "You are a Pandas Dataframe Expert. Translate the user's natural "
@@ -125,37 +150,30 @@ class LLMService:
             if not client:
                 return "Units_Sold > 5000"  # Mock for testing
 
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": natural_language_prompt}
-                ],
-                temperature=0.0,
+            return _complete(
+                "filter", natural_language_prompt, system_instruction,
             )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Filter Error: {e}")
+        except Exception:
+            logger.exception("LLM filter generation failed")
             return ""
 
     @staticmethod
     def generate_math_operation(
         natural_language_prompt: str,
         data_context: list = None,
+        profile: dict = None,
             ) -> str:
 
         context_str = ""
-        cols_with_spaces = []
+        headers = _headers(data_context, profile)
+        # Dynamic list of columns requiring backticks
+        cols_with_spaces = [h for h in headers if " " in h]
 
+        if headers:
+            context_str = f"Available Columns: {headers}\n"
         if data_context:
-            headers = list(data_context[0].keys())
-            # Dynamic list of columns requiring backticks
-            cols_with_spaces = [h for h in headers if " " in h]
-
-            context_str = (
-                f"Available Columns: {headers}\n"
-                f"Sample Row: {str(data_context[0])}"
-                )
+            context_str += f"Sample Row: {str(data_context[0])}\n"
+        context_str += _profile_summary(profile)
 
         system_instruction = (
             "You are a Pandas Dataframe Expert. Convert the user's natural "
@@ -169,6 +187,7 @@ class LLMService:
             "2. The following columns HAVE spaces and "
             f"MUST be backticked: {cols_with_spaces}\n"
             "3. The format must be: NewColumnName = Expression\n"
+            "4. For several new columns, write one assignment per line.\n"
             "Example: 'Calculate Profit as Revenue minus Cost'\n"
             "Output: 'Profit = Revenue - Cost'\n"
             "Example: 'Calculate Total as Price times Quantity'\n"
@@ -177,21 +196,118 @@ class LLMService:
         )
 
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
+            content = _complete(
+                "math", natural_language_prompt, system_instruction,
+            ).strip()
+
+            if content.startswith("```"):
+                content = content.replace("```python", "").replace("```", "")
+            return content.strip()
+
+        except Exception:
+            logger.exception("LLM math generation failed")
+            return ""
+
+
+def _complete(kind, natural_language_prompt, system_instruction):
+    """
+    Chat completion for one generator, served from the LLM cache when the
+    same (normalized) prompt was already answered with the same context.
+    """
+    key = _cache_key(kind, natural_language_prompt, system_instruction)
+    cache = caches["llm"]
+
+    cached = _cache_get(cache, key)
+    if cached is not None:
+        _count("hits")
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+        # Counted under the lock: requests run on several threads
+        _stats["misses" if owner else "coalesced"] += 1
+
+    if not owner:
+        # Someone is already asking the exact same question
+        return future.result()
+
+    try:
+        # Upstream calls only; the span also gets the token counts
+        with metrics.span(f"llm.{kind}"):
+            content = client.complete(
+                model=MODEL,
                 messages=[
                     {"role": "system", "content": system_instruction},
                     {"role": "user", "content": natural_language_prompt}
                 ],
-                temperature=0.0,
+                temperature=0.0,  # Keep it deterministic
             )
+        _cache_set(cache, key, content)
+        future.set_result(content)
+        return content
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
 
-            content = response.choices[0].message.content.strip()
 
-            if content.startswith("```"):
-                content = content.replace("```python", "").replace("```", "")
-            return content.strip()
+def _count(result):
+    with _inflight_lock:
+        _stats[result] += 1
 
-        except Exception as e:
-            print(f"Math Gen Error: {e}")
-            return ""
+
+def _headers(data_context, profile):
+    # The stored profile knows every column, even ones the sample lacks
+    if profile:
+        return profile_columns(profile)
+    return list(data_context[0].keys()) if data_context else []
+
+
+def _profile_summary(profile):
+    """One line per column: type, nulls, range and most common values"""
+    if not profile:
+        return ""
+
+    lines = [f"Rows: {profile['rows']}"]
+    for column in profile['columns']:
+        line = f"- {column['name']} ({column['dtype']}"
+        if column['nulls']:
+            line += f", {column['nulls']} empty"
+        if column['min'] is not None:
+            line += f", {column['min']} to {column['max']}"
+        line += ")"
+        if column['top']:
+            values = [str(value)[:40] for value, _ in column['top']]
+            line += f" e.g. {values}"
+        lines.append(line)
+    return "Column Profile:\n" + "\n".join(lines) + "\n"
+
+
+def _cache_key(kind, natural_language_prompt, system_instruction):
+    # The instruction carries the headers, sample rows and profile the
+    # model sees: another sample can mean another answer
+    prompt = re.sub(r"\s+", " ", (natural_language_prompt or "").strip())
+    raw = json.dumps([MODEL, kind, prompt, system_instruction])
+    return f"llm:{hashlib.sha256(raw.encode()).hexdigest()}"
+
+
+def _cache_get(cache, key):
+    try:
+        return cache.get(key)
+    except Exception:
+        logger.warning("LLM cache read failed", exc_info=True)
+        return None
+
+
+def _cache_set(cache, key, content):
+    try:
+        cache.set(key, content)
+    except Exception:
+        # e.g. read-only filesystem; the answer is still returned
+        logger.warning("LLM cache write failed", exc_info=True)
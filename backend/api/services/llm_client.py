@@ -0,0 +1,193 @@
+# api/services/llm_client.py
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import openai
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class OpenAITransport:
+    """
+    Default transport: the OpenAI SDK. One client is kept for the life of
+    the process (and one async client per event loop) so HTTP connections
+    are pooled.
+    Retries are done by LLMClient, so the SDK's own are disabled.
+
+    Point LLM_BASE_URL at `manage.py llm_stub` to run without OpenAI.
+    """
+
+    # Errors worth retrying (timeouts, dropped connections, 429, 5xx)
+    retryable = (
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+    def __init__(self, api_key=None, base_url=None):
+        self._kwargs = {
+            "api_key": api_key or os.environ.get("OPENAI_API_KEY"),
+            "base_url": base_url,
+            "max_retries": 0,
+        }
+        self._client = None
+        # An async client's connections belong to one event loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def complete(self, request: dict, timeout: float) -> str:
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(**self._kwargs)
+        response = self._client.chat.completions.create(
+            **request, timeout=timeout
+        )
+        _record_usage(response)
+        return response.choices[0].message.content
+
+    async def acomplete(self, request: dict, timeout: float) -> str:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(**self._kwargs)
+            self._async_clients[loop] = client
+        response = await client.chat.completions.create(
+            **request, timeout=timeout
+        )
+        _record_usage(response)
+        return response.choices[0].message.content
+
+
+class LLMClient:
+    """
+    Chat completions with a per-call deadline, jittered exponential
+    retries and a cap on concurrent upstream calls, over a pluggable
+    transport (any object with complete()/acomplete() and `retryable`).
+    complete() blocks the calling thread; acomplete() is for ASGI views
+    and scripts running many calls on one event loop, and is capped per
+    loop.
+    """
+
+    def __init__(self, transport, timeout: float, deadline: float,
+                 max_retries: int, max_concurrency: int,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0):
+        self.transport = transport
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        # asyncio semaphores belong to one event loop
+        self._async_semaphores = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_settings(cls):
+        transport_class = import_string(settings.LLM_TRANSPORT)
+        return cls(
+            transport=transport_class(base_url=settings.LLM_BASE_URL),
+            timeout=settings.LLM_TIMEOUT,
+            deadline=settings.LLM_DEADLINE,
+            max_retries=settings.LLM_MAX_RETRIES,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        )
+
+    def complete(self, **request) -> str:
+        deadline = time.monotonic() + self.deadline
+
+        if not self._semaphore.acquire(timeout=self._remaining(deadline)):
+            raise LLMTimeout("Too many concurrent LLM requests")
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return self.transport.complete(
+                        request, timeout=self._attempt_timeout(deadline)
+                    )
+                except self.transport.retryable as e:
+                    delay = self._backoff(attempt, deadline, e)
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            self._semaphore.release()
+
+    async def acomplete(self, **request) -> str:
+        deadline = time.monotonic() + self.deadline
+        semaphore = self._async_semaphore()
+
+        try:
+            await asyncio.wait_for(
+                semaphore.acquire(), timeout=self._remaining(deadline)
+            )
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Too many concurrent LLM requests")
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return await self.transport.acomplete(
+                        request, timeout=self._attempt_timeout(deadline)
+                    )
+                except self.transport.retryable as e:
+                    delay = self._backoff(attempt, deadline, e)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        finally:
+            semaphore.release()
+
+    def _async_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._async_semaphores[loop] = semaphore
+        return semaphore
+
+    def _remaining(self, deadline):
+        return max(deadline - time.monotonic(), 0)
+
+    def _attempt_timeout(self, deadline):
+        remaining = self._remaining(deadline)
+        if remaining <= 0:
+            raise LLMTimeout("LLM deadline exceeded")
+        return min(self.timeout, remaining)
+
+    def _backoff(self, attempt, deadline, error):
+        """Full-jitter delay before the next attempt, or re-raise"""
+        if attempt >= self.max_retries:
+            raise error
+
+        delay = random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        )
+        # Don't start an attempt we can't finish in time
+        if delay >= self._remaining(deadline):
+            raise LLMTimeout("LLM deadline exceeded") from error
+        return delay
+
+
+def _record_usage(response):
+    # Token counts go to the current span (llm.<kind>, see _complete() in
+    # llm.py)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        metrics.add(
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
+        )
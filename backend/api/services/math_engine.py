@@ -0,0 +1,335 @@
+# api/services/math_engine.py
+import ast
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .dtypes import mentioned_columns, widen_array, widen_columns
+
+try:
+    import numexpr
+except ImportError:  # optional, NumPy kernels are used instead
+    numexpr = None
+
+# Rows evaluated at a time by the NumPy kernels, so the temporaries of a
+# long expression stay small (smaller frames skip numexpr too)
+MATH_BLOCK_ROWS = 65_536
+
+# Same functions pandas.eval() accepts; numexpr and NumPy share the names
+FUNCTIONS = {
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2',
+    'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh',
+    'exp', 'expm1', 'log', 'log1p', 'log10', 'sqrt', 'abs',
+}
+
+_BINARY = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+_UNARY = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+_COMPARE = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+# numexpr has no floor division and its integer modulo by zero differs
+_NUMEXPR_UNSUPPORTED = (ast.FloorDiv, ast.Mod)
+
+_BACKTICKED = re.compile(r"`([^`]*)`")
+_PLACEHOLDER = re.compile(r"__col_(\d+)__")
+# After compiling, column references are named _col<i> where i indexes
+# Statement.names (valid numexpr identifiers, whatever the column is called)
+_VARIABLE = re.compile(r"\b_col(\d+)\b")
+
+
+class MathError(ValueError):
+    pass
+
+
+class MathEngine:
+    """
+    Evaluates the LLM's math expressions, e.g.
+    "`Total` = `Unit Price` * `Quantity`; Tax = `Total` * 0.2".
+
+    The expression is parsed once (and cached), its column references are
+    checked against the frame, and each assignment is evaluated over the
+    column arrays with numexpr when installed, otherwise with NumPy kernels
+    in row blocks. Statements using anything else (strings, text columns,
+    other functions) go through pandas' own eval.
+    """
+
+    @staticmethod
+    def compile(expression: str) -> 'MathProgram':
+        return _compile(expression)
+
+    @staticmethod
+    def validate(expression: str, columns) -> None:
+        """Raises MathError for syntax errors or unknown columns"""
+        MathEngine.compile(expression).check_names(columns)
+
+    @staticmethod
+    def apply(df: pd.DataFrame, expression: str) -> pd.DataFrame:
+        return MathEngine.compile(expression).run(df)
+
+
+class Statement:
+    def __init__(self, target, node, names):
+        self.target = target  # None for a bare expression
+        self.node = node
+        self.names = names  # referenced column names, in order
+        self.vectorizable = _is_vectorizable(node)
+
+    def source(self):
+        """pandas.eval() text of the right-hand side"""
+        return _VARIABLE.sub(
+            lambda m: f"`{self.names[int(m.group(1))]}`",
+            ast.unparse(self.node),
+        )
+
+
+class MathProgram:
+    def __init__(self, statements, legacy=None):
+        self.statements = statements
+        # Expressions Python can't parse keep the old pandas behaviour
+        self.legacy = legacy
+
+    def check_names(self, columns):
+        if self.legacy is not None:
+            return
+        known = set(columns)
+        for statement in self.statements:
+            for name in statement.names:
+                if name not in known:
+                    raise MathError(f"Unknown column '{name}'")
+            if statement.target is not None:
+                known.add(statement.target)
+
+    def run(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.legacy is not None:
+            return _legacy_eval(df, self.legacy)
+
+        self.check_names(df.columns)
+        for statement in self.statements:
+            values = None
+            if statement.vectorizable:
+                values = _evaluate(statement, df)
+            if values is None:
+                # Compact dtypes would overflow (int8) or refuse to
+                # compute (categoricals)
+                values = widen_columns(df, statement.names).eval(
+                    statement.source(), engine='python'
+                )
+
+            if statement.target is None:
+                # Fallback if no '=' found (unlikely given prompts)
+                return pd.Series(values, index=df.index)
+            df[statement.target] = _round(values, df.index)
+        return df
+
+
+@lru_cache(maxsize=256)
+def _compile(expression: str) -> MathProgram:
+    if not expression or not expression.strip():
+        raise MathError("Empty expression")
+
+    # Backticked names aren't Python: swap them for placeholders
+    columns = []
+
+    def placeholder(match):
+        columns.append(match.group(1))
+        return f"__col_{len(columns) - 1}__"
+
+    source = _BACKTICKED.sub(placeholder, expression.strip())
+
+    try:
+        module = ast.parse(source, mode='exec')
+    except SyntaxError:
+        # e.g. "New Col = Price * 2": let pandas have a go as before
+        return MathProgram([], legacy=expression)
+
+    def name_of(identifier):
+        match = _PLACEHOLDER.fullmatch(identifier)
+        return columns[int(match.group(1))] if match else identifier
+
+    statements = []
+    for node in module.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name):
+            target = name_of(node.targets[0].id)
+        elif isinstance(node, ast.Expr) and len(module.body) == 1:
+            target = None
+        else:
+            raise MathError(
+                "Expected assignments like `New Column` = `A` * `B`"
+            )
+
+        functions = {
+            id(child.func) for child in ast.walk(node.value)
+            if isinstance(child, ast.Call)
+        }
+        names = []
+        for child in ast.walk(node.value):
+            if isinstance(child, ast.Name) and id(child) not in functions:
+                column = name_of(child.id)
+                if column not in names:
+                    names.append(column)
+                child.id = f"_col{names.index(column)}"
+        statements.append(Statement(target, node.value, names))
+
+    return MathProgram(statements)
+
+
+def _is_vectorizable(node) -> bool:
+    for child in ast.walk(node):
+        if isinstance(child, ast.BinOp):
+            if type(child.op) not in _BINARY:
+                return False
+        elif isinstance(child, ast.UnaryOp):
+            if type(child.op) not in _UNARY:
+                return False
+        elif isinstance(child, ast.Compare):
+            if len(child.ops) != 1 or type(child.ops[0]) not in _COMPARE:
+                return False
+        elif isinstance(child, ast.Call):
+            if not isinstance(child.func, ast.Name) \
+                    or child.func.id not in FUNCTIONS or child.keywords:
+                return False
+        elif isinstance(child, ast.Constant):
+            if type(child.value) not in (int, float, bool):
+                return False
+        elif not isinstance(child, (ast.Name, ast.Load, ast.operator,
+                                    ast.unaryop, ast.cmpop)):
+            return False
+    return True
+
+
+def _evaluate(statement, df):
+    """Column arrays in, result array out; None if pandas must do it"""
+    arrays = {}
+    for index, column in enumerate(statement.names):
+        dtype = df[column].dtype
+        # Numbers only: text and extension types behave differently
+        if not isinstance(dtype, np.dtype) or dtype.kind not in 'iufb':
+            return None
+        # int64 like before compaction, so results don't overflow
+        arrays[f"_col{index}"] = widen_array(df[column].to_numpy())
+
+    rows = len(df)
+    # numexpr's setup cost only pays off on larger arrays
+    if rows >= MATH_BLOCK_ROWS and _numexpr_can_run(statement, arrays):
+        # numexpr already works through the arrays in cache-sized blocks
+        result = numexpr.evaluate(
+            ast.unparse(statement.node), local_dict=arrays
+        )
+        return _full(result, rows)
+
+    with np.errstate(all='ignore'):
+        blocks = [
+            _full(_kernel(statement.node, {
+                name: values[start:start + MATH_BLOCK_ROWS]
+                for name, values in arrays.items()
+            }), min(MATH_BLOCK_ROWS, rows - start))
+            for start in range(0, rows, MATH_BLOCK_ROWS)
+        ]
+    if len(blocks) == 1:
+        return blocks[0]
+    return np.concatenate(blocks) if blocks else np.empty(0)
+
+
+def _full(result, rows):
+    """
+    result as a new, writable array of `rows` values: a broadcast
+    constant (read-only, stride 0) or a view of an input column (`b` =
+    `a`) must not end up in the frame
+    """
+    result = np.asarray(result)
+    if result.shape == (rows,) and result.flags.owndata:
+        return result
+    return np.broadcast_to(result, (rows,)).copy()
+
+
+def _numexpr_can_run(statement, arrays):
+    if numexpr is None:
+        return False
+    # numexpr treats bool + bool as "or", pandas counts
+    if any(values.dtype.kind == 'b' for values in arrays.values()):
+        return False
+    return not any(
+        isinstance(child, ast.BinOp)
+        and isinstance(child.op, _NUMEXPR_UNSUPPORTED)
+        for child in ast.walk(statement.node)
+    )
+
+
+def _kernel(node, arrays):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return arrays[node.id]
+    if isinstance(node, ast.BinOp):
+        left = _kernel(node.left, arrays)
+        right = _kernel(node.right, arrays)
+        if isinstance(node.op, (ast.FloorDiv, ast.Mod)) \
+                and np.any(np.equal(right, 0)):
+            # Like pandas: integer x // 0 is inf and x % 0 is nan
+            left, right = _as_float(left), _as_float(right)
+        return _BINARY[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY[type(node.op)](_kernel(node.operand, arrays))
+    if isinstance(node, ast.Compare):
+        return _COMPARE[type(node.ops[0])](
+            _kernel(node.left, arrays),
+            _kernel(node.comparators[0], arrays),
+        )
+    # Call (checked by _is_vectorizable)
+    function = np.abs if node.func.id == 'abs' else getattr(np, node.func.id)
+    return function(*[_kernel(arg, arrays) for arg in node.args])
+
+
+def _as_float(value):
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'iub':
+        return value.astype(np.float64)
+    if isinstance(value, (int, bool)):
+        return float(value)
+    return value
+
+
+def _round(values, index):
+    # As before: results are rounded to 2 decimals
+    if isinstance(values, pd.Series):
+        return values.round(2)
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = np.round(values, 2)
+    return pd.Series(values, index=index)
+
+
+def _legacy_eval(df, expression):
+    if "=" in expression:
+        # Split into Target Column and Formula
+        target, formula = expression.split("=", 1)
+        target = target.strip()
+
+        # Remove backticks from the target column name if present
+        if target.startswith("`") and target.endswith("`"):
+            target = target[1:-1]
+
+        wide = widen_columns(df, mentioned_columns(df, formula))
+        df[target] = wide.eval(formula, engine='python').round(2)
+        return df
+
+    wide = widen_columns(df, mentioned_columns(df, expression))
+    return wide.eval(expression, inplace=False, engine='python')
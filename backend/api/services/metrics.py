@@ -0,0 +1,247 @@
+# api/services/metrics.py
+import contextvars
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0,
+)
+# What a span can count, see add()
+MEASURES = (
+    'rows', 'bytes_read', 'bytes_written', 'prompt_tokens',
+    'completion_tokens',
+)
+PREFIX = 'rhombus'
+
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+_span = contextvars.ContextVar('metrics_span', default=None)
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of this process, rendered in the
+    Prometheus text format. Every worker process has its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}
+        # (name, labels) -> (cumulative bucket counts, sum, count)
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, value=1, help='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('counter', help))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, help='', kind='gauge', **labels):
+        """kind='counter' for totals kept elsewhere, e.g. cache hits"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, (kind, help))
+            values = self._counters if kind == 'counter' else self._gauges
+            values[key] = value
+
+    def set_max(self, name, value, help='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('gauge', help))
+            self._gauges[key] = max(self._gauges.get(key, 0), value)
+
+    def observe(self, name, seconds, help='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', help))
+            buckets, total, count = self._histograms.get(
+                key, ([0] * len(LATENCY_BUCKETS), 0.0, 0)
+            )
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            self._histograms[key] = (buckets, total + seconds, count + 1)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {
+                key: (list(buckets), total, count)
+                for key, (buckets, total, count) in self._histograms.items()
+            }
+            described = dict(self._help)
+
+        lines = []
+        for name, (kind, help) in sorted(described.items()):
+            full = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {full} {help or name}")
+            lines.append(f"# TYPE {full} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), (buckets, total, count) in \
+                        sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, observed in zip(LATENCY_BUCKETS, buckets):
+                        lines.append(f"{full}_bucket"
+                                     f"{_labels(labels, le=bound)} "
+                                     f"{observed}")
+                    lines.append(f"{full}_bucket{_labels(labels, le='+Inf')}"
+                                 f" {count}")
+                    lines.append(f"{full}_sum{_labels(labels)} {total:.6f}")
+                    lines.append(f"{full}_count{_labels(labels)} {count}")
+                continue
+
+            values = counters if kind == 'counter' else gauges
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{full}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Span:
+    """One timed stage of a request; see span()"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.counts = dict.fromkeys(MEASURES, 0)
+        self.peak_memory = None  # bytes, with METRICS_TRACE_MEMORY only
+        self._peak = 0
+
+    def add(self, **counts):
+        for measure, value in counts.items():
+            self.counts[measure] += value
+
+
+class Trace:
+    """The spans of one request, for the Server-Timing header and the log"""
+
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def summary(self) -> dict:
+        """span name -> total seconds, in the order they first ran"""
+        totals = {}
+        for span_ in self.spans:
+            totals[span_.name] = totals.get(span_.name, 0) + span_.seconds
+        if self.queries:
+            totals['db'] = self.query_seconds
+        return totals
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a stage, e.g. `with span('parse') as stage: stage.add(rows=n)`.
+    Recorded in the process metrics, and in the trace of the current
+    request if there is one. Stages can nest.
+    """
+    current = Span(name)
+    parent = _span.get()
+    tracing = settings.METRICS_TRACE_MEMORY and tracemalloc.is_tracing()
+    if tracing:
+        start_memory, peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent._peak = max(parent._peak, peak)
+        tracemalloc.reset_peak()
+
+    token = _span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - started
+        _span.reset(token)
+        if tracing:
+            peak = max(current._peak, tracemalloc.get_traced_memory()[1])
+            current.peak_memory = peak - start_memory
+            if parent is not None:
+                parent._peak = max(parent._peak, peak)
+        _record(current)
+
+
+def add(**counts):
+    """Add to the counts (rows, bytes_read, ...) of the innermost span"""
+    current = _span.get()
+    if current is not None:
+        current.add(**counts)
+
+
+def record(name: str, seconds: float, **counts):
+    """A stage timed elsewhere, e.g. while a streamed response is sent"""
+    finished = Span(name)
+    finished.seconds = seconds
+    finished.add(**counts)
+    _record(finished)
+
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _trace.set(None)
+
+
+def record_query(seconds: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.queries += 1
+        trace.query_seconds += seconds
+    registry.inc('db_queries_total', help="Database queries")
+    registry.observe('db_query_seconds', seconds,
+                     help="Database query latency")
+
+
+def _record(current):
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append(current)
+
+    registry.observe('stage_seconds', current.seconds,
+                     help="Time spent per stage", stage=current.name)
+    for measure, value in current.counts.items():
+        if value:
+            registry.inc(f'stage_{measure}_total', value,
+                         help=f"{measure.replace('_', ' ').capitalize()} "
+                              f"per stage",
+                         stage=current.name)
+    if current.peak_memory is not None:
+        registry.set_max('stage_peak_memory_bytes', current.peak_memory,
+                         help="Largest Python memory peak per stage",
+                         stage=current.name)
+
+
+def _labels(labels, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{key}="{_escape(value)}"' for key, value in pairs
+    ) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
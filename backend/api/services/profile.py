@@ -0,0 +1,154 @@
+# api/services/profile.py
+import datetime
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .dtypes import logical_dtype
+
+# Most frequent values reported per column
+PROFILE_TOP_K = 5
+# Value counts kept per column; past this the distinct count becomes a
+# lower bound and top values an approximation
+PROFILE_MAX_TRACKED_VALUES = 10_000
+
+# A profile is a JSON document:
+# {"rows": 3, "columns": [{"name": "Price", "dtype": "float64", "nulls": 0,
+#   "distinct": 3, "distinct_exact": true, "min": 1.25, "max": 3.0,
+#   "top": [[2.5, 1], ...]}, ...]}
+# Columns are a list because not every JSON column type keeps key order.
+
+
+class ProfileAccumulator:
+    """
+    Column statistics built from one or more row batches. Each update() is
+    vectorized per column, and accumulators of different batches can be
+    merged, so files read in chunks are profiled in the same single pass.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self._columns = {}  # name -> state, in column order
+
+    def update(self, df: pd.DataFrame):
+        self.rows += len(df)
+        for name in df.columns:
+            self._merge_state(name, _batch_state(df[name]))
+        return self
+
+    def merge(self, other: 'ProfileAccumulator'):
+        self.rows += other.rows
+        for name, state in other._columns.items():
+            self._merge_state(name, dict(state, counts=Counter(
+                state['counts']
+            )))
+        return self
+
+    def result(self) -> dict:
+        columns = []
+        for name, state in self._columns.items():
+            counts = state['counts']
+            columns.append({
+                "name": name,
+                "dtype": state['dtype'],
+                "nulls": state['nulls'],
+                "distinct": len(counts) if state['exact']
+                else max(state['distinct'], len(counts)),
+                "distinct_exact": state['exact'],
+                "min": _json_value(state['min']),
+                "max": _json_value(state['max']),
+                "top": [
+                    [_json_value(value), count]
+                    for value, count in counts.most_common(PROFILE_TOP_K)
+                ],
+            })
+        return {"rows": self.rows, "columns": columns}
+
+    def _merge_state(self, name, batch):
+        state = self._columns.get(name)
+        if state is None:
+            self._columns[name] = batch
+            return
+
+        if state['dtype'] != batch['dtype']:
+            state['dtype'] = 'object'
+        state['nulls'] += batch['nulls']
+        try:
+            state['min'] = _combine(min, state['min'], batch['min'])
+            state['max'] = _combine(max, state['max'], batch['max'])
+        except TypeError:
+            # Batches disagree on the type (e.g. numbers vs dates)
+            state['min'] = state['max'] = None
+        state['distinct'] = max(state['distinct'], batch['distinct'])
+        state['counts'].update(batch['counts'])
+        state['exact'] = state['exact'] and batch['exact']
+        _bound(state)
+
+
+def profile_frame(df: pd.DataFrame) -> dict:
+    return ProfileAccumulator().update(df).result()
+
+
+def profile_columns(profile: dict) -> list:
+    return [column['name'] for column in (profile or {}).get('columns', [])]
+
+
+def _batch_state(series: pd.Series) -> dict:
+    counts = series.value_counts(dropna=True)
+    counts = counts[counts > 0]  # categoricals list unused categories
+    state = {
+        'dtype': logical_dtype(series.dtype),
+        'nulls': int(series.isna().sum()),
+        'min': None,
+        'max': None,
+        'distinct': len(counts),
+        'exact': True,
+        'counts': None,
+    }
+
+    if len(counts) > PROFILE_MAX_TRACKED_VALUES:
+        counts = counts.iloc[:PROFILE_MAX_TRACKED_VALUES]
+        state['exact'] = False
+    state['counts'] = Counter(dict(zip(counts.index.tolist(),
+                                       counts.tolist())))
+
+    # Ordering only makes sense for numbers, booleans and dates
+    if series.dtype.kind in 'iufbmM' and state['distinct']:
+        state['min'] = series.min()
+        state['max'] = series.max()
+    return state
+
+
+def _bound(state):
+    counts = state['counts']
+    if len(counts) > PROFILE_MAX_TRACKED_VALUES:
+        state['distinct'] = max(state['distinct'], len(counts))
+        state['counts'] = Counter(
+            dict(counts.most_common(PROFILE_MAX_TRACKED_VALUES))
+        )
+        state['exact'] = False
+
+
+def _combine(pick, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return pick(a, b)
+
+
+def _json_value(value):
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (pd.Timestamp, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (pd.Timedelta, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
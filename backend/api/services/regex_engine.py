@@ -0,0 +1,599 @@
+# api/services/regex_engine.py
+import multiprocessing
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Characters that can appear in the text form of non-object dtypes. A
+# pattern that requires any other character can never match such a column.
+_DTYPE_ALPHABETS = {
+    'i': set('0123456789-'),
+    'u': set('0123456789'),
+    'f': set('0123456789.-+eEnaif'),  # also 'nan', 'inf', '1e-05'
+    'b': set('TrueFals'),
+}
+
+# Characters the safety check tries character classes on
+_SAMPLE_CHARS = frozenset(
+    [chr(code) for code in range(128)] + list('\u00a0\u00e9\u00df\u2003\u4e2d')
+)
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: str.isdecimal,
+    sre_constants.CATEGORY_SPACE: str.isspace,
+    sre_constants.CATEGORY_WORD: lambda char: char.isalnum() or char == '_',
+    sre_constants.CATEGORY_LINEBREAK: lambda char: char == '\n',
+}
+_NEGATED_CATEGORIES = {
+    sre_constants.CATEGORY_NOT_DIGIT: sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_NOT_SPACE: sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_WORD: sre_constants.CATEGORY_WORD,
+    sre_constants.CATEGORY_NOT_LINEBREAK: sre_constants.CATEGORY_LINEBREAK,
+}
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+_pool = None
+_pool_workers = None
+# Request threads share the pool: one of them starts or replaces it
+_pool_lock = threading.Lock()
+
+
+class UnsafePattern(ValueError):
+    """A pattern that can take exponential time to fail"""
+    pass
+
+
+class RegexTimeout(Exception):
+    pass
+
+
+class RegexEngine:
+    """
+    Regex replacement over DataFrame columns, equivalent to
+    Series.astype(str).replace(regex=True) but:
+
+    - only converts the cells of one partition to text at a time instead of
+      copying the whole frame as Python strings,
+    - skips columns whose dtype can't contain a match,
+    - rewrites categorical columns once per category instead of per row,
+    - only runs the pattern on rows containing the literal text every
+      match needs (e.g. 'N' for '^N.*'), found by vectorized string
+      search, when the pattern has some (REGEX_PREFILTER),
+    - splits large frames by column and row range across a process pool,
+      each worker compiling the pattern once.
+
+    Patterns are checked before they run: nested or overlapping repeats
+    such as (a+)+ or (a|ab)* are rejected, and each replace() call stops
+    with RegexTimeout once it has used REGEX_TIME_BUDGET seconds.
+    """
+
+    @staticmethod
+    def compile(pattern: str):
+        """
+        Raises re.error for invalid patterns, UnsafePattern for patterns
+        prone to catastrophic backtracking
+        """
+        compiled = _compile(pattern)
+        reason = _unsafe_reason(pattern)
+        if reason:
+            raise UnsafePattern(reason)
+        return compiled
+
+    @staticmethod
+    def can_match(pattern: str, dtype) -> bool:
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtype = dtype.categories.dtype
+        if not isinstance(dtype, np.dtype):
+            return True
+        alphabet = _DTYPE_ALPHABETS.get(dtype.kind)
+        if alphabet is None:
+            return True
+        return _required_chars(pattern) <= alphabet
+
+    @staticmethod
+    def replace(df: pd.DataFrame, pattern: str, replacement: str,
+                columns: list = None, max_workers: int = None,
+                min_parallel_cells: int = None,
+                partition_rows: int = None,
+                time_budget: float = None,
+                prefilter: bool = None) -> pd.DataFrame:
+        """
+        Replace in `columns` (default: all), returning a new frame.
+        Processed columns become text (categoricals stay categorical);
+        skipped ones keep their dtype.
+        Raises RegexTimeout after time_budget seconds (default
+        REGEX_TIME_BUDGET, 0 for none). The other None arguments default
+        to their REGEX_* setting too.
+        """
+        RegexEngine.compile(pattern)
+        if time_budget is None:
+            time_budget = settings.REGEX_TIME_BUDGET
+        deadline = time.time() + time_budget if time_budget else None
+        if max_workers is None:
+            max_workers = settings.REGEX_WORKERS
+        if min_parallel_cells is None:
+            min_parallel_cells = settings.REGEX_PARALLEL_MIN_CELLS
+        if partition_rows is None:
+            partition_rows = settings.REGEX_PARTITION_ROWS
+        if prefilter is None:
+            prefilter = settings.REGEX_PREFILTER
+
+        columns = list(df.columns) if columns is None else columns
+        targets = [
+            col for col in columns
+            if RegexEngine.can_match(pattern, df[col].dtype)
+        ]
+
+        out = df.copy(deep=False)
+        if not targets:
+            return out
+
+        # Column x row-range partitions (of the categories, for
+        # categoricals)
+        tasks = []
+        for col in targets:
+            values = _raw_values(df[col])
+            for start in range(0, max(len(values), 1), partition_rows):
+                tasks.append((col, values[start:start + partition_rows]))
+
+        cells = sum(len(values) for _, values in tasks)
+        pool = None
+        if max_workers > 1 and cells >= min_parallel_cells:
+            pool = _get_pool(max_workers)
+        if pool is None and deadline and not _can_time_here() \
+                and cells >= min_parallel_cells:
+            # The budget needs a timer signal, which only a main thread
+            # gets: let a worker process run it. Small inputs (previews)
+            # stay in this thread, with the budget checked between rows.
+            pool = _get_pool(max(max_workers, 1))
+
+        if pool is not None:
+            results = list(pool.map(
+                _replace_partition,
+                [pattern] * len(tasks),
+                [replacement] * len(tasks),
+                [values for _, values in tasks],
+                [deadline] * len(tasks),
+                [prefilter] * len(tasks),
+            ))
+        else:
+            results = [
+                _replace_partition(pattern, replacement, values, deadline,
+                                   prefilter)
+                for _, values in tasks
+            ]
+
+        by_column = {}
+        for (col, _), result in zip(tasks, results):
+            by_column.setdefault(col, []).append(result)
+
+        for col, parts in by_column.items():
+            values = np.concatenate(parts) if parts \
+                else np.array([], object)
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                out[col] = _recategorize(df[col], values)
+            else:
+                out[col] = pd.Series(values, index=df.index, dtype=object)
+        return out
+
+
+def _recategorize(series: pd.Series, categories: np.ndarray) -> pd.Series:
+    """series with its categories replaced by the rewritten ones"""
+    # Several categories can become the same text: merge them
+    merged, uniques = pd.factorize(categories, sort=True)
+    codes = series.cat.codes.to_numpy()
+    if len(merged):
+        codes = np.where(codes >= 0, merged[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=uniques),
+        index=series.index,
+    )
+
+
+def _raw_values(series: pd.Series) -> np.ndarray:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return _raw_values(series.cat.categories.to_series())
+    # Text and numbers are converted per partition by the workers; other
+    # dtypes (dates etc.) need pandas' own text form
+    if series.dtype == object or series.dtype.kind in _DTYPE_ALPHABETS:
+        return series.to_numpy()
+    return series.astype(str).where(series.notna(), None).to_numpy()
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str):
+    # Cached per process, so every pool worker compiles a pattern only once
+    return re.compile(pattern)
+
+
+@lru_cache(maxsize=256)
+def _required_chars(pattern: str) -> frozenset:
+    """Characters every match of the pattern must contain"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return frozenset()
+
+    if parsed.state.flags & re.IGNORECASE:
+        return frozenset()
+    return frozenset(_walk_required(parsed))
+
+
+def _walk_required(parsed) -> set:
+    chars = set()
+    for op, arg in parsed:
+        if op is sre_constants.LITERAL:
+            chars.add(chr(arg))
+        elif op is sre_constants.SUBPATTERN:
+            chars |= _walk_required(arg[-1])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, _, body = arg
+            if low > 0:
+                chars |= _walk_required(body)
+        # Branches, classes, lookarounds etc. are treated as optional
+    return chars
+
+
+@lru_cache(maxsize=256)
+def _required_literals(pattern: str):
+    """
+    (prefix, substrings): text every match starts with (None if not
+    anchored) and runs of literal text every match contains
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None, ()
+    flags = parsed.state.flags
+    if flags & re.IGNORECASE:
+        return None, ()
+
+    items = list(_inline_groups(parsed))
+    prefix = None
+    if items and items[0][0] is sre_constants.AT and (
+        items[0][1] is sre_constants.AT_BEGINNING_STRING
+        or (items[0][1] is sre_constants.AT_BEGINNING
+            and not flags & re.MULTILINE)
+    ):
+        runs = _literal_runs(items[1:])
+        if runs and items[1][0] is sre_constants.LITERAL:
+            prefix = runs[0]
+    return prefix, tuple(_literal_runs(items))
+
+
+def _inline_groups(items):
+    # A group is matched in place: its items are part of the sequence
+    for op, arg in items:
+        if op is sre_constants.SUBPATTERN and not arg[1] & re.IGNORECASE:
+            yield from _inline_groups(arg[-1])
+        else:
+            yield op, arg
+
+
+def _literal_runs(items) -> list:
+    """Consecutive literal characters every match of items contains"""
+    runs = []
+    run = ''
+    for op, arg in items:
+        if op is sre_constants.LITERAL:
+            run += chr(arg)
+            continue
+        if run:
+            runs.append(run)
+            run = ''
+        if op in _REPEATS and arg[0] > 0:
+            runs.extend(_literal_runs(_inline_groups(arg[2])))
+    if run:
+        runs.append(run)
+    return runs
+
+
+def _candidates(pattern, values):
+    """
+    Positions of the text values that can match, None if every value has
+    to be tried (no required literals, or not all text)
+    """
+    prefix, literals = _required_literals(pattern)
+    if (prefix is None and not literals) or values.dtype != object:
+        return None
+    try:
+        text = pa.array(values, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+
+    mask = None
+    if prefix is not None:
+        mask = pc.starts_with(text, pattern=prefix)
+    if literals:
+        # The longest literal is the most selective
+        longest = max(literals, key=len)
+        if prefix is None or len(longest) > len(prefix):
+            found = pc.match_substring(text, pattern=longest)
+            mask = found if mask is None else pc.and_(mask, found)
+    return np.flatnonzero(
+        mask.fill_null(False).to_numpy(zero_copy_only=False)
+    )
+
+
+def _replace_partition(pattern, replacement, values, deadline=None,
+                       prefilter=False):
+    """Runs in the pool workers: text-convert one slice and substitute"""
+    compiled = _compile(pattern)
+    rows = _candidates(pattern, values) if prefilter else None
+    if rows is None:
+        out = np.empty(len(values), dtype=object)
+        rows = range(len(values))
+    else:
+        # Rows that can't match keep their text, nulls become None
+        out = values.copy()
+        out[pd.isna(values)] = None
+
+    # Without a timer signal the budget can only be checked between rows;
+    # compile() rejects the patterns a single match could hang on
+    checked = deadline is not None and not _can_time_here()
+    with _time_budget(deadline):
+        for n, i in enumerate(rows):
+            if checked and n % 256 == 0 and time.time() > deadline:
+                raise RegexTimeout()
+            value = values[i]
+            if value is None or value is pd.NA or \
+                    (isinstance(value, float) and value != value):
+                out[i] = None
+                continue
+
+            text = value if isinstance(value, str) else str(value)
+            # Same rule as Series.replace(regex=True): only rewrite on a
+            # match
+            out[i] = compiled.sub(replacement, text) \
+                if compiled.search(text) is not None else text
+    return out
+
+
+def _can_time_here():
+    return hasattr(signal, 'setitimer') \
+        and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def _time_budget(deadline):
+    """
+    Raise RegexTimeout at `deadline` (time.time()), even in the middle of a
+    match: the regex engine checks for signals as it backtracks
+    """
+    if deadline is None or not _can_time_here():
+        yield
+        return
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise RegexTimeout()
+
+    def expire(signum, frame):
+        raise RegexTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@lru_cache(maxsize=256)
+def _unsafe_reason(pattern: str):
+    """
+    Why the pattern can backtrack exponentially, or None. Looks for repeats
+    whose iterations can split the same text in several ways: (a+)+,
+    (\\w+\\s?)*, (a|ab)+. Patterns like (\\d+,)* stay allowed.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    return _check_items(list(parsed), parsed.state.flags)
+
+
+def _check_items(items, flags):
+    for op, arg in items:
+        if op in _REPEATS:
+            low, high, body = arg
+            body = _flatten(list(body))
+            if high == sre_constants.MAXREPEAT:
+                reason = _ambiguous_repeat(body, flags)
+                if reason:
+                    return reason
+            nested = body
+        elif op is sre_constants.SUBPATTERN:
+            nested = list(arg[-1])
+        elif op is sre_constants.BRANCH:
+            nested = [item for branch in arg[1] for item in branch]
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            nested = list(arg[1])
+        else:
+            continue
+
+        reason = _check_items(nested, flags)
+        if reason:
+            return reason
+    return None
+
+
+def _ambiguous_repeat(body, flags):
+    # A variable-length piece of the repeated sequence whose text can also
+    # be matched by what follows it, including the next iteration: (a+)+,
+    # (a|aa)+. Each way of splitting the text is tried before failing.
+    for position, (op, arg) in enumerate(body):
+        if not _variable_width(op, arg):
+            continue
+        rest = body[position + 1:]
+        follow = _first(rest, flags)
+        if _nullable(rest):
+            follow |= _first(body, flags)
+        if _chars([(op, arg)], flags) & follow:
+            return "Nested repeats, e.g. (a+)+ or (\\w+\\s?)*; this " \
+                   "can take exponential time"
+    return None
+
+
+def _variable_width(op, arg) -> bool:
+    if op in _REPEATS:
+        return arg[0] != arg[1] or len(set(arg[2].getwidth())) > 1
+    if op is sre_constants.BRANCH:
+        widths = {branch.getwidth() for branch in arg[1]}
+        return len(widths) > 1 or any(low != high for low, high in widths)
+    return False
+
+
+def _flatten(items):
+    # Groups don't change what a sequence matches
+    flat = []
+    for op, arg in items:
+        if op is sre_constants.SUBPATTERN:
+            flat.extend(_flatten(list(arg[-1])))
+        else:
+            flat.append((op, arg))
+    return flat
+
+
+def _nullable(items) -> bool:
+    return all(_item_nullable(op, arg) for op, arg in items)
+
+
+def _item_nullable(op, arg) -> bool:
+    if op in _REPEATS:
+        return arg[0] == 0 or _nullable(list(arg[2]))
+    if op is sre_constants.SUBPATTERN:
+        return _nullable(list(arg[-1]))
+    if op is sre_constants.BRANCH:
+        return any(_nullable(list(branch)) for branch in arg[1])
+    # Anchors and lookarounds match no characters
+    return op in (sre_constants.AT, sre_constants.ASSERT,
+                  sre_constants.ASSERT_NOT)
+
+
+def _first(items, flags) -> frozenset:
+    """Sample characters a match of the sequence can start with"""
+    first = frozenset()
+    for op, arg in items:
+        first |= _item_first(op, arg, flags)
+        if not _item_nullable(op, arg):
+            break
+    return first
+
+
+def _item_first(op, arg, flags) -> frozenset:
+    if op in _REPEATS:
+        return _first(list(arg[2]), flags)
+    if op is sre_constants.SUBPATTERN:
+        return _first(list(arg[-1]), flags)
+    if op is sre_constants.BRANCH:
+        return frozenset().union(
+            *[_first(list(branch), flags) for branch in arg[1]]
+        )
+    return _atom_chars(op, arg, flags)
+
+
+def _chars(items, flags) -> frozenset:
+    """Sample characters anywhere in a match of the sequence"""
+    chars = frozenset()
+    for op, arg in items:
+        if op in _REPEATS:
+            chars |= _chars(list(arg[2]), flags)
+        elif op is sre_constants.SUBPATTERN:
+            chars |= _chars(list(arg[-1]), flags)
+        elif op is sre_constants.BRANCH:
+            for branch in arg[1]:
+                chars |= _chars(list(branch), flags)
+        else:
+            chars |= _atom_chars(op, arg, flags)
+    return chars
+
+
+def _atom_chars(op, arg, flags) -> frozenset:
+    chars = _case_sensitive_chars(op, arg, flags)
+    if flags & re.IGNORECASE:
+        chars |= _SAMPLE_CHARS & {char.swapcase() for char in chars}
+    return chars
+
+
+def _case_sensitive_chars(op, arg, flags) -> frozenset:
+    if op in (sre_constants.AT, sre_constants.ASSERT,
+              sre_constants.ASSERT_NOT):
+        return frozenset()
+    if op is sre_constants.LITERAL:
+        return frozenset([chr(arg)])
+    if op is sre_constants.NOT_LITERAL:
+        return _SAMPLE_CHARS - {chr(arg)}
+    if op is sre_constants.ANY:
+        return _SAMPLE_CHARS if flags & re.DOTALL \
+            else _SAMPLE_CHARS - {'\n'}
+    if op is sre_constants.IN:
+        return frozenset(
+            char for char in _SAMPLE_CHARS if _in_class(char, arg)
+        )
+    # Back-references and anything else: could be anything
+    return _SAMPLE_CHARS
+
+
+def _in_class(char, items) -> bool:
+    negate = False
+    matched = False
+    for op, arg in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            matched |= char == chr(arg)
+        elif op is sre_constants.RANGE:
+            matched |= arg[0] <= ord(char) <= arg[1]
+        elif op is sre_constants.CATEGORY:
+            matched |= _in_category(char, arg)
+        else:
+            matched = True
+    return matched != negate
+
+
+def _in_category(char, category) -> bool:
+    if category in _NEGATED_CATEGORIES:
+        return not _CATEGORIES[_NEGATED_CATEGORIES[category]](char)
+    test = _CATEGORIES.get(category)
+    return test(char) if test else True
+
+
+def _get_pool(max_workers):
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+                _pool = None
+            try:
+                # Fresh interpreters (as in batch.py): forking a threaded
+                # server would copy its locks, database connections and S3
+                # clients. Started once per process, then reused.
+                _pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                _pool_workers = max_workers
+            except (OSError, NotImplementedError):
+                # e.g. serverless runtimes without /dev/shm: stay
+                # single-process
+                return None
+        return _pool
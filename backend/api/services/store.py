@@ -0,0 +1,666 @@
+# api/services/store.py
+import hashlib
+import tempfile
+import uuid
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from ..models import Operation, UploadedDocument
+from . import metrics
+from .cache import frame_cache, frame_key
+from .dtypes import compact_frame, logical_dtype, logical_frame
+from .excel import ExcelReader
+from .profile import profile_frame
+from .transforms import build_transform
+
+# Every version is kept as a compressed, typed Parquet "working copy".
+# CSV/XLSX is only produced again when the user downloads the file.
+WORKING_COMPRESSION = 'zstd'
+
+CSV_CONTENT_TYPE = 'text/csv'
+XLSX_CONTENT_TYPE = ('application/vnd.'
+                     'openxmlformats-officedocument.'
+                     'spreadsheetml.sheet')
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+# S3 requires every multipart part except the last to be at least 5 MiB
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+class DocumentStore:
+    @staticmethod
+    def read_source(file_obj, filename: str, sheet: str = '') -> pd.DataFrame:
+        """Parse an original CSV/Excel upload (one sheet) into a DataFrame."""
+        filename = filename.lower()
+
+        with metrics.span('parse') as stage:
+            if filename.endswith('.csv'):
+                df = pd.read_csv(file_obj)
+            elif filename.endswith(('.xls', '.xlsx')):
+                df = ExcelReader.read(file_obj, filename, sheet)
+            else:
+                raise UnsupportedFileType("Unsupported file type")
+            stage.add(rows=len(df),
+                      bytes_read=getattr(file_obj, 'size', None) or 0)
+
+        # Parquet needs string column names (Excel headers can be numbers)
+        df.columns = [str(c) for c in df.columns]
+        return compact_frame(_coerce_mixed_columns(df))
+
+    @staticmethod
+    def to_working_bytes(df: pd.DataFrame) -> bytes:
+        # Stored in the logical dtypes, compacted again on load()
+        df = logical_frame(df)
+        buffer = BytesIO()
+        with metrics.span('parquet.write') as stage:
+            # Fixed-size row groups double as the row index for preview
+            # windows
+            df.to_parquet(
+                buffer, index=False, compression=WORKING_COMPRESSION,
+                row_group_size=settings.WORKING_ROW_GROUP_ROWS,
+            )
+            stage.add(rows=len(df), bytes_written=buffer.tell())
+        return buffer.getvalue()
+
+    @staticmethod
+    def create_from_upload(file_obj, sheet: str = ''):
+        """
+        Save the original upload, then convert it ONCE into the working copy.
+        sheet: resolved worksheet name for Excel files.
+        Returns (document, df).
+        """
+        filename = file_obj.name.split('/')[-1]
+        source_hash = _file_hash(file_obj)
+
+        original = UploadedDocument.objects.filter(
+            source_hash=source_hash
+        ).exclude(file='').order_by('id').first()
+        if original is not None:
+            # Same bytes as an earlier upload (e.g. a daily export)
+            return DocumentStore.create_from_original(
+                original, filename, sheet
+            )
+
+        document = UploadedDocument.objects.create(
+            file=file_obj, filename=filename, source_hash=source_hash,
+            sheet=sheet,
+        )
+        df = DocumentStore.convert_original(document)
+        return document, df
+
+    @staticmethod
+    def create_from_original(original, filename: str, sheet: str = ''):
+        """
+        New document reading an already stored original, e.g. another sheet
+        of a workbook. Returns (document, df).
+        """
+        document = UploadedDocument(
+            file=original.file.name,
+            filename=filename,
+            source_hash=original.source_hash,
+            sheet=sheet,
+        )
+
+        same = None
+        if original.source_hash:
+            same = UploadedDocument.objects.filter(
+                source_hash=original.source_hash, sheet=sheet
+            ).exclude(working_file='').order_by('id').first()
+        if same is None:
+            document.save()
+            return document, DocumentStore.convert_original(document)
+
+        # Read before: share the working copy, profile and cached frame
+        document.working_file.name = same.working_file.name
+        document.content_hash = same.content_hash
+        document.profile = same.profile
+        document.save()
+        return document, DocumentStore.load(document)
+
+    @staticmethod
+    def convert_original(document) -> pd.DataFrame:
+        """Parse a saved original, store its profile and working copy"""
+        document.file.open()
+        df = DocumentStore.read_source(
+            document.file, document.file.name, document.sheet
+        )
+
+        working_bytes = DocumentStore.to_working_bytes(df)
+        _store_working_bytes(document, df, working_bytes)
+        if document.profile is None:
+            document.profile = profile_frame(df)
+        document.save()
+        frame_cache.put(frame_key(document), df, working_bytes)
+        return df
+
+    @staticmethod
+    def create_version(df: pd.DataFrame, filename: str, base=None,
+                       columns: list = None):
+        """
+        Store a transformed DataFrame as a new (working copy only) version.
+        The frame is cached as-is, so callers must not mutate it afterwards.
+        With base, only `columns` are stored, as a delta on top of base.
+        """
+        document = UploadedDocument(filename=filename)
+        DocumentStore.save_working_copy(document, df, base, columns)
+        return document
+
+    @staticmethod
+    def save_working_copy(document, df: pd.DataFrame, base=None,
+                          columns: list = None):
+        """Materialize a (new or lazy) version from an in-memory frame"""
+        lazy = document.pk is not None
+        df = _coerce_mixed_columns(df)
+        document.delta_base = base
+        stored = df if base is None else df[columns]
+        working_bytes = DocumentStore.to_working_bytes(stored)
+        _store_working_bytes(document, stored, working_bytes)
+        document.save()
+        if lazy:
+            # Cached by content from now on
+            frame_cache.invalidate(document.id)
+
+        # The next operation in the chain will most likely read this version
+        # (a delta's bytes alone aren't the version: not shared). Rows are
+        # numbered as when the working copy is read, not as in the parent.
+        frame_cache.put(
+            frame_key(document), _renumbered(df),
+            working_bytes if base is None else None,
+        )
+
+    @staticmethod
+    def create_lazy_version(parent, spec: dict, filename: str):
+        """Record a version as parent + operation, without computing it"""
+        document = UploadedDocument.objects.create(filename=filename)
+        Operation.objects.create(document=document, parent=parent, spec=spec)
+        return document
+
+    @staticmethod
+    def resolve(document):
+        """
+        Walk up the lineage of a lazy version to the nearest ancestor whose
+        data is available (materialized or cached).
+        Returns (base_document, [op specs to apply to it, in order]).
+        """
+        specs = []
+        while frame_key(document) not in frame_cache \
+                and not document.is_materialized:
+            operation = document.operation
+            specs.insert(0, operation.spec)
+            document = operation.parent
+        return document, specs
+
+    @staticmethod
+    def open_version_writer(filename: str):
+        """
+        File-like sink for a working copy that is too big to build in memory.
+        Call create_version_from_writer() once everything is written.
+        """
+        name = UploadedDocument._meta.get_field('working_file') \
+            .generate_filename(None, _working_name())
+
+        if isinstance(default_storage, S3Boto3Storage):
+            return S3MultipartWriter(default_storage, name)
+        return SpooledWriter(default_storage, name)
+
+    @staticmethod
+    def create_version_from_writer(writer, filename: str, base=None):
+        """base: what was written is a delta on top of this version"""
+        document = UploadedDocument(filename=filename, delta_base=base)
+        DocumentStore.commit_working_copy(document, writer)
+        document.save()
+        return document
+
+    @staticmethod
+    def save_working_copy_from_writer(document, writer, base=None):
+        document.delta_base = base
+        DocumentStore.commit_working_copy(document, writer)
+        document.save(update_fields=[
+            'working_file', 'content_hash', 'profile', 'delta_base'
+        ])
+
+    @staticmethod
+    def commit_working_copy(document, writer):
+        """
+        Point the (unsaved) document at what was written, or at an existing
+        working copy with the same content, dropping the new one
+        """
+        document.content_hash = _content_hash(document, writer.content_hash)
+        match = DocumentStore.find_content(document.content_hash)
+        if match is not None:
+            writer.abort()
+            _adopt(document, match)
+        else:
+            with metrics.span('storage.write') as stage:
+                stage.add(bytes_written=writer.tell())
+                document.working_file.name = writer.commit()
+
+    @staticmethod
+    def find_content(content_hash: str):
+        """A document whose working copy has this content, or None"""
+        if not content_hash:
+            return None
+        return UploadedDocument.objects.filter(
+            content_hash=content_hash
+        ).exclude(working_file='').order_by('id').first()
+
+    @staticmethod
+    def compose(df: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+        """
+        A delta's columns over (a row range of) its base version: they
+        replace the base's columns in place, new ones are appended
+        """
+        for column in delta.columns:
+            df[column] = delta[column].set_axis(df.index)
+        return df
+
+    @staticmethod
+    def working_schema(document):
+        """Arrow schema of a materialized version, deltas composed"""
+        with DocumentStore.open_working_copy(document) as handle:
+            schema = pq.read_schema(handle)
+        if document.delta_base_id is None:
+            return schema
+
+        composed = DocumentStore.working_schema(document.delta_base)
+        for field in schema:
+            index = composed.get_field_index(field.name)
+            composed = composed.set(index, field) if index >= 0 \
+                else composed.append(field)
+        return composed
+
+    @staticmethod
+    def stored_size(document) -> int:
+        """Bytes stored for a materialized version, with its delta bases"""
+        size = 0
+        while document is not None:
+            size += (document.working_file or document.file).size
+            document = document.delta_base
+        return size
+
+    @staticmethod
+    def delta_depth(document) -> int:
+        """How many deltas a read of the version composes"""
+        depth = 0
+        while document.delta_base_id is not None:
+            depth += 1
+            document = document.delta_base
+        return depth
+
+    @staticmethod
+    def open_working_copy(document):
+        """
+        Seekable binary handle on the Parquet working copy. On S3 only the
+        byte ranges actually read are downloaded (footer, row groups).
+        """
+        return DocumentStore.open_ranged(document.working_file)
+
+    @staticmethod
+    def open_ranged(field_file):
+        """Seekable handle on any stored file, see open_working_copy()"""
+        if isinstance(default_storage, S3Boto3Storage):
+            return S3RangeReader(default_storage, field_file.name)
+        return field_file.open('rb')
+
+    @staticmethod
+    def presigned_url(field_file, expire: int, **parameters):
+        """
+        Temporary direct S3 link (e.g. ResponseContentDisposition=...), or
+        None when files aren't on S3
+        """
+        if not isinstance(default_storage, S3Boto3Storage):
+            return None
+        return default_storage.url(
+            field_file.name, parameters=parameters, expire=expire
+        )
+
+    @staticmethod
+    def load(document) -> pd.DataFrame:
+        """Returns a private copy of the version, skipping S3 on cache hits"""
+        df = frame_cache.get(frame_key(document))
+        if df is not None:
+            return df
+
+        # Lazy version: run the whole chain of operations in one go
+        if not document.is_materialized:
+            base, specs = DocumentStore.resolve(document)
+            df = DocumentStore.load(base)
+            with metrics.span('transform') as stage:
+                for spec in specs:
+                    df = build_transform(spec)(df)
+                stage.add(rows=len(df))
+            df = compact_frame(df)
+            frame_cache.put(frame_key(document), df)
+            return df.copy()
+
+        # Documents uploaded before working copies existed
+        if not document.working_file:
+            document.file.open()
+            df = DocumentStore.read_source(
+                document.file, document.file.name, document.sheet
+            )
+            frame_cache.put(frame_key(document), df)
+            return df.copy()
+
+        with metrics.span('storage.read') as stage:
+            document.working_file.open()
+            try:
+                working_bytes = document.working_file.read()
+            finally:
+                document.working_file.close()
+            stage.add(bytes_read=len(working_bytes))
+
+        with metrics.span('parquet.read') as stage:
+            # Working copies are stored in plain dtypes
+            df = compact_frame(pd.read_parquet(BytesIO(working_bytes)))
+            stage.add(rows=len(df))
+        if document.delta_base_id is not None:
+            df = DocumentStore.compose(
+                DocumentStore.load(document.delta_base), df
+            )
+            working_bytes = None
+        frame_cache.put(frame_key(document), df, working_bytes)
+        return df.copy()
+
+
+class ContentDigest:
+    """
+    SHA-256 of a version's data in its logical dtypes, fed one frame (row
+    batch) at a time. Unlike a hash of the Parquet bytes, it doesn't depend
+    on how the rows were split into batches and row groups, so the memory,
+    chunked and lazy paths give the same digest for the same content.
+    """
+
+    def __init__(self):
+        self._dtypes = None
+        self._columns = []
+        self._rows = 0
+
+    def update(self, df: pd.DataFrame):
+        if not self._rows:
+            # The first non-empty batch has the real dtypes
+            self._dtypes = [
+                (str(name), logical_dtype(dtype))
+                for name, dtype in df.dtypes.items()
+            ]
+        while len(self._columns) < df.shape[1]:
+            self._columns.append(hashlib.sha256())
+
+        for position, column in enumerate(self._columns[:df.shape[1]]):
+            # Compact columns hash like their plain values: no need to
+            # widen them. Text is mostly distinct, so not factorized first.
+            series = df.iloc[:, position]
+            hashes = pd.util.hash_pandas_object(
+                series, index=False, categorize=False
+            ).to_numpy()
+            # NaN and None hash differently, both are null once stored
+            hashes[series.isna().to_numpy()] = 0
+            column.update(hashes.tobytes())
+        self._rows += len(df)
+        return self
+
+    def hexdigest(self) -> str:
+        digest = hashlib.sha256(repr((self._dtypes, self._rows)).encode())
+        for column in self._columns:
+            digest.update(column.digest())
+        return digest.hexdigest()
+
+
+class S3MultipartWriter:
+    """
+    Write-only file object that streams straight into an S3 multipart upload,
+    holding at most one part in memory.
+    """
+
+    def __init__(self, storage, name):
+        self.name = name
+        self._bucket = storage.bucket_name
+        self._key = f"{storage.location}/{name}" if storage.location else name
+        self._client = storage.connection.meta.client
+        self._upload_id = self._client.create_multipart_upload(
+            Bucket=self._bucket, Key=self._key
+        )['UploadId']
+        self._parts = []
+        self._buffer = BytesIO()
+        self._position = 0
+        # Fed the frames written, by whoever writes them
+        self.digest = ContentDigest()
+        self.closed = False
+
+    @property
+    def content_hash(self):
+        return self.digest.hexdigest()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.write(data)
+        self._position += len(data)
+        if self._buffer.tell() >= MULTIPART_PART_SIZE:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # pyarrow closes its sink when the writer finishes; completing the
+        # upload is left to commit()
+        self.closed = True
+
+    def commit(self):
+        if self._buffer.tell() or not self._parts:
+            self._upload_part()
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts},
+        )
+        return self.name
+
+    def abort(self):
+        self._client.abort_multipart_upload(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+        )
+
+    def _upload_part(self):
+        part_number = len(self._parts) + 1
+        response = self._client.upload_part(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=self._buffer.getvalue(),
+        )
+        self._parts.append(
+            {'PartNumber': part_number, 'ETag': response['ETag']}
+        )
+        self._buffer = BytesIO()
+
+
+class S3RangeReader:
+    """
+    Read-only, seekable file object over an S3 key that fetches each read()
+    with a ranged GET instead of downloading the whole object first.
+    """
+
+    def __init__(self, storage, name):
+        self.name = name
+        self._bucket = storage.bucket_name
+        self._key = f"{storage.location}/{name}" if storage.location else name
+        self._client = storage.connection.meta.client
+        self.size = self._client.head_object(
+            Bucket=self._bucket, Key=self._key
+        )['ContentLength']
+        self._position = 0
+        self.closed = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 \
+            else min(self._position + size, self.size)
+        if end <= self._position:
+            return b''
+
+        body = self._client.get_object(
+            Bucket=self._bucket,
+            Key=self._key,
+            Range=f"bytes={self._position}-{end - 1}",
+        )['Body'].read()
+        self._position += len(body)
+        return body
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SpooledWriter:
+    """Fallback for non-S3 storages: spool to disk, then save in one go"""
+
+    def __init__(self, storage, name):
+        self.name = name
+        self._storage = storage
+        self._file = tempfile.TemporaryFile()
+        # Fed the frames written, by whoever writes them
+        self.digest = ContentDigest()
+        self.closed = False
+
+    @property
+    def content_hash(self):
+        return self.digest.hexdigest()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self.closed = True
+
+    def commit(self):
+        self._file.seek(0)
+        try:
+            return self._storage.save(self.name, File(self._file))
+        finally:
+            self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+def _renumbered(df: pd.DataFrame) -> pd.DataFrame:
+    index = df.index
+    if isinstance(index, pd.RangeIndex) and index.start == 0 \
+            and index.step == 1:
+        return df
+    df = df.copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+
+def _store_working_bytes(document, df, working_bytes):
+    """Save a working copy (of df) unless the content is stored already"""
+    document.content_hash = _content_hash(
+        document, ContentDigest().update(df).hexdigest()
+    )
+    match = DocumentStore.find_content(document.content_hash)
+    if match is not None:
+        _adopt(document, match)
+    else:
+        with metrics.span('storage.write') as stage:
+            stage.add(bytes_written=len(working_bytes))
+            document.working_file.save(
+                _working_name(), ContentFile(working_bytes), save=False
+            )
+
+
+def _content_hash(document, digest: str) -> str:
+    # A delta only holds some columns: the same bytes on top of a different
+    # base are different content
+    if document.delta_base is None:
+        return digest
+    base = frame_key(document.delta_base)
+    return hashlib.sha256(f"{base}:{digest}".encode()).hexdigest()
+
+
+def _adopt(document, match):
+    document.working_file.name = match.working_file.name
+    # Same content: composing match's delta with its base gives this version
+    document.delta_base_id = match.delta_base_id
+    if document.profile is None:
+        document.profile = match.profile
+
+
+def _file_hash(file_obj) -> str:
+    digest = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def _working_name() -> str:
+    # Unique per version: S3 storage overwrites existing keys by default
+    return f"{uuid.uuid4().hex}.parquet"
+
+
+def _coerce_mixed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # Object columns mixing e.g. ints and strings (common in Excel) can't be
+    # stored as a single Arrow type, so keep them as text
+    mixed = [
+        col for col in df.columns
+        if df[col].dtype == object
+        and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed')
+    ]
+    if not mixed:
+        return df
+
+    df = df.copy()
+    for col in mixed:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
@@ -0,0 +1,234 @@
+# api/services/transforms.py
+import re
+
+import pandas as pd
+from django.conf import settings
+
+from .dtypes import mentioned_columns, widen_columns
+from .filter_plan import parse_query
+from .math_engine import MathEngine
+from .regex_engine import RegexEngine, RegexTimeout, UnsafePattern
+
+# Every transform is row-local: applying it to each row batch of a file and
+# concatenating the results gives the same frame as applying it to the whole
+# file. This is what lets the streaming engine process files in chunks. The
+# batches keep their rows' labels in the whole file, so a query on `index`
+# sees the same row numbers either way.
+
+
+class TransformError(ValueError):
+    """The operation itself is invalid for this data (HTTP 400)"""
+    pass
+
+
+def apply_regex(df: pd.DataFrame, regex: str, replacement: str = '',
+                column: str = None) -> pd.DataFrame:
+    _check_regex(regex)
+    replacement = replacement if replacement is not None else ''
+
+    # --- LOGIC TO APPLY TO SPECIFIC COLUMN ---
+    if column:
+        if column not in df.columns:
+            # If LLM hallucinated a column name, fail so the user knows
+            raise TransformError(f"Column '{column}' not found in file")
+
+        # Apply ONLY to this column
+        return _replace(df, regex, replacement, columns=[column])
+
+    # Apply Globally (columns whose type can't match are left untouched)
+    return _replace(df, regex, replacement)
+
+
+def _check_regex(regex: str):
+    try:
+        RegexEngine.compile(regex)
+    except UnsafePattern as e:
+        raise TransformError(f"Regex rejected: {str(e)}")
+    except re.error as e:
+        raise TransformError(f"Invalid regex pattern: {str(e)}")
+
+
+def _replace(df, regex, replacement, columns=None):
+    try:
+        return RegexEngine.replace(df, regex, replacement, columns=columns)
+    except RegexTimeout:
+        raise TransformError(
+            f"Regex took longer than {settings.REGEX_TIME_BUDGET:g}s and was "
+            f"stopped, try a more specific pattern"
+        )
+
+
+def apply_filter(df: pd.DataFrame, query: str) -> pd.DataFrame:
+    # Using query() is safer than exec() but still powerful
+    try:
+        # Pandas query requires backticks for column names with spaces,
+        # the LLM usually handles this
+        wide = widen_columns(df, mentioned_columns(df, query))
+        if wide is df:
+            return df.query(query)
+        # Evaluated on the usual dtypes (no int8 overflow, categoricals
+        # compare like text), the compact rows are kept
+        return df.loc[wide.eval(query)]
+    except Exception as e:
+        raise TransformError(f"Invalid Filter Logic: {str(e)}")
+
+
+def check_filter(query: str, profile: dict = None):
+    """
+    Raises TransformError for a query that can't run: bad syntax, or with
+    the version's profile, names that aren't columns. Nothing is read, it
+    runs on an empty frame of the profiled dtypes.
+    """
+    try:
+        parse_query(query)
+    except SyntaxError as e:
+        raise TransformError(f"Invalid Filter Logic: {str(e)}")
+
+    columns = (profile or {}).get('columns')
+    if columns:
+        apply_filter(pd.DataFrame({
+            column['name']: pd.Series(dtype=_empty_dtype(column['dtype']))
+            for column in columns
+        }), query)
+
+
+def _empty_dtype(name):
+    try:
+        return pd.api.types.pandas_dtype(name)
+    except TypeError:
+        return object
+
+
+def apply_math(df: pd.DataFrame, expression: str) -> pd.DataFrame:
+    # The LLM returns format: "`New Col` = `Old Col` * 2", possibly several
+    # assignments separated by ';' or newlines
+    try:
+        return MathEngine.apply(df, expression)
+    except Exception as e:
+        raise TransformError(f"Math Operation Failed: {str(e)}")
+
+
+# Operation specs are the JSON form of a transform, as accepted by the
+# Apply* views: {"op": "regex", "regex": ..., "replacement": ...,
+# "column": ...}, {"op": "filter", "filter_query": ...} or
+# {"op": "math", "expression": ...}. A recipe chains several of them:
+# {"op": "recipe", "operations": [...]}. Specs are what gets stored for
+# jobs, lazy versions and saved recipes.
+
+# Prefix for the filename of the version an operation creates
+VERSION_PREFIXES = {
+    'regex': 'v_edited_',
+    'filter': 'v_filtered_',
+    'math': 'v_math_',
+    'recipe': 'v_recipe_',
+}
+
+# How many rows of the result each operation sends back for the preview
+PREVIEW_ROWS = {
+    'regex': 200,
+    'filter': 50,
+    'math': 50,
+    'recipe': 50,
+}
+
+
+def build_transform(spec: dict):
+    """Returns a DataFrame -> DataFrame callable for an operation spec"""
+    op = spec.get('op')
+
+    if op == 'regex':
+        regex = _required(spec, 'regex')
+        # Rejected before any data is read (jobs, recipes, lazy versions)
+        _check_regex(regex)
+        replacement = spec.get('replacement', '')
+        column = spec.get('column')
+        return lambda df: apply_regex(df, regex, replacement, column)
+    if op == 'filter':
+        query = _required(spec, 'filter_query')
+        check_filter(query)
+        return lambda df: apply_filter(df, query)
+    if op == 'math':
+        expression = _required(spec, 'expression')
+        return lambda df: apply_math(df, expression)
+    if op == 'recipe':
+        return build_pipeline(spec.get('operations'))
+
+    raise TransformError(f"Unknown operation '{op}'")
+
+
+def build_pipeline(specs: list):
+    """
+    One callable running every operation in order over the same frame (or
+    batch), so the data is only loaded and written once.
+    """
+    if not isinstance(specs, list) or not specs:
+        raise TransformError("A recipe needs a non-empty list of operations")
+
+    transforms = [build_transform(spec) for spec in fuse_operations(specs)]
+
+    def pipeline(df):
+        for transform in transforms:
+            df = transform(df)
+        return df
+    return pipeline
+
+
+def fuse_operations(specs: list) -> list:
+    """Merge adjacent filters into a single query() pass"""
+    fused = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise TransformError("Each operation must be an object")
+
+        if spec.get('op') == 'filter':
+            # Before fusing, which would hide a missing query
+            _required(spec, 'filter_query')
+
+        previous = fused[-1] if fused else None
+        if spec.get('op') == 'filter' and previous \
+                and previous.get('op') == 'filter':
+            fused[-1] = {
+                'op': 'filter',
+                'filter_query': f"({previous['filter_query']}) and "
+                                f"({spec['filter_query']})",
+            }
+        else:
+            fused.append(spec)
+    return fused
+
+
+def written_columns(specs: list):
+    """
+    The columns a list of operations rewrites or adds, in the order they
+    are first written, when every other column of the result is the input
+    unchanged (same rows too). None for filters, regex over all columns and
+    anything else that can touch every column.
+    """
+    columns = []
+    for spec in specs:
+        op = spec.get('op')
+        if op == 'regex' and spec.get('column'):
+            written = [spec['column']]
+        elif op == 'math':
+            try:
+                program = MathEngine.compile(spec.get('expression'))
+            except Exception:
+                return None
+            written = [statement.target for statement in program.statements]
+            if program.legacy is not None or None in written:
+                return None
+        elif op == 'recipe':
+            written = written_columns(spec.get('operations') or [])
+            if written is None:
+                return None
+        else:
+            return None
+
+        columns.extend(column for column in written if column not in columns)
+    return columns
+
+
+def _required(spec: dict, key: str):
+    if not spec.get(key):
+        raise TransformError(f"Operation '{spec.get('op')}' needs '{key}'")
+    return spec[key]
@@ -0,0 +1,437 @@
+# api/services/uploads.py
+import hashlib
+import pickle
+import shutil
+import tempfile
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from ..models import UploadedDocument, UploadSession
+from .profile import ProfileAccumulator
+from .store import (
+    WORKING_COMPRESSION, DocumentStore, S3RangeReader, UnsupportedFileType,
+    _coerce_mixed_columns,
+)
+
+SOURCE_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+# S3 rejects multipart parts smaller than this, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10_000
+
+
+class UploadError(ValueError):
+    pass
+
+
+class ChunkedUploadService:
+    """
+    Resumable uploads: initiate(), put_part() for parts numbered from 1
+    (sending a part again replaces it, so a client resumes by re-sending
+    whatever GET on the session doesn't list), then complete().
+
+    CSV parts are parsed and profiled as soon as every part before them is
+    in, one Parquet segment per part: a part that fills a gap also parses
+    the parts received early after it. complete() then only stitches the
+    segments into the working copy. Excel is a zip and can only be read
+    once whole.
+    """
+
+    @staticmethod
+    def initiate(filename: str) -> UploadSession:
+        filename = (filename or '').split('/')[-1]
+        if not filename.lower().endswith(SOURCE_EXTENSIONS):
+            raise UnsupportedFileType("Unsupported file type")
+
+        name = default_storage.get_available_name(
+            UploadedDocument._meta.get_field('file')
+            .generate_filename(None, filename)
+        )
+        session = UploadSession(filename=filename, name=name)
+        if _on_s3():
+            session.multipart_id = _client().create_multipart_upload(
+                Bucket=default_storage.bucket_name, Key=_key(name)
+            )['UploadId']
+        session.save()
+        return session
+
+    @staticmethod
+    def put_part(session, number: int, data: bytes) -> dict:
+        _check_open(session)
+        if not 1 <= number <= MAX_PARTS:
+            raise UploadError(f"Part number must be between 1 and "
+                              f"{MAX_PARTS}")
+        if not data:
+            raise UploadError("Empty part")
+
+        part = {'size': len(data), 'md5': hashlib.md5(data).hexdigest()}
+        previous = session.parts.get(str(number))
+        if previous and number <= session.parsed_parts \
+                and previous['md5'] != part['md5']:
+            # Its rows are already parsed
+            raise UploadError(f"Part {number} was already received with "
+                              f"different content")
+
+        if session.multipart_id:
+            part['etag'] = _client().upload_part(
+                Bucket=default_storage.bucket_name,
+                Key=_key(session.name),
+                UploadId=session.multipart_id,
+                PartNumber=number,
+                Body=data,
+            )['ETag']
+            if _is_csv(session) and number > session.parsed_parts + 1:
+                # Parsed once the parts before it are in, and S3 can't
+                # read back the parts of an unfinished upload
+                part['name'] = _stage(session, number, data)
+            elif previous and 'name' in previous:
+                default_storage.delete(previous['name'])
+        else:
+            part['name'] = _stage(session, number, data)
+
+        error = None
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update() \
+                .get(pk=session.pk)
+            _check_open(session)
+            session.parts[str(number)] = part
+            try:
+                if _is_csv(session) and number == session.parsed_parts + 1:
+                    _parse(session, data)
+                    session.parsed_parts = number
+                    # Parts that came early and are next in line now
+                    while str(session.parsed_parts + 1) in session.parts:
+                        following = session.parsed_parts + 1
+                        _parse(session, _read_staged(
+                            session.parts[str(following)]
+                        ))
+                        session.parsed_parts = following
+            except Exception as e:
+                # The file is broken: the rest of it can't be read either
+                error = e
+                _abort(session)
+            else:
+                session.save()
+
+        if error is not None:
+            raise _unreadable(session, error)
+        return part
+
+    @staticmethod
+    def complete(session) -> UploadedDocument:
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update() \
+                .get(pk=session.pk)
+            _check_open(session)
+            numbers = _check_parts(session)
+
+            name = _assemble(session, numbers)
+            document = UploadedDocument(file=name, filename=session.filename)
+            error = None
+            try:
+                if _is_csv(session):
+                    _finish_csv(session, document)
+                else:
+                    document.save()
+                    DocumentStore.convert_original(document)
+            except Exception as e:
+                error = e
+                if document.pk:
+                    document.delete()
+                # The parts are joined already: drop the file instead
+                default_storage.delete(name)
+                session.multipart_id = ''
+                _abort(session)
+            else:
+                session.status = UploadSession.COMPLETED
+                session.document = document
+                session.tail = b''
+                session.accumulator = None
+                _delete_staged(session)
+                session.save()
+
+        if error is not None:
+            raise _unreadable(session, error)
+        return document
+
+    @staticmethod
+    def abort(session):
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update() \
+                .get(pk=session.pk)
+            _check_open(session)
+            _abort(session)
+
+
+def _on_s3():
+    return isinstance(default_storage, S3Boto3Storage)
+
+
+def _client():
+    return default_storage.connection.meta.client
+
+
+def _key(name):
+    location = default_storage.location
+    return f"{location}/{name}" if location else name
+
+
+def _prefix(session):
+    # Staged parts and parsed segments
+    return f"uploads/parts/{session.id}"
+
+
+def _stage(session, number, data):
+    name = f"{_prefix(session)}/{number:05d}"
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(data))
+
+
+def _read_staged(part) -> bytes:
+    with default_storage.open(part['name'], 'rb') as handle:
+        return handle.read()
+
+
+def _is_csv(session):
+    return session.filename.lower().endswith('.csv')
+
+
+def _check_open(session):
+    if session.status != UploadSession.OPEN:
+        raise UploadError(f"Upload {session.id} is {session.status}")
+
+
+def _check_parts(session):
+    numbers = sorted(int(number) for number in session.parts)
+    if not numbers:
+        raise UploadError("No parts uploaded")
+    missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+    if missing:
+        raise UploadError(f"Missing parts: {missing}")
+
+    if session.multipart_id:
+        small = [number for number in numbers[:-1]
+                 if session.parts[str(number)]['size'] < MIN_PART_SIZE]
+        if small:
+            raise UploadError(f"Parts {small} are smaller than "
+                              f"{MIN_PART_SIZE} bytes; only the last part "
+                              f"may be")
+    return numbers
+
+
+def _assemble(session, numbers):
+    """Join the parts into the original upload, returns its storage name"""
+    if session.multipart_id:
+        _client().complete_multipart_upload(
+            Bucket=default_storage.bucket_name,
+            Key=_key(session.name),
+            UploadId=session.multipart_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': number,
+                 'ETag': session.parts[str(number)]['etag']}
+                for number in numbers
+            ]},
+        )
+        return session.name
+
+    with tempfile.TemporaryFile() as spool:
+        for number in numbers:
+            with default_storage.open(session.parts[str(number)]['name'],
+                                      'rb') as part:
+                shutil.copyfileobj(part, spool)
+        spool.seek(0)
+        return default_storage.save(session.name, File(spool))
+
+
+def _abort(session):
+    if session.multipart_id:
+        _client().abort_multipart_upload(
+            Bucket=default_storage.bucket_name,
+            Key=_key(session.name),
+            UploadId=session.multipart_id,
+        )
+    _delete_staged(session)
+    session.status = UploadSession.ABORTED
+    session.save()
+
+
+def _delete_staged(session):
+    names = list(session.segments) + [
+        part['name'] for part in session.parts.values() if 'name' in part
+    ]
+    for name in names:
+        default_storage.delete(name)
+
+
+def _unreadable(session, error):
+    if isinstance(error, UploadError):
+        return error
+    return UploadError(f"Could not read {session.filename}: {error}")
+
+
+def _parse(session, data):
+    """Parse the complete lines of the next piece of the file"""
+    lines, tail = _split_lines(bytes(session.tail) + data)
+    session.tail = tail
+    session.parsed_bytes += len(data)
+    if lines:
+        _parse_rows(session, lines)
+
+
+def _parse_rows(session, data):
+    if session.columns is None:
+        df = pd.read_csv(BytesIO(data))
+        df.columns = [str(c) for c in df.columns]
+        session.columns = list(df.columns)
+    else:
+        df = pd.read_csv(BytesIO(data), header=None,
+                         names=session.columns, index_col=False)
+
+    accumulator = pickle.loads(session.accumulator) \
+        if session.accumulator else ProfileAccumulator()
+    session.accumulator = pickle.dumps(accumulator.update(df))
+
+    if len(df):
+        buffer = BytesIO()
+        _coerce_mixed_columns(df).to_parquet(
+            buffer, index=False, compression=WORKING_COMPRESSION
+        )
+        session.segments.append(default_storage.save(
+            f"{_prefix(session)}/rows-{len(session.segments):05d}.parquet",
+            ContentFile(buffer.getvalue()),
+        ))
+
+
+def _split_lines(data: bytes):
+    """(complete lines, rest): newlines inside quoted fields don't count"""
+    end = len(data)
+    quotes = data.count(b'"')
+    while True:
+        newline = data.rfind(b'\n', 0, end)
+        if newline < 0:
+            return b'', data
+        quotes -= data.count(b'"', newline, end)
+        if quotes % 2 == 0:
+            return data[:newline + 1], data[newline + 1:]
+        end = newline
+
+
+def _finish_csv(session, document):
+    # Every part is parsed by now, unless the session predates parsing
+    # parts once the gap before them is filled: read the rest back
+    with DocumentStore.open_ranged(document.file) as handle:
+        handle.seek(session.parsed_bytes)
+        while True:
+            piece = handle.read(settings.UPLOAD_PART_SIZE)
+            if not piece:
+                break
+            _parse(session, piece)
+    if bytes(session.tail).strip():
+        # Last line without a newline
+        _parse_rows(session, bytes(session.tail))
+    if session.columns is None:
+        raise UploadError("No columns to parse from file")
+
+    writer = DocumentStore.open_version_writer(session.filename)
+    try:
+        schema = _write_segments(session, writer)
+    except Exception:
+        writer.abort()
+        raise
+    DocumentStore.commit_working_copy(document, writer)
+
+    profile = pickle.loads(session.accumulator).result()
+    # Segments may disagree on a column's type; report the final one
+    dtypes = schema.empty_table().to_pandas().dtypes
+    for column in profile['columns']:
+        column['dtype'] = str(dtypes[column['name']])
+    document.profile = profile
+    document.save()
+
+
+def _write_segments(session, writer) -> pa.Schema:
+    """Copy the segments into the working copy in full row groups"""
+    schemas = []
+    for name in session.segments:
+        with _open(name) as handle:
+            schemas.append(pq.ParquetFile(handle).schema_arrow)
+    schema = _unify(session.columns, schemas)
+
+    row_group_rows = settings.WORKING_ROW_GROUP_ROWS
+    parquet_writer = pq.ParquetWriter(
+        writer, schema, compression=WORKING_COMPRESSION
+    )
+    pending = schema.empty_table()
+    for name in session.segments:
+        with _open(name) as handle:
+            table = pq.ParquetFile(handle).read(columns=session.columns)
+        pending = pa.concat_tables([pending, _cast(table, schema)])
+        full = pending.num_rows - pending.num_rows % row_group_rows
+        if full:
+            parquet_writer.write_table(pending.slice(0, full),
+                                       row_group_size=row_group_rows)
+            writer.digest.update(pending.slice(0, full).to_pandas())
+            pending = pending.slice(full)
+    parquet_writer.write_table(pending, row_group_size=row_group_rows)
+    writer.digest.update(pending.to_pandas())
+    parquet_writer.close()
+    return schema
+
+
+def _cast(table, schema) -> pa.Table:
+    columns = []
+    for field in schema:
+        column = table.column(field.name)
+        if pa.types.is_string(field.type) \
+                and not pa.types.is_string(column.type) \
+                and not pa.types.is_null(column.type):
+            # Spelled as pandas does (True, not Arrow's true)
+            values = column.to_pandas()
+            column = pa.array(values.astype(str).where(values.notna()),
+                              type=pa.string(), from_pandas=True)
+        else:
+            column = column.cast(field.type, safe=False)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _unify(columns, schemas) -> pa.Schema:
+    """
+    One type per column over all segments: numbers that were ints in some
+    parts and floats in others become floats, other disagreements text
+    (as pandas does when it reads the whole file at once)
+    """
+    if not schemas:
+        return pa.Schema.from_pandas(pd.DataFrame(columns=columns),
+                                     preserve_index=False)
+
+    fields = []
+    for column in columns:
+        types = {schema.field(column).type for schema in schemas} \
+            - {pa.null()}
+        if not types:
+            type_ = pa.null()
+        elif len(types) == 1:
+            type_ = types.pop()
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t)
+                 for t in types):
+            type_ = pa.float64()
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(column, type_))
+    return pa.schema(fields)
+
+
+def _open(name):
+    if _on_s3():
+        return S3RangeReader(default_storage, name)
+    return default_storage.open(name, 'rb')
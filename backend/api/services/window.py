@@ -0,0 +1,189 @@
+# api/services/window.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .cache import frame_cache, frame_key
+from .engine import TransformEngine
+from .store import DocumentStore
+
+# Sort orders of recently paged columns: (document id, column, descending)
+# -> row positions. Versions never change once written, so entries only
+# age out.
+SORT_INDEX_ENTRIES = 4
+
+_sort_index = OrderedDict()
+_sort_lock = threading.Lock()
+
+
+class InvalidWindow(ValueError):
+    pass
+
+
+class RowWindow:
+    """
+    Any window of rows of a version, optionally sorted by one column,
+    without parsing the rows before it:
+
+    - cached versions are sliced in memory,
+    - materialized versions use the Parquet footer (row counts per row
+      group) as a row index and only read the row groups the window
+      overlaps; sorting reads just the sort column once,
+    - large lazy versions are streamed until the window is reached.
+    """
+
+    @staticmethod
+    def fetch(document, offset: int, limit: int, sort: str = None,
+              descending: bool = False):
+        """
+        Returns (df, total_rows). total_rows is None when it isn't known
+        without computing the whole version.
+        """
+        cached = frame_cache.get(frame_key(document), copy=False)
+        if cached is not None:
+            return _frame_window(
+                document, cached, offset, limit, sort, descending
+            )
+
+        if document.working_file:
+            return _parquet_window(document, offset, limit, sort, descending)
+
+        if not document.is_materialized and not sort \
+                and TransformEngine.should_stream(document):
+            return _stream_window(document, offset, limit)
+
+        # Small lazy versions and legacy uploads: load once (this caches it)
+        df = DocumentStore.load(document)
+        return _frame_window(document, df, offset, limit, sort, descending)
+
+
+def _frame_window(document, df, offset, limit, sort, descending):
+    if sort:
+        _check_column(sort, df.columns)
+        positions = _sort_positions(
+            document.id, sort, descending, lambda: df[sort]
+        )[offset:offset + limit]
+    else:
+        positions = np.arange(offset, min(offset + limit, len(df)))
+    return df.iloc[positions].copy(), len(df)
+
+
+def _parquet_window(document, offset, limit, sort, descending):
+    if sort and document.delta_base_id is not None:
+        _check_column(sort, DocumentStore.working_schema(document).names)
+
+    with DocumentStore.open_working_copy(document) as handle:
+        parquet = pq.ParquetFile(handle, pre_buffer=True)
+        total_rows = parquet.metadata.num_rows
+
+        if sort:
+            if document.delta_base_id is None:
+                _check_column(sort, parquet.schema_arrow.names)
+            positions = _sort_positions(
+                document.id, sort, descending,
+                lambda: _read_column(document, parquet, sort),
+            )[offset:offset + limit]
+        else:
+            positions = np.arange(offset, min(offset + limit, total_rows))
+
+        df = _read_rows(parquet, positions)
+
+    if document.delta_base_id is not None:
+        df = DocumentStore.compose(_take(document.delta_base, positions), df)
+    return df, total_rows
+
+
+def _take(document, positions) -> pd.DataFrame:
+    """Rows at positions of a materialized version, in that order"""
+    with DocumentStore.open_working_copy(document) as handle:
+        df = _read_rows(pq.ParquetFile(handle, pre_buffer=True), positions)
+    if document.delta_base_id is None:
+        return df
+    return DocumentStore.compose(_take(document.delta_base, positions), df)
+
+
+def _read_rows(parquet, positions) -> pd.DataFrame:
+    """Only reads the row groups the positions fall into"""
+    if not len(positions):
+        return parquet.schema_arrow.empty_table().to_pandas()
+
+    # First row of each row group
+    metadata = parquet.metadata
+    starts = np.cumsum([0] + [
+        metadata.row_group(i).num_rows
+        for i in range(metadata.num_row_groups)
+    ])
+    groups = np.searchsorted(starts, positions, side='right') - 1
+
+    pieces = []
+    requested = []
+    for group in np.unique(groups):
+        members = np.flatnonzero(groups == group)
+        table = parquet.read_row_group(int(group))
+        pieces.append(table.take(positions[members] - starts[group]))
+        requested.append(members)
+
+    # Put the rows back in the order they were asked for
+    table = pa.concat_tables(pieces)
+    table = table.take(np.argsort(np.concatenate(requested)))
+    return table.to_pandas()
+
+
+def _read_column(document, parquet, column):
+    # A delta only stores some columns, the others come from its base
+    if column in parquet.schema_arrow.names:
+        return parquet.read(columns=[column]).column(0).to_pandas()
+    base = document.delta_base
+    with DocumentStore.open_working_copy(base) as handle:
+        return _read_column(base, pq.ParquetFile(handle), column)
+
+
+def _stream_window(document, offset, limit):
+    pieces = []
+    seen = 0
+    for batch in TransformEngine.iter_batches(document):
+        start = max(offset - seen, 0)
+        seen += len(batch)
+        if start < len(batch):
+            pieces.append(batch.iloc[start:start + limit])
+            limit -= len(pieces[-1])
+        if limit <= 0:
+            # Stopped early: the total isn't known
+            return pd.concat(pieces), None
+
+    if not pieces:
+        return TransformEngine.preview(document, 0), seen
+    return pd.concat(pieces), seen
+
+
+def _sort_positions(document_id, column, descending, load_column):
+    """Row positions of the version ordered by column (nulls last)"""
+    key = (document_id, column, descending)
+    with _sort_lock:
+        if key in _sort_index:
+            _sort_index.move_to_end(key)
+            return _sort_index[key]
+
+    values = load_column().reset_index(drop=True)
+    try:
+        positions = values.sort_values(
+            ascending=not descending, kind='stable', na_position='last'
+        ).index.to_numpy()
+    except TypeError:
+        raise InvalidWindow(f"Column '{column}' has values that can't be "
+                            f"compared to each other")
+
+    with _sort_lock:
+        _sort_index[key] = positions
+        while len(_sort_index) > SORT_INDEX_ENTRIES:
+            _sort_index.popitem(last=False)
+    return positions
+
+
+def _check_column(column, columns):
+    if column not in columns:
+        raise InvalidWindow(f"Column '{column}' not found in file")
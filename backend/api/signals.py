@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import UploadedDocument
+from .services.cache import frame_cache, frame_key
+
+
+@receiver(post_delete, sender=UploadedDocument)
+def invalidate_cached_frame(sender, instance, **kwargs):
+    frame_cache.invalidate(instance.id)
+    # Content shared with other documents stays cached
+    if instance.content_hash and not UploadedDocument.objects.filter(
+        content_hash=instance.content_hash
+    ).exists():
+        frame_cache.invalidate(frame_key(instance))
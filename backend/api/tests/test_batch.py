@@ -0,0 +1,54 @@
+# api/tests/test_batch.py
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+
+from api.services import batch
+from api.services.batch import BatchApply
+from api.services.store import DocumentStore
+from api.services.transforms import TransformError
+from api.tests.utils import StoreTestCase
+
+SPEC = {'op': 'regex', 'regex': 'a', 'replacement': 'b', 'column': 'x'}
+
+
+# Never start a pool here: its processes wouldn't use the test database
+@override_settings(BATCH_WORKERS=1)
+class BatchApplyTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = []
+        for index in range(3):
+            document, _ = DocumentStore.create_from_upload(SimpleUploadedFile(
+                f'f{index}.csv',
+                pd.DataFrame({'x': ['a', 'ca'], 'n': [index, 1]})
+                .to_csv(index=False).encode(),
+            ))
+            self.ids.append(document.id)
+
+    def test_result_per_file(self):
+        results = BatchApply.run(self.ids + [0], SPEC, mode='memory')
+        self.assertEqual(list(results), self.ids + [0])
+        for document_id in self.ids:
+            self.assertEqual(results[document_id]['status'], 'ok')
+            new_id = results[document_id]['new_file_id']
+            self.assertNotEqual(new_id, document_id)
+        self.assertEqual(results[0], {
+            'status': 'failed', 'error': 'File 0 not found',
+            'seconds': results[0]['seconds'],
+        })
+
+    def test_invalid_spec_is_rejected_before_any_file(self):
+        with self.assertRaises(TransformError):
+            BatchApply.run(self.ids, {'op': 'regex', 'regex': '(a+)+$'})
+
+    def test_pool_only_for_enough_eager_work(self):
+        with override_settings(BATCH_WORKERS=4, BATCH_PARALLEL_MIN_BYTES=0):
+            self.assertTrue(batch._worth_a_pool(self.ids, 'memory'))
+            self.assertFalse(batch._worth_a_pool(self.ids, 'lazy'))
+            self.assertFalse(batch._worth_a_pool(self.ids[:1], 'memory'))
+            with override_settings(LAZY_VERSIONS=True):
+                self.assertFalse(batch._worth_a_pool(self.ids, None))
+        with override_settings(BATCH_WORKERS=4,
+                               BATCH_PARALLEL_MIN_BYTES=1 << 30):
+            self.assertFalse(batch._worth_a_pool(self.ids, 'memory'))
@@ -0,0 +1,36 @@
+# api/tests/test_cache.py
+from io import BytesIO
+
+import pandas as pd
+from django.test import SimpleTestCase, override_settings
+
+from api.services.cache import FrameCache
+from api.services.dtypes import compact_frame
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'frames': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'frame-tests',
+    },
+})
+class SharedFrameCacheTests(SimpleTestCase):
+    def test_frames_from_another_worker_are_compacted(self):
+        plain = pd.DataFrame({
+            'city': ['Oslo', 'Lima'] * 500, 'n': range(1000),
+        })
+        buffer = BytesIO()
+        plain.to_parquet(buffer, index=False)
+
+        # Put by another worker: only the shared copy is here
+        FrameCache(10 ** 8, 'frames').put('key', plain, buffer.getvalue())
+        cache = FrameCache(10 ** 8, 'frames')
+        self.assertNotIn('key', cache)
+
+        df = cache.get('key')
+        pd.testing.assert_series_equal(df.dtypes, compact_frame(plain).dtypes)
+        self.assertIn('key', cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
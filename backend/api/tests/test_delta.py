@@ -0,0 +1,112 @@
+# api/tests/test_delta.py
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+
+from api.services.cache import frame_cache
+from api.services.engine import TransformEngine
+from api.services.store import DocumentStore
+from api.services.transforms import build_pipeline
+from api.tests.utils import StoreTestCase
+
+FRAME = pd.DataFrame({
+    'n': range(120),
+    'name': [f"N{i}" if i % 3 else f"A{i}" for i in range(120)],
+    'city': ['Oslo', 'Lima', 'Rome'] * 40,
+})
+REGEX = {'op': 'regex', 'regex': r'^N', 'replacement': 'X',
+         'column': 'name'}
+MATH = {'op': 'math', 'expression': '`m` = `n` * 2'}
+
+
+@override_settings(LAZY_VERSIONS=False, DELTA_VERSIONS=True,
+                   WORKING_ROW_GROUP_ROWS=40, STREAMING_CHUNK_ROWS=25)
+class DeltaVersionTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('people.csv',
+                               FRAME.to_csv(index=False).encode())
+        )
+
+    def stored_columns(self, document):
+        with DocumentStore.open_working_copy(document) as handle:
+            return pq.ParquetFile(handle).schema_arrow.names
+
+    def assertLoads(self, document, specs):
+        expected = build_pipeline(specs)(FRAME.copy())
+        frame_cache.clear()
+        pd.testing.assert_frame_equal(
+            DocumentStore.load(document).astype(object),
+            expected.astype(object),
+        )
+
+    def test_column_edits_store_only_their_columns(self):
+        for mode in ('memory', 'chunked'):
+            for spec, columns in ((REGEX, ['name']), (MATH, ['m'])):
+                with self.subTest(mode=mode, op=spec['op']):
+                    version, _ = TransformEngine.apply(
+                        self.document, spec, mode
+                    )
+                    self.assertEqual(version.delta_base_id,
+                                     self.document.id)
+                    self.assertEqual(self.stored_columns(version), columns)
+                    self.assertLoads(version, [spec])
+
+    def test_chain_of_deltas(self):
+        first, _ = TransformEngine.apply(self.document, REGEX, 'memory')
+        second, _ = TransformEngine.apply(first, MATH, 'chunked')
+        self.assertEqual(second.delta_base_id, first.id)
+        self.assertEqual(DocumentStore.delta_depth(second), 2)
+        self.assertLoads(second, [REGEX, MATH])
+
+        batches = pd.concat(TransformEngine.iter_batches(second))
+        self.assertEqual(batches['name'].tolist(),
+                         build_pipeline([REGEX])(FRAME.copy())['name']
+                         .tolist())
+
+    def test_row_changes_and_no_ops_are_not_deltas(self):
+        filtered, _ = TransformEngine.apply(
+            self.document, {'op': 'filter', 'filter_query': 'n > 5'},
+            'memory',
+        )
+        self.assertIsNone(filtered.delta_base_id)
+
+        # Nothing matches: same content as the parent, stored once
+        same, _ = TransformEngine.apply(
+            self.document, dict(REGEX, regex='^Z'), 'memory'
+        )
+        self.assertIsNone(same.delta_base_id)
+        self.assertEqual(same.content_hash, self.document.content_hash)
+
+    @override_settings(DELTA_MAX_DEPTH=1)
+    def test_depth_is_capped(self):
+        first, _ = TransformEngine.apply(self.document, REGEX, 'memory')
+        second, _ = TransformEngine.apply(first, MATH, 'memory')
+        self.assertEqual(first.delta_base_id, self.document.id)
+        self.assertIsNone(second.delta_base_id)
+        self.assertLoads(second, [REGEX, MATH])
+
+    def test_reads_compose_the_delta(self):
+        version, _ = TransformEngine.apply(self.document, MATH, 'memory')
+        expected = build_pipeline([MATH])(FRAME.copy())
+        frame_cache.clear()
+
+        response = self.client.get(reverse('preview', args=[version.id]),
+                                   {'offset': 60, 'limit': 5})
+        self.assertEqual(response.json()['data'][0],
+                         {'n': 60, 'name': 'A60', 'city': 'Oslo', 'm': 120})
+
+        response = self.client.get(
+            reverse('download-file', args=[version.id]),
+            {'format': 'csv', 'redirect': '0'},
+        )
+        downloaded = pd.read_csv(BytesIO(b''.join(
+            response.streaming_content
+        )))
+        pd.testing.assert_frame_equal(downloaded, expected,
+                                      check_dtype=False)
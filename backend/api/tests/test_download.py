@@ -0,0 +1,127 @@
+# api/tests/test_download.py
+import gzip
+from io import BytesIO
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+
+from api.services.download import DownloadService
+from api.services.engine import TransformEngine
+from api.services.store import DocumentStore
+from api.services.transforms import TransformError
+from api.tests.utils import StoreTestCase
+
+CSV = b'name,n\nOslo,1\nLima,2\n'
+
+
+class DownloadErrorTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('cities.csv', CSV)
+        )
+        self.url = reverse('download-file', args=[self.document.id])
+
+    def test_missing_file_is_404(self):
+        response = self.client.get(reverse('download-file', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_format_is_400(self):
+        response = self.client.get(self.url, {'format': 'docx'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failing_version_is_400(self):
+        with mock.patch.object(DownloadService, 'prepare',
+                               side_effect=TransformError("Bad query")):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': "Bad query"})
+
+    def test_unexpected_error_is_500(self):
+        with mock.patch.object(DownloadService, 'prepare',
+                               side_effect=OSError("Disk gone")), \
+                self.assertLogs('api.views', 'ERROR'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 500)
+
+
+def _body(response):
+    return b''.join(response.streaming_content)
+
+
+@override_settings(LAZY_VERSIONS=False)
+class DownloadTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('cities.csv', CSV)
+        )
+
+    def get(self, document=None, headers=None, **params):
+        return self.client.get(
+            reverse('download-file', args=[(document or self.document).id]),
+            {'redirect': '0', **params}, headers=headers or {},
+        )
+
+    def test_byte_ranges(self):
+        for header, expected, content_range in (
+            ('bytes=0-3', CSV[:4], f'bytes 0-3/{len(CSV)}'),
+            ('bytes=7-', CSV[7:], f'bytes 7-{len(CSV) - 1}/{len(CSV)}'),
+            ('bytes=-5', CSV[-5:],
+             f'bytes {len(CSV) - 5}-{len(CSV) - 1}/{len(CSV)}'),
+        ):
+            with self.subTest(header=header):
+                response = self.get(headers={'Range': header})
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], content_range)
+                self.assertEqual(_body(response), expected)
+
+        response = self.get(headers={'Range': f'bytes={len(CSV)}-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(CSV)}')
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(CSV))
+        self.assertEqual(_body(response), CSV)
+
+    def test_compressed_round_trips(self):
+        decompress = {
+            'gzip': gzip.decompress,
+            'zstd': lambda data: pa.input_stream(
+                BytesIO(data), compression='zstd'
+            ).read(),
+        }
+        for encoding, accept in (('zstd', 'gzip, zstd'),
+                                 ('gzip', 'gzip;q=1, zstd;q=0')):
+            with self.subTest(encoding=encoding):
+                response = self.get(headers={'Accept-Encoding': accept})
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(decompress[encoding](_body(response)), CSV)
+
+    def test_conversions(self):
+        version, _ = TransformEngine.apply(
+            self.document, {'op': 'filter', 'filter_query': 'n > 1'}
+        )
+        expected = pd.DataFrame({'name': ['Lima'], 'n': [2]})
+        readers = {
+            'csv': pd.read_csv,
+            'xlsx': pd.read_excel,
+            'parquet': pd.read_parquet,
+        }
+        for fmt, read in readers.items():
+            with self.subTest(format=fmt):
+                response = self.get(version, format=fmt)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(f'.{fmt}"', response['Content-Disposition'])
+                pd.testing.assert_frame_equal(
+                    read(BytesIO(_body(response))), expected,
+                    check_dtype=False,
+                )
@@ -0,0 +1,176 @@
+# api/tests/test_engine.py
+from unittest import mock
+
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+
+from api.services.cache import frame_cache
+from api.services.engine import TransformEngine
+from api.services.store import DocumentStore
+from api.tests.utils import StoreTestCase
+
+
+def _upload(df, name='cities.csv'):
+    document, _ = DocumentStore.create_from_upload(
+        SimpleUploadedFile(name, df.to_csv(index=False).encode())
+    )
+    return document
+
+
+class PushdownFilterTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        # Few distinct cities: stored as a dictionary, read as categoricals
+        self.df = pd.DataFrame({
+            'city': ['Oslo', 'Lima', 'Rome', 'Kyiv'] * 50,
+            'n': range(200),
+        })
+        self.document = _upload(self.df)
+        frame_cache.clear()
+
+    def _filter(self, mode):
+        spec = {'op': 'filter', 'filter_query': "city > 'M'"}
+        new_document, _ = TransformEngine.apply(
+            self.document, spec, mode=mode
+        )
+        frame_cache.clear()
+        if mode == 'lazy':
+            new_document = TransformEngine.materialize(new_document)
+        return DocumentStore.load(new_document)
+
+    def test_ordered_comparison_on_categorical(self):
+        expected = self.df[self.df['city'] > 'M'].reset_index(drop=True)
+        for mode in ('lazy', 'chunked', 'memory'):
+            with self.subTest(mode=mode):
+                result = self._filter(mode).reset_index(drop=True)
+                self.assertEqual(len(result), 100)
+                pd.testing.assert_frame_equal(
+                    result.astype(object), expected.astype(object)
+                )
+
+
+class WorkingSchemaTests(StoreTestCase):
+    def test_stored_in_logical_dtypes_in_every_mode(self):
+        # Small ints and few distinct cities: both compacted in memory
+        document = _upload(pd.DataFrame({
+            'city': ['Oslo', 'Lima'] * 100,
+            'qty': range(200),
+        }))
+        spec = {'op': 'math', 'expression': '`sq` = `qty` * `qty`'}
+        for mode in ('lazy', 'chunked', 'memory'):
+            with self.subTest(mode=mode):
+                frame_cache.clear()
+                new_document, _ = TransformEngine.apply(
+                    document, spec, mode=mode
+                )
+                new_document = TransformEngine.materialize(new_document)
+                schema = DocumentStore.working_schema(new_document)
+                self.assertEqual(
+                    {name: str(schema.field(name).type)
+                     for name in schema.names},
+                    {'city': 'string', 'qty': 'int64', 'sq': 'int64'},
+                )
+
+
+class ContentDedupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({
+            'city': ['Oslo', 'Lima', 'Rome', None] * 50,
+            'n': range(200),
+        })
+
+    # Several row groups, which the chunked filter writes differently
+    @override_settings(WORKING_ROW_GROUP_ROWS=50, STREAMING_CHUNK_ROWS=30)
+    def test_same_content_hash_in_every_mode(self):
+        self.document = _upload(self.df)
+        spec = {'op': 'filter', 'filter_query': 'n % 3 == 0'}
+        hashes = set()
+        for mode in ('lazy', 'chunked', 'memory'):
+            frame_cache.clear()
+            new_document, _ = TransformEngine.apply(
+                self.document, spec, mode=mode
+            )
+            new_document = TransformEngine.materialize(new_document)
+            hashes.add(
+                (new_document.content_hash, new_document.working_file.name)
+            )
+        self.assertEqual(len(hashes), 1)
+
+    def test_noop_edit_shares_parent_on_cache_miss(self):
+        self.document = _upload(self.df)
+        spec = {'op': 'regex', 'regex': 'Paris', 'replacement': 'X',
+                'column': 'city'}
+        new_document, _ = TransformEngine.apply(
+            self.document, spec, mode='lazy'
+        )
+        # Nothing fits in the cache
+        with mock.patch.object(frame_cache, 'max_bytes', 0):
+            frame_cache.clear()
+            new_document = TransformEngine.materialize(new_document)
+        self.assertIsNone(new_document.delta_base_id)
+        self.assertEqual(new_document.working_file.name,
+                         self.document.working_file.name)
+
+
+# Several row groups and batches per file
+@override_settings(WORKING_ROW_GROUP_ROWS=50, STREAMING_CHUNK_ROWS=30)
+class IndexQueryTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = _upload(pd.DataFrame({
+            'city': ['Oslo', 'Lima', 'Rome', 'Kyiv'] * 50,
+            'n': range(200),
+        }))
+
+    def _results(self, spec):
+        """The stored result of spec in every mode, read back cold"""
+        results = {}
+        for mode in ('memory', 'chunked', 'lazy'):
+            frame_cache.clear()
+            new_document, _ = TransformEngine.apply(
+                self.document, spec, mode=mode
+            )
+            new_document = TransformEngine.materialize(new_document)
+            frame_cache.clear()
+            results[mode] = DocumentStore.load(new_document)
+        return results
+
+    def assertSameInEveryMode(self, spec, rows):
+        results = self._results(spec)
+        self.assertEqual(len(results['memory']), rows)
+        for mode in ('chunked', 'lazy'):
+            with self.subTest(mode=mode):
+                pd.testing.assert_frame_equal(
+                    results[mode], results['memory']
+                )
+
+    def test_index_after_another_operation(self):
+        self.assertSameInEveryMode({'op': 'recipe', 'operations': [
+            {'op': 'math', 'expression': '`m` = `n` * 2'},
+            {'op': 'filter', 'filter_query': 'index > 190'},
+        ]}, rows=9)
+
+    def test_index_of_a_version_read_from_the_cache(self):
+        # Renumbered like a fresh read, not labelled as in its parent
+        filtered, _ = TransformEngine.apply(self.document, {
+            'op': 'filter', 'filter_query': 'n >= 100',
+        }, mode='memory')
+        spec = {'op': 'filter', 'filter_query': 'index < 10'}
+        new_document, _ = TransformEngine.apply(filtered, spec,
+                                                mode='memory')
+        self.assertEqual(
+            list(DocumentStore.load(new_document)['n']), list(range(100, 110))
+        )
+
+    def test_index_in_a_pushed_down_filter(self):
+        for query, rows in (
+            ('index > 190', 9),                     # every column read
+            ('index >= 100 and n % 7 == 0', 14),
+            ('n % 7 == 0 and city == "Oslo"', 8),   # only the keys read
+        ):
+            with self.subTest(query=query):
+                self.assertSameInEveryMode(
+                    {'op': 'filter', 'filter_query': query}, rows=rows
+                )
@@ -0,0 +1,109 @@
+# api/tests/test_excel.py
+import datetime
+from io import BytesIO
+from unittest import mock
+
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+from django.urls import reverse
+from openpyxl import Workbook
+
+from api.models import UploadedDocument
+from api.services import excel
+from api.services.cache import frame_cache
+from api.services.excel import ExcelReader, InvalidSheet
+from api.services.store import DocumentStore
+from api.tests.utils import StoreTestCase
+
+
+def _workbook(sheets) -> bytes:
+    """sheets: {name: rows}, rows as lists of cell values"""
+    book = Workbook()
+    book.remove(book.active)
+    for name, rows in sheets.items():
+        sheet = book.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    buffer = BytesIO()
+    book.save(buffer)
+    return buffer.getvalue()
+
+
+ORDERS = [
+    ['id', 'price', 'note', 'when'],
+    [1, 2.5, 'first', datetime.datetime(2024, 1, 2)],
+    [2, 3, None, datetime.datetime(2024, 1, 3)],
+    [],
+    [4, None, 'after a blank row'],
+    [5, 1.75, 'x', datetime.datetime(2024, 1, 5)],
+    [],
+]
+CITIES = [['city', 'n'], ['Oslo', 1], ['Lima', 2]]
+WORKBOOK = _workbook({'Orders': ORDERS, 'Cities': CITIES})
+
+
+class StreamingReaderTests(SimpleTestCase):
+    def read(self, sheet=None):
+        # The openpyxl path, in batches of 2 rows
+        with mock.patch.object(excel, 'python_calamine', None), \
+                mock.patch.object(excel, 'EXCEL_BATCH_ROWS', 2):
+            return ExcelReader.read(BytesIO(WORKBOOK), 'orders.xlsx', sheet)
+
+    def test_same_frame_as_read_excel(self):
+        for sheet in ('Orders', 'Cities'):
+            with self.subTest(sheet=sheet):
+                pd.testing.assert_frame_equal(
+                    self.read(sheet),
+                    pd.read_excel(BytesIO(WORKBOOK), sheet_name=sheet,
+                                  engine='openpyxl'),
+                )
+
+    def test_sheets(self):
+        names = ExcelReader.sheet_names(BytesIO(WORKBOOK), 'orders.xlsx')
+        self.assertEqual(names, ['Orders', 'Cities'])
+        self.assertEqual(ExcelReader.pick_sheet(names, '1'), 'Cities')
+        self.assertEqual(list(self.read('1').columns), ['city', 'n'])
+        with self.assertRaises(InvalidSheet):
+            ExcelReader.pick_sheet(names, 'Missing')
+
+
+class ExcelUploadTests(StoreTestCase):
+    def upload(self, **data):
+        return self.client.post(reverse('file-upload'), {
+            'file': SimpleUploadedFile('orders.xlsx', WORKBOOK), **data,
+        })
+
+    def test_upload_a_sheet_then_another_one(self):
+        response = self.upload(sheet='Cities')
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body['sheet'], 'Cities')
+        self.assertEqual(body['sheets'], ['Orders', 'Cities'])
+        self.assertEqual(body['data'], [{'city': 'Oslo', 'n': 1},
+                                        {'city': 'Lima', 'n': 2}])
+
+        url = reverse('sheets', args=[body['file_id']])
+        self.assertEqual(self.client.get(url).json()['sheet'], 'Cities')
+        response = self.client.post(url, {'sheet': 0},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_rows'], 5)
+        self.assertEqual(response.json()['sheet'], 'Orders')
+
+        invalid = self.client.post(url, {'sheet': 'Missing'},
+                                   content_type='application/json')
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_workbook_is_read_once(self):
+        file_id = self.upload().json()['file_id']
+        document = UploadedDocument.objects.get(id=file_id)
+        self.assertTrue(document.working_file)
+
+        frame_cache.clear()
+        with mock.patch.object(ExcelReader, 'read',
+                               side_effect=AssertionError("workbook read")):
+            df = DocumentStore.load(document)
+        # As pd.read_excel(): the blank row in the middle is kept
+        self.assertEqual(len(df), 5)
+        self.assertEqual(df['note'].iloc[3], 'after a blank row')
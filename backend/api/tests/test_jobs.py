@@ -0,0 +1,174 @@
+# api/tests/test_jobs.py
+from datetime import timedelta
+
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from api.models import Job
+from api.services.engine import TransformEngine
+from api.services.jobs import JobQueue
+from api.services.store import DocumentStore
+from api.services.transforms import TransformError
+from api.tests.utils import StoreTestCase
+
+SPEC = {'op': 'filter', 'filter_query': 'n > 1'}
+
+
+# Jobs are run by hand here: no threads, no worker
+@override_settings(JOB_EXECUTION='worker', JOB_HEARTBEAT_SECONDS=3600)
+class JobQueueTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('n.csv', pd.DataFrame({
+                'n': range(5), 'city': ['Oslo', 'Lima'] * 2 + ['Rome'],
+            }).to_csv(index=False).encode())
+        )
+
+    def test_enqueue_claim_and_run(self):
+        job = JobQueue.enqueue(self.document, SPEC, 'memory')
+        self.assertEqual(job.status, Job.QUEUED)
+
+        claimed = JobQueue.claim_next()
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNotNone(claimed.heartbeat_at)
+        self.assertIsNone(JobQueue.claim_next())
+
+        JobQueue.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual((job.rows_processed, job.total_rows), (5, 5))
+        self.assertEqual([row['n'] for row in job.preview], [2, 3, 4])
+        self.assertEqual(len(DocumentStore.load(job.result)), 3)
+
+    def test_failure_is_recorded(self):
+        job = JobQueue.enqueue(self.document, {
+            'op': 'regex', 'regex': 'a', 'column': 'missing',
+        }, 'memory')
+        with self.assertLogs('api.services.jobs', 'ERROR'):
+            JobQueue.run(JobQueue.claim_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("Column 'missing' not found", job.error)
+        self.assertIsNone(job.result)
+
+    def test_invalid_operation_is_not_queued(self):
+        for spec in ({'op': 'filter', 'filter_query': 'n >'},
+                     {'op': 'regex', 'regex': '(a+)+$'},
+                     {'op': 'unknown'}):
+            with self.subTest(spec=spec):
+                with self.assertRaises(TransformError):
+                    JobQueue.enqueue(self.document, spec)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOB_STALE_SECONDS=60, JOB_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = JobQueue.enqueue(self.document, SPEC, 'memory')
+        JobQueue.claim_next()
+        # Fresh heartbeat: left alone
+        self.assertEqual(JobQueue.requeue_stale(), [])
+
+        self._worker_died(job)
+        with self.assertLogs('api.services.jobs', 'WARNING'):
+            self.assertEqual(JobQueue.requeue_stale(), [job.id])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+
+        self.assertEqual(JobQueue.claim_next().id, job.id)
+        self._worker_died(job)
+        self.assertEqual(JobQueue.requeue_stale(), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(job.error, "The worker running this job stopped")
+
+    def _worker_died(self, job):
+        Job.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=61)
+        )
+
+
+@override_settings(JOB_EXECUTION='worker')
+class AsyncApplyViewTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('n.csv', b'n,city\n1,Oslo\n2,Lima\n')
+        )
+
+    def test_filter_is_queued(self):
+        response = self.client.post('/api/apply-filter/', {
+            'file_id': self.document.id, 'filter_query': 'n > 1',
+            'async': True,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(id=response.json()['job_id'])
+        self.assertEqual(job.operation, {
+            'op': 'filter', 'filter_query': 'n > 1',
+        })
+
+        status = self.client.get(reverse('job-status', args=[job.id]))
+        self.assertEqual(status.json()['status'], Job.QUEUED)
+
+    def test_bad_filter_is_rejected_before_queueing(self):
+        for query in ('n >', 'missing > 1'):
+            with self.subTest(query=query):
+                with self.assertLogs('api.views', 'INFO'):
+                    response = self.client.post('/api/apply-filter/', {
+                        'file_id': self.document.id, 'filter_query': query,
+                        'async': True,
+                    }, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid Filter Logic',
+                              response.json()['error'])
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(JOB_EXECUTION='worker', LAZY_VERSIONS=True,
+                   JOB_HEARTBEAT_SECONDS=3600)
+class MaterializeJobTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('n.csv', b'n\n1\n2\n3\n')
+        )
+        self.lazy, _ = TransformEngine.apply(document, SPEC)
+        self.assertFalse(self.lazy.is_materialized)
+
+    def test_download_queues_one_job_then_serves_the_file(self):
+        url = reverse('download-file', args=[self.lazy.id])
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first.json()['job_id'], second.json()['job_id'])
+
+        job = JobQueue.run(JobQueue.claim_next())
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result_id, self.lazy.id)
+        self.assertEqual((job.rows_processed, job.total_rows), (2, 2))
+
+        response = self.client.get(url, {'redirect': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'n\n2\n3\n')
+
+    def test_checkpoint(self):
+        url = reverse('checkpoint', args=[self.lazy.id])
+        self.assertEqual(self.client.post(url).status_code, 202)
+        JobQueue.run(JobQueue.claim_next())
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], "Version materialized")
+
+    def test_async_apply_is_computed_by_its_job(self):
+        job = JobQueue.enqueue(self.lazy, {
+            'op': 'math', 'expression': '`m` = `n` * 2',
+        })
+        job = JobQueue.run(JobQueue.claim_next())
+        self.assertTrue(job.result.is_materialized)
+        self.assertEqual(job.total_rows, 2)
+        self.assertEqual([row['m'] for row in job.preview], [4, 6])
@@ -0,0 +1,90 @@
+# api/tests/test_llm_cache.py
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from api.services import llm
+from api.services.llm import LLMService
+
+ROWS = [{'name': 'Nick', 'city': 'Oslo'}, {'name': 'Anna', 'city': 'Lima'}]
+TTL = 60
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'llm-tests',
+        'TIMEOUT': TTL,
+    },
+})
+class LLMCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.complete.return_value = '`city` == "Oslo"'
+        for patch in (
+            mock.patch.object(llm, 'client', self.client),
+            mock.patch.dict(llm._stats, hits=0, misses=0, coalesced=0),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        caches['llm'].clear()
+
+    def ask(self, prompt='Keep Oslo', rows=ROWS, profile=None):
+        return LLMService.generate_pandas_filter(prompt, rows, profile)
+
+    def test_repeated_question_is_a_hit(self):
+        self.assertEqual(self.ask(), '`city` == "Oslo"')
+        # Only whitespace differs
+        self.assertEqual(self.ask('  Keep   Oslo '), '`city` == "Oslo"')
+        self.assertEqual(self.client.complete.call_count, 1)
+        self.assertEqual(LLMService.cache_stats(), {
+            'hits': 1, 'misses': 1, 'coalesced': 0, 'hit_rate': 0.5,
+        })
+
+    def test_other_context_is_a_miss(self):
+        self.ask()
+        self.ask('Keep Lima')
+        # Same headers, other sample rows
+        self.ask(rows=[{'name': 'Ned', 'city': 'Rome'}])
+        self.ask(profile={'rows': 2, 'columns': [
+            {'name': 'city', 'dtype': 'object', 'nulls': 0, 'min': None,
+             'max': None, 'top': [['Oslo', 1]]},
+        ]})
+        self.assertEqual(self.client.complete.call_count, 4)
+        self.assertEqual(LLMService.cache_stats()['hits'], 0)
+
+    def test_entries_expire(self):
+        self.ask()
+        later = time.time() + TTL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=later):
+            self.ask()
+        self.assertEqual(self.client.complete.call_count, 2)
+
+    def test_concurrent_identical_questions_share_one_call(self):
+        release = threading.Event()
+
+        def slow_answer(**request):
+            release.wait(5)
+            return '`city` == "Oslo"'
+
+        self.client.complete.side_effect = slow_answer
+        answers = []
+        threads = [threading.Thread(target=lambda: answers.append(self.ask()))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        # Wait for the other two to join the first one's call
+        while LLMService.cache_stats()['coalesced'] < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(answers, ['`city` == "Oslo"'] * 3)
+        self.assertEqual(self.client.complete.call_count, 1)
+        self.assertEqual(LLMService.cache_stats()['misses'], 1)
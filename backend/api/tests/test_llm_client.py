@@ -0,0 +1,199 @@
+# api/tests/test_llm_client.py
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import openai
+from django.test import SimpleTestCase
+
+from api.management.commands.llm_stub import stub_server
+from api.services.llm_client import LLMClient, LLMTimeout, OpenAITransport
+
+REGEX_SYSTEM = ("Return a valid JSON object with strictly three keys: "
+                "'regex', 'column', and 'replacement'.\n"
+                "Data Headers: ['name', 'city']")
+
+
+class Flaky(Exception):
+    pass
+
+
+class FakeTransport:
+    """Answers from a script: an exception to raise, or text to return"""
+
+    retryable = (Flaky,)
+
+    def __init__(self, *outcomes, hold=None):
+        self.outcomes = list(outcomes)
+        self.timeouts = []
+        # Calls wait for this event, to keep several of them in flight
+        self.hold = hold
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def complete(self, request, timeout):
+        self._enter(timeout)
+        try:
+            if self.hold is not None:
+                self.hold.wait(5)
+            return self._next()
+        finally:
+            self._leave()
+
+    async def acomplete(self, request, timeout):
+        self._enter(timeout)
+        try:
+            await asyncio.sleep(0.01)
+            return self._next()
+        finally:
+            self._leave()
+
+    def _enter(self, timeout):
+        with self._lock:
+            self.timeouts.append(timeout)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def _leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def _next(self):
+        with self._lock:
+            outcome = self.outcomes.pop(0) if self.outcomes else 'ok'
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _client(transport, **options):
+    return LLMClient(transport, **{
+        'timeout': 1.0, 'deadline': 5.0, 'max_retries': 3,
+        'max_concurrency': 4, 'backoff_base': 0.01, **options,
+    })
+
+
+class RetryTests(SimpleTestCase):
+    def test_retryable_errors_are_retried_with_jittered_backoff(self):
+        transport = FakeTransport(Flaky(), Flaky(), 'answer')
+        with mock.patch('api.services.llm_client.time.sleep') as sleep:
+            self.assertEqual(_client(transport).complete(), 'answer')
+
+        self.assertEqual(len(transport.timeouts), 3)
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        for attempt, delay in enumerate(delays):
+            self.assertTrue(0 <= delay <= 0.01 * 2 ** attempt)
+
+    def test_error_is_raised_once_retries_are_spent(self):
+        transport = FakeTransport(*[Flaky()] * 3)
+        with mock.patch('api.services.llm_client.time.sleep'), \
+                self.assertRaises(Flaky):
+            _client(transport, max_retries=2).complete()
+        self.assertEqual(len(transport.timeouts), 3)
+
+    def test_other_errors_are_not_retried(self):
+        transport = FakeTransport(ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            _client(transport).complete()
+        self.assertEqual(len(transport.timeouts), 1)
+
+    def test_async_retries(self):
+        transport = FakeTransport(Flaky(), 'answer')
+        client = _client(transport)
+        self.assertEqual(asyncio.run(client.acomplete()), 'answer')
+        self.assertEqual(len(transport.timeouts), 2)
+
+
+class DeadlineTests(SimpleTestCase):
+    def test_attempts_get_what_is_left_of_the_deadline(self):
+        transport = FakeTransport('answer')
+        _client(transport, timeout=30.0, deadline=2.0).complete()
+        self.assertLessEqual(transport.timeouts[0], 2.0)
+
+    def test_no_retry_that_would_end_after_the_deadline(self):
+        transport = FakeTransport(Flaky(), 'answer')
+        client = _client(transport, deadline=0.05, backoff_base=1.0)
+        with mock.patch('api.services.llm_client.random.uniform',
+                        return_value=0.5), \
+                self.assertRaisesMessage(LLMTimeout, 'deadline exceeded'):
+            client.complete()
+        self.assertEqual(len(transport.timeouts), 1)
+
+
+class ConcurrencyTests(SimpleTestCase):
+    def test_upstream_calls_are_capped(self):
+        hold = threading.Event()
+        transport = FakeTransport(hold=hold)
+        client = _client(transport, max_concurrency=2)
+        threads = [threading.Thread(target=client.complete)
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.assertEqual(transport.active, 2)
+        hold.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((transport.peak, len(transport.timeouts)), (2, 5))
+
+    def test_waiting_for_a_slot_counts_against_the_deadline(self):
+        hold = threading.Event()
+        transport = FakeTransport(hold=hold)
+        client = _client(transport, max_concurrency=1, deadline=0.1)
+        busy = threading.Thread(target=client.complete)
+        busy.start()
+        try:
+            with self.assertRaisesMessage(LLMTimeout, 'Too many concurrent'):
+                client.complete()
+        finally:
+            hold.set()
+            busy.join()
+
+    def test_async_calls_are_capped(self):
+        transport = FakeTransport()
+        client = _client(transport, max_concurrency=2)
+
+        async def many():
+            return await asyncio.gather(
+                *[client.acomplete() for _ in range(6)]
+            )
+
+        self.assertEqual(asyncio.run(many()), ['ok'] * 6)
+        self.assertEqual(transport.peak, 2)
+
+
+class StubServerTests(SimpleTestCase):
+    def serve(self, **options):
+        server = stub_server(port=0, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address
+        return OpenAITransport(api_key='stub',
+                               base_url=f"http://{host}:{port}/v1")
+
+    def request(self):
+        return {'model': 'gpt-4-turbo', 'messages': [
+            {'role': 'system', 'content': REGEX_SYSTEM},
+            {'role': 'user', 'content': 'replace names starting with N'},
+        ]}
+
+    def test_sync_and_async_calls(self):
+        client = _client(self.serve())
+        expected = ('{"regex": "^N.*", "column": "name", '
+                    '"replacement": "X"}')
+        self.assertEqual(client.complete(**self.request()), expected)
+        self.assertEqual(asyncio.run(client.acomplete(**self.request())),
+                         expected)
+
+    def test_errors_are_retried(self):
+        transport = self.serve(error_rate=1.0)
+        client = _client(transport, max_retries=1)
+        with mock.patch.object(transport, 'complete',
+                               wraps=transport.complete) as complete, \
+                self.assertRaises(openai.InternalServerError):
+            client.complete(**self.request())
+        self.assertEqual(complete.call_count, 2)
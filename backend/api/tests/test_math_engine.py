@@ -0,0 +1,30 @@
+# api/tests/test_math_engine.py
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from api.services.math_engine import MATH_BLOCK_ROWS, MathEngine, _evaluate
+
+
+class EvaluateTests(SimpleTestCase):
+    def test_results_are_new_writable_arrays(self):
+        expression = '`c` = 5\n`d` = `a` * 0 + 5\n`e` = `a`'
+        # Small frames (NumPy kernels) and large ones (numexpr, if there)
+        for rows in (10, MATH_BLOCK_ROWS + 10):
+            df = pd.DataFrame({'a': np.arange(rows)})
+            for statement in MathEngine.compile(expression).statements:
+                with self.subTest(rows=rows, target=statement.target):
+                    values = _evaluate(statement, df)
+                    self.assertTrue(values.flags.writeable)
+                    self.assertEqual(values.shape, (rows,))
+                    self.assertFalse(np.shares_memory(
+                        values, df['a'].to_numpy()
+                    ))
+
+    def test_assigned_column_can_be_changed_in_place(self):
+        df = MathEngine.apply(
+            pd.DataFrame({'a': np.arange(MATH_BLOCK_ROWS)}), '`c` = 5'
+        )
+        df.loc[0, 'c'] = 7
+        self.assertEqual(df['c'].iloc[0], 7)
+        self.assertEqual(df['c'].iloc[1], 5)
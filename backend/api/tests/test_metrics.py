@@ -0,0 +1,114 @@
+# api/tests/test_metrics.py
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from api.services import metrics
+from api.services.llm_client import _record_usage
+from api.tests.utils import StoreTestCase
+
+CSV = b'city,n\nOslo,1\nLima,2\n'
+
+
+def _counter(name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    return metrics.registry._counters.get(key, 0)
+
+
+class SpanTests(SimpleTestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    def test_spans_are_traced_and_counted(self):
+        trace = metrics.start_trace()
+        try:
+            with metrics.span('llm.regex'):
+                with metrics.span('parse') as stage:
+                    stage.add(rows=10, bytes_read=300)
+                # Token counts go to the innermost span
+                _record_usage(SimpleNamespace(usage=SimpleNamespace(
+                    prompt_tokens=120, completion_tokens=8,
+                )))
+        finally:
+            metrics.end_trace()
+
+        self.assertEqual(list(trace.summary()), ['parse', 'llm.regex'])
+        self.assertEqual(_counter('stage_rows_total', stage='parse'), 10)
+        self.assertEqual(_counter('stage_prompt_tokens_total',
+                                  stage='llm.regex'), 120)
+        self.assertEqual(_counter('stage_completion_tokens_total',
+                                  stage='llm.regex'), 8)
+
+        text = metrics.registry.render()
+        self.assertIn('# TYPE rhombus_stage_seconds histogram', text)
+        self.assertIn('rhombus_stage_seconds_count{stage="parse"} 1', text)
+
+
+class MetricsMiddlewareTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    def upload(self, query=''):
+        return self.client.post(reverse('file-upload') + query, {
+            'file': SimpleUploadedFile('cities.csv', CSV),
+        })
+
+    def test_requests_are_timed_per_stage(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201)
+        timing = response['Server-Timing']
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        self.assertTrue(timing.split(', ')[-1].startswith('total;dur='))
+        self.assertEqual(_counter('http_requests_total',
+                                  view='FileUploadView', method='POST',
+                                  status='201'), 1)
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('rhombus_http_requests_total{method="POST",'
+                      'status="201",view="FileUploadView"} 1', text)
+        self.assertIn('rhombus_frame_cache_lookups_total', text)
+
+    @override_settings(LAZY_VERSIONS=False)
+    def test_streamed_bodies_are_counted_once_sent(self):
+        file_id = self.upload().json()['file_id']
+        response = self.client.get(
+            reverse('download-file', args=[file_id]), {'redirect': '0'}
+        )
+        key = dict(view='DownloadFileView')
+        self.assertEqual(_counter('http_response_bytes_total', **key), 0)
+
+        body = b''.join(response.streaming_content)
+        self.assertEqual(body, CSV)
+        self.assertEqual(_counter('http_response_bytes_total', **key),
+                         len(CSV))
+        self.assertEqual(_counter('stage_bytes_written_total',
+                                  stage='send'), len(CSV))
+
+    def test_requests_can_be_profiled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(PROFILE_REQUESTS=True,
+                               PROFILE_DIR=directory), \
+                self.assertLogs('api.metrics', 'INFO'):
+            response = self.upload('?profile=cprofile')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue((Path(directory) / response['X-Profile']).exists())
+
+        # Off by default: the parameter is ignored
+        self.assertNotIn('X-Profile', self.upload('?profile=cprofile'))
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.upload()
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                         404)
@@ -0,0 +1,104 @@
+# api/tests/test_preview.py
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+
+from api.services import window
+from api.services.cache import frame_cache
+from api.services.engine import TransformEngine
+from api.services.store import DocumentStore
+from api.tests.utils import StoreTestCase
+
+FRAME = pd.DataFrame({
+    'n': range(200),
+    'score': [np.nan if i % 7 == 0 else (i * 37) % 101 for i in range(200)],
+    'city': ['Oslo', 'Lima', 'Rome', 'Kyiv'] * 50,
+})
+
+_read_row_group = pq.ParquetFile.read_row_group
+
+
+@override_settings(WORKING_ROW_GROUP_ROWS=50, PREVIEW_MAX_ROWS=100)
+class PreviewWindowTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        window._sort_index.clear()
+        self.addCleanup(window._sort_index.clear)
+        self.document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('scores.csv',
+                               FRAME.to_csv(index=False).encode())
+        )
+
+    def get(self, document=None, **params):
+        return self.client.get(
+            reverse('preview', args=[(document or self.document).id]),
+            params,
+        )
+
+    def assertWindow(self, response, expected):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['n'] for row in response.json()['data']],
+                         expected['n'].tolist())
+
+    def test_window_from_the_cache_and_from_the_working_copy(self):
+        expected = FRAME.iloc[120:135]
+        self.assertWindow(self.get(offset=120, limit=15), expected)
+
+        frame_cache.clear()
+        with mock.patch.object(pq.ParquetFile, 'read_row_group',
+                               autospec=True,
+                               side_effect=_read_row_group) as read:
+            response = self.get(offset=120, limit=15)
+        self.assertWindow(response, expected)
+        self.assertEqual(response.json()['total_rows'], 200)
+        # Rows 120-134 all lie in the third row group
+        self.assertEqual([call.args[1] for call in read.call_args_list],
+                         [2])
+
+    def test_sorted_window(self):
+        expected = FRAME.sort_values('score', ascending=False, kind='stable',
+                                     na_position='last')
+        for cached in (True, False):
+            with self.subTest(cached=cached):
+                if not cached:
+                    frame_cache.clear()
+                    window._sort_index.clear()
+                response = self.get(offset=160, limit=40, sort='-score')
+                self.assertWindow(response, expected.iloc[160:200])
+                # Nulls last
+                self.assertIsNone(response.json()['data'][-1]['score'])
+
+    @override_settings(LAZY_VERSIONS=True, STREAMING_THRESHOLD_BYTES=0,
+                       STREAMING_CHUNK_ROWS=30)
+    def test_window_of_a_streamed_lazy_version(self):
+        frame_cache.clear()
+        lazy, _ = TransformEngine.apply(
+            self.document, {'op': 'filter', 'filter_query': 'n % 2 == 0'}
+        )
+        self.assertFalse(lazy.is_materialized)
+        expected = FRAME[FRAME['n'] % 2 == 0]
+
+        response = self.get(lazy, offset=40, limit=20)
+        self.assertWindow(response, expected.iloc[40:60])
+        # Stopped before the end: the total isn't known yet
+        self.assertIsNone(response.json()['total_rows'])
+
+        response = self.get(lazy, offset=90, limit=20)
+        self.assertWindow(response, expected.iloc[90:])
+        self.assertEqual(response.json()['total_rows'], 100)
+
+    def test_limit_is_capped(self):
+        response = self.get(limit=500)
+        self.assertEqual(response.json()['limit'], 100)
+        self.assertEqual(len(response.json()['data']), 100)
+
+    def test_invalid_windows(self):
+        for params in ({'offset': 'x'}, {'offset': -1}, {'limit': 0},
+                       {'sort': 'missing'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
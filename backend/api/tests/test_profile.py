@@ -0,0 +1,86 @@
+# api/tests/test_profile.py
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+
+from api.services.engine import TransformEngine
+from api.services.llm import LLMService
+from api.services.profile import ProfileAccumulator, profile_frame
+from api.services.store import DocumentStore
+from api.tests.utils import StoreTestCase
+
+CSV = (b'city,price,sold\n'
+       b'Oslo,2.5,3\nLima,,5\nOslo,1.25,\nRome,3.0,5\nOslo,2.5,1\n')
+
+
+class ProfileTests(StoreTestCase):
+    def upload(self):
+        response = self.client.post(reverse('file-upload'), {
+            'file': SimpleUploadedFile('prices.csv', CSV),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_upload_is_profiled_once(self):
+        profile = self.upload()['profile']
+        self.assertEqual(profile['rows'], 5)
+        city, price, sold = profile['columns']
+
+        self.assertEqual((city['name'], city['nulls'], city['distinct']),
+                         ('city', 0, 3))
+        self.assertEqual(city['top'][0], ['Oslo', 3])
+        self.assertEqual((price['min'], price['max'], price['nulls']),
+                         (1.25, 3.0, 1))
+        self.assertEqual(price['top'][0], [2.5, 2])
+        self.assertEqual((sold['min'], sold['max'], sold['nulls']),
+                         (1.0, 5.0, 1))
+
+    def test_stored_profile_is_served_without_reading_the_file(self):
+        file_id = self.upload()['file_id']
+        with mock.patch.object(DocumentStore, 'load',
+                               side_effect=AssertionError("file read")):
+            response = self.client.get(reverse('profile', args=[file_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['profile']['rows'], 5)
+
+    @override_settings(LAZY_VERSIONS=True)
+    def test_versions_are_profiled_on_first_use(self):
+        document, _ = DocumentStore.create_from_upload(
+            SimpleUploadedFile('prices.csv', CSV)
+        )
+        lazy, _ = TransformEngine.apply(
+            document, {'op': 'filter', 'filter_query': "city == 'Oslo'"}
+        )
+        self.assertIsNone(lazy.profile)
+
+        profile = TransformEngine.profile(lazy)
+        self.assertEqual(profile['rows'], 3)
+        lazy.refresh_from_db()
+        self.assertEqual(lazy.profile, profile)
+
+    def test_batches_add_up_to_the_whole_frame(self):
+        df = pd.DataFrame({
+            'n': [1, 5, np.nan, 2, 9, 5],
+            'tag': ['a', 'b', 'a', None, 'c', 'a'],
+        })
+        whole = profile_frame(df)
+        batched = ProfileAccumulator().update(df.iloc[:2]) \
+            .merge(ProfileAccumulator().update(df.iloc[2:4])) \
+            .update(df.iloc[4:]).result()
+        self.assertEqual(batched, whole)
+
+    def test_profile_is_given_to_the_llm(self):
+        file_id = self.upload()['file_id']
+        with mock.patch.object(LLMService, 'generate_pandas_filter',
+                               return_value="price > 2") as generate:
+            response = self.client.post('/api/generate-filter/', {
+                'prompt': 'Price over 2', 'file_id': file_id,
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        profile = generate.call_args.args[2]
+        self.assertEqual([c['name'] for c in profile['columns']],
+                         ['city', 'price', 'sold'])
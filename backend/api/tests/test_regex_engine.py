@@ -0,0 +1,186 @@
+# api/tests/test_regex_engine.py
+import threading
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, override_settings
+
+from api.services.regex_engine import (
+    RegexEngine,
+    RegexTimeout,
+    UnsafePattern,
+    _candidates,
+    _replace_partition,
+)
+from api.services.transforms import TransformError, apply_regex
+
+
+class PatternSafetyTests(SimpleTestCase):
+    def test_backtracking_patterns_are_rejected(self):
+        df = pd.DataFrame({'a': ['aaa', 'b']})
+        for pattern in (r'(a+)+$', r'(\w+\s?)*', r'(a|aa)+'):
+            with self.subTest(pattern=pattern):
+                with self.assertRaises(UnsafePattern):
+                    RegexEngine.compile(pattern)
+                with self.assertRaisesRegex(TransformError, 'rejected'):
+                    apply_regex(df, pattern, 'x', 'a')
+
+    def test_unambiguous_repeats_are_allowed(self):
+        for pattern in (r'(\d+,)*', r'\s+', r'(ab)+c', r'[a-z]+@\w+'):
+            with self.subTest(pattern=pattern):
+                RegexEngine.compile(pattern)
+
+
+# Serial, in this (main) thread: the budget is enforced with a timer signal
+@override_settings(REGEX_TIME_BUDGET=0.01, REGEX_WORKERS=1)
+class TimeBudgetTests(SimpleTestCase):
+    def test_timeout_raises_transform_error(self):
+        df = pd.DataFrame({'a': ['x1y2z3 ' * 20] * 200_000})
+        with self.assertRaisesRegex(TransformError, 'longer than 0.01s'):
+            apply_regex(df, r'\d', '#', 'a')
+
+    def test_budget_of_zero_means_none(self):
+        df = pd.DataFrame({'a': ['x1'] * 1000})
+        out = RegexEngine.replace(df, r'\d', '#', time_budget=0)
+        self.assertEqual(out['a'].iloc[-1], 'x#')
+
+
+def _in_thread(fn):
+    """fn() in another thread (as under a threaded server): its result or
+    its exception"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+@override_settings(REGEX_WORKERS=1)
+class ThreadedBudgetTests(SimpleTestCase):
+    def test_small_inputs_stay_in_the_thread(self):
+        df = pd.DataFrame({'a': ['x1', 'y2', None]})
+        with mock.patch('api.services.regex_engine._get_pool',
+                        side_effect=AssertionError("pool started")):
+            out = _in_thread(lambda: RegexEngine.replace(
+                df, r'\d', '#', time_budget=5, min_parallel_cells=1000
+            ))
+        self.assertEqual(out['a'].tolist(), ['x#', 'y#', None])
+
+    def test_budget_is_checked_between_rows(self):
+        df = pd.DataFrame({'a': ['x1y2z3 ' * 20] * 200_000})
+        with self.assertRaises(RegexTimeout):
+            _in_thread(lambda: RegexEngine.replace(
+                df, r'\d', '#', time_budget=0.01,
+                min_parallel_cells=10 ** 9,
+            ))
+
+
+def _reference(series, pattern, replacement):
+    """What Series.replace(regex=True) gives on the text form"""
+    text = series.astype(str).where(series.notna(), None)
+    return text.replace(to_replace=pattern, value=replacement, regex=True)
+
+
+class CategoricalTests(SimpleTestCase):
+    def test_categories_that_become_equal_are_merged(self):
+        series = pd.Series(
+            ['NY', 'N.Y.', 'ny', None, 'LA', 'N.Y.'], dtype='category'
+        )
+        out = RegexEngine.replace(
+            pd.DataFrame({'city': series}), r'(?i)^n\.?y\.?$', 'NY'
+        )['city']
+
+        self.assertIsInstance(out.dtype, pd.CategoricalDtype)
+        self.assertEqual(list(out.cat.categories), ['LA', 'NY'])
+        self.assertEqual(
+            out.astype(object).where(out.notna(), None).tolist(),
+            _reference(series.astype(object), r'(?i)^n\.?y\.?$', 'NY')
+            .tolist(),
+        )
+
+    def test_merged_column_still_concatenates(self):
+        series = pd.Series(['a1', 'a2', 'b'], dtype='category')
+        out = RegexEngine.replace(pd.DataFrame({'c': series}), r'\d', '')
+        both = pd.concat([out['c'], out['c']], ignore_index=True)
+        self.assertEqual(both.tolist(), ['a', 'a', 'b'] * 2)
+
+
+PREFILTER_VALUES = np.array(
+    ['Name: Ann', 'name', 'Nate', None, np.nan, 'a cat', 'dog!', 'catdog',
+     '', 'xNamex', 'A', 'Nb\nN', 'the cat and the dog'],
+    dtype=object,
+)
+
+
+class PrefilterTests(SimpleTestCase):
+    patterns = [
+        (r'^N.*', 'X'),           # anchored
+        (r'\AN', 'X'),
+        (r'^Na(me)?', 'X'),
+        (r'(?m)^N', 'X'),         # anchor that isn't only at the start
+        (r'(Na)me', r'\1ME'),     # grouped
+        (r'(?:cat)+', 'C'),
+        (r'cat|dog', 'pet'),      # alternation
+        (r'^(cat|dog)', 'pet'),
+        (r'a(?:t|n)', '_'),
+        (r'x?', '-'),             # matches everything, nothing required
+    ]
+
+    def test_same_result_with_and_without(self):
+        for pattern, replacement in self.patterns:
+            with self.subTest(pattern=pattern):
+                expected = _replace_partition(
+                    pattern, replacement, PREFILTER_VALUES, prefilter=False
+                )
+                actual = _replace_partition(
+                    pattern, replacement, PREFILTER_VALUES, prefilter=True
+                )
+                self.assertEqual(actual.tolist(), expected.tolist())
+                self.assertEqual(
+                    expected.tolist(),
+                    _reference(pd.Series(PREFILTER_VALUES), pattern,
+                               replacement).tolist(),
+                )
+
+    def test_non_text_values_are_not_filtered(self):
+        values = np.array([1, 'N1', 2.5, None], dtype=object)
+        self.assertIsNone(_candidates(r'^N', values))
+        self.assertEqual(
+            _replace_partition(r'^N', 'X', values, prefilter=True).tolist(),
+            ['1', 'X1', '2.5', None],
+        )
+
+
+@override_settings(REGEX_WORKERS=1)
+class PartitionTests(SimpleTestCase):
+    def test_partitions_match_reference(self):
+        df = pd.DataFrame({
+            'text': ['a1', None, 'b22', 'c', 'd4'] * 7,
+            'num': [1.5, np.nan, 3.0, 42.0, 7.25] * 7,
+            'cat': pd.Series(['x1', 'y', None, 'x1', 'z9'] * 7,
+                             dtype='category'),
+        })
+        out = RegexEngine.replace(df, r'\d', '#', partition_rows=4)
+        for col in df.columns:
+            with self.subTest(column=col):
+                actual = out[col].astype(object)
+                self.assertEqual(
+                    actual.where(actual.notna(), None).tolist(),
+                    _reference(df[col].astype(object), r'\d', '#').tolist(),
+                )
+
+    def test_columns_that_cannot_match_keep_their_dtype(self):
+        df = pd.DataFrame({'n': [1, 2], 's': ['a', 'b']})
+        out = RegexEngine.replace(df, r'b', 'x')
+        self.assertEqual(out['n'].dtype, df['n'].dtype)
+        self.assertEqual(out['s'].tolist(), ['a', 'x'])
@@ -0,0 +1,94 @@
+# api/tests/test_serialization.py
+import json
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from api import renderers
+from api.renderers import FastJSONRenderer
+from api.services import engine
+from api.services.engine import preview_columns, preview_records
+from api.tests.utils import StoreTestCase
+
+FRAME = pd.DataFrame({
+    'i': [1, 2, 3],
+    'f': [1.5, np.nan, np.inf],
+    'g': [-np.inf, 0.25, np.nan],
+    's': ['a', None, 'nan'],
+    'b': [True, False, True],
+    'c': pd.Series(['x', None, 'x'], dtype='category'),
+    'n': pd.array([1, None, 3], dtype='Int64'),
+    't': pd.to_datetime(['2024-01-02', None, '2024-01-04']),
+})
+RECORDS = [
+    {'i': 1, 'f': 1.5, 'g': None, 's': 'a', 'b': True, 'c': 'x', 'n': 1,
+     't': pd.Timestamp('2024-01-02')},
+    {'i': 2, 'f': None, 'g': 0.25, 's': None, 'b': False, 'c': None,
+     'n': None, 't': None},
+    {'i': 3, 'f': None, 'g': None, 's': None, 'b': True, 'c': 'x', 'n': 3,
+     't': pd.Timestamp('2024-01-04')},
+]
+
+
+class PreviewSerializationTests(SimpleTestCase):
+    def test_records_are_json_safe(self):
+        self.assertEqual(preview_records(FRAME), RECORDS)
+
+    def test_columns_shape(self):
+        out = preview_columns(FRAME)
+        self.assertEqual(out['columns'], list(FRAME.columns))
+        self.assertEqual(out['values'], [
+            [row[name] for row in RECORDS] for name in FRAME.columns
+        ])
+
+    def test_values_are_python_types(self):
+        row = preview_records(FRAME)[0]
+        self.assertIs(type(row['i']), int)
+        self.assertIs(type(row['f']), float)
+        self.assertIs(type(row['b']), bool)
+
+    def test_rendered_with_and_without_orjson(self):
+        data = {'data': preview_records(FRAME), 'n': np.int64(3)}
+        fast = json.loads(FastJSONRenderer().render(data))
+        with mock.patch.object(renderers, 'orjson', None):
+            plain = json.loads(FastJSONRenderer().render(data))
+        self.assertEqual(fast, plain)
+        self.assertEqual(fast['data'][0]['t'], '2024-01-02T00:00:00')
+        self.assertEqual(fast['n'], 3)
+
+
+class PreviewResponseTests(StoreTestCase):
+    def test_upload_preview_in_both_shapes(self):
+        csv = b'name,score\nOslo,1.5\nLima,\nRome,nan\n'
+        rows = self.client.post(reverse('file-upload'), {
+            'file': SimpleUploadedFile('scores.csv', csv),
+        }).json()['data']
+        self.assertEqual(rows, [
+            {'name': 'Oslo', 'score': 1.5},
+            {'name': 'Lima', 'score': None},
+            {'name': 'Rome', 'score': None},
+        ])
+
+        columns = self.client.post(
+            reverse('file-upload') + '?shape=columns',
+            {'file': SimpleUploadedFile('scores.csv', csv)},
+        ).json()['data']
+        self.assertEqual(columns, {
+            'columns': ['name', 'score'],
+            'values': [['Oslo', 'Lima', 'Rome'], [1.5, None, None]],
+        })
+
+    def test_only_the_preview_rows_are_converted(self):
+        csv = pd.DataFrame({'n': range(1000)}).to_csv(index=False).encode()
+        with mock.patch.object(engine, '_json_columns',
+                               wraps=engine._json_columns) as convert:
+            response = self.client.post(reverse('file-upload'), {
+                'file': SimpleUploadedFile('n.csv', csv),
+            })
+        self.assertEqual(response.json()['total_rows'], 1000)
+        self.assertEqual([len(call.args[0]) for call in convert.mock_calls],
+                         [200])
@@ -0,0 +1,34 @@
+# api/tests/test_transforms.py
+import pandas as pd
+from django.test import SimpleTestCase
+
+from api.services.transforms import (
+    TransformError, build_pipeline, fuse_operations,
+)
+
+
+class FuseOperationsTests(SimpleTestCase):
+    def test_adjacent_filters_are_fused(self):
+        fused = fuse_operations([
+            {'op': 'filter', 'filter_query': 'a > 1'},
+            {'op': 'filter', 'filter_query': 'b < 2'},
+        ])
+        self.assertEqual(fused, [
+            {'op': 'filter', 'filter_query': '(a > 1) and (b < 2)'},
+        ])
+        df = pd.DataFrame({'a': [1, 2, 3], 'b': [1, 1, 5]})
+        self.assertEqual(list(build_pipeline(fused)(df).index), [1])
+
+    def test_filter_without_query_is_rejected(self):
+        for missing in ({'op': 'filter'},
+                        {'op': 'filter', 'filter_query': ''}):
+            for specs in (
+                [{'op': 'filter', 'filter_query': 'a > 1'}, missing],
+                [missing, {'op': 'filter', 'filter_query': 'a > 1'}],
+            ):
+                with self.subTest(specs=specs):
+                    with self.assertRaisesMessage(
+                        TransformError,
+                        "Operation 'filter' needs 'filter_query'",
+                    ):
+                        fuse_operations(specs)
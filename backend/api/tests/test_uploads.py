@@ -0,0 +1,171 @@
+# api/tests/test_uploads.py
+from contextlib import contextmanager
+from io import BytesIO
+from unittest import mock
+
+import pandas as pd
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from api.models import UploadSession
+from api.services import uploads
+from api.services.store import DocumentStore, UnsupportedFileType
+from api.services.uploads import ChunkedUploadService, UploadError
+from api.tests.utils import StoreTestCase
+
+# A column that is bools in the first part and text in the last
+CSV = (b'n,flag,city\n'
+       b'1,True,Oslo\n2,False,Lima\n'
+       b'3,True,Rome\n4,,Kyiv\n'
+       b'5,maybe,Quito\n')
+
+
+def _parts(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ChunkedUploadTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = ChunkedUploadService.initiate('cities.csv')
+        self.parts = _parts(CSV, 24)
+
+    def put(self, number):
+        return ChunkedUploadService.put_part(
+            self._session(), number, self.parts[number - 1]
+        )
+
+    def _session(self):
+        return UploadSession.objects.get(pk=self.session.pk)
+
+    def assertSameAsWholeFile(self, document):
+        expected = pd.read_csv(BytesIO(CSV))
+        actual = DocumentStore.load(document)
+        pd.testing.assert_frame_equal(
+            actual.astype(object).where(actual.notna(), None),
+            expected.astype(object).where(expected.notna(), None),
+        )
+        self.assertEqual(actual['flag'].tolist()[:2], ['True', 'False'])
+
+    def test_unsupported_file_type(self):
+        with self.assertRaises(UnsupportedFileType):
+            ChunkedUploadService.initiate('notes.txt')
+
+    def test_in_order_parts_are_parsed_as_they_arrive(self):
+        for number in range(1, len(self.parts) + 1):
+            self.put(number)
+            self.assertEqual(self._session().parsed_parts, number)
+
+        document = ChunkedUploadService.complete(self._session())
+        self.assertSameAsWholeFile(document)
+        session = self._session()
+        self.assertEqual(session.status, UploadSession.COMPLETED)
+        for name in list(session.segments) + [
+                part['name'] for part in session.parts.values()]:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_out_of_order_parts_are_parsed_once_the_gap_fills(self):
+        last = len(self.parts)
+        for number in range(last, 1, -1):
+            self.put(number)
+            self.assertEqual(self._session().parsed_parts, 0)
+
+        self.put(1)
+        self.assertEqual(self._session().parsed_parts, last)
+        self.assertSameAsWholeFile(
+            ChunkedUploadService.complete(self._session())
+        )
+
+    def test_resume_by_sending_parts_again(self):
+        self.put(1)
+        self.put(3)
+        # The same content again is fine, different content isn't
+        self.put(1)
+        with self.assertRaisesMessage(UploadError, 'different content'):
+            ChunkedUploadService.put_part(self._session(), 1, b'x,y,z\n')
+
+        with self.assertRaisesMessage(UploadError, 'Missing parts: [2]'):
+            ChunkedUploadService.complete(self._session())
+        for number in range(2, len(self.parts) + 1):
+            self.put(number)
+        self.assertSameAsWholeFile(
+            ChunkedUploadService.complete(self._session())
+        )
+
+    def test_invalid_parts(self):
+        for number, data, message in (
+            (0, b'a', 'Part number must be'),
+            (uploads.MAX_PARTS + 1, b'a', 'Part number must be'),
+            (1, b'', 'Empty part'),
+        ):
+            with self.subTest(number=number):
+                with self.assertRaisesMessage(UploadError, message):
+                    ChunkedUploadService.put_part(self._session(), number,
+                                                  data)
+        with self.assertRaisesMessage(UploadError, 'No parts uploaded'):
+            ChunkedUploadService.complete(self._session())
+
+    def test_abort(self):
+        self.put(1)
+        ChunkedUploadService.abort(self._session())
+        session = self._session()
+        self.assertEqual(session.status, UploadSession.ABORTED)
+        self.assertFalse(default_storage.exists(session.parts['1']['name']))
+        with self.assertRaisesMessage(UploadError, 'is aborted'):
+            self.put(2)
+
+    @contextmanager
+    def _multipart(self):
+        """Parts go to a (fake) S3 multipart upload"""
+        client = mock.Mock()
+        client.upload_part.return_value = {'ETag': '"etag"'}
+        UploadSession.objects.filter(pk=self.session.pk) \
+            .update(multipart_id='multipart')
+        with mock.patch.object(uploads, '_client', return_value=client), \
+                mock.patch.object(default_storage, 'bucket_name', 'bucket',
+                                  create=True):
+            yield client
+
+    def test_part_size_on_s3(self):
+        with self._multipart() as client:
+            for number in range(1, len(self.parts) + 1):
+                self.put(number)
+            with self.assertRaisesMessage(UploadError,
+                                          'are smaller than'):
+                ChunkedUploadService.complete(self._session())
+        client.complete_multipart_upload.assert_not_called()
+
+    def test_out_of_order_parts_are_staged_on_s3(self):
+        with self._multipart():
+            self.put(2)
+            self.put(1)
+        parts = self._session().parts
+        # S3 can't read part 2 back before completion
+        self.assertIn('name', parts['2'])
+        self.assertNotIn('name', parts['1'])
+        self.assertEqual(self._session().parsed_parts, 2)
+
+
+class ChunkedUploadViewTests(StoreTestCase):
+    def test_upload_through_the_api(self):
+        response = self.client.post(reverse('uploads'),
+                                    {'filename': 'cities.csv'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['upload_id']
+
+        parts = _parts(CSV, 40)
+        for number, data in reversed(list(enumerate(parts, 1))):
+            response = self.client.put(
+                reverse('upload-part', args=[upload_id, number]), data,
+                content_type='application/octet-stream',
+            )
+            self.assertEqual(response.status_code, 200)
+        status = self.client.get(reverse('upload-detail', args=[upload_id]))
+        self.assertEqual(status.json()['parsed_parts'], len(parts))
+
+        response = self.client.post(
+            reverse('upload-complete', args=[upload_id])
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_rows'], 5)
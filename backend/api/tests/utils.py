@@ -0,0 +1,28 @@
+# api/tests/utils.py
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from api.services.cache import frame_cache
+
+
+class StoreTestCase(TestCase):
+    """Working copies on a temporary local storage, empty frame cache"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        storage = override_settings(
+            MEDIA_ROOT=media,
+            STORAGES={
+                'default': {
+                    'BACKEND':
+                        'django.core.files.storage.FileSystemStorage',
+                },
+            },
+        )
+        storage.enable()
+        self.addCleanup(storage.disable)
+        frame_cache.clear()
+        self.addCleanup(frame_cache.clear)
@@ -8,10 +8,38 @@ from .views import (
     ApplyFilterView,
     GenerateMathView,
     ApplyMathView,
+    RecipeListView,
+    ApplyRecipeView,
+    BatchApplyView,
+    CheckpointView,
+    JobStatusView,
+    LLMCacheStatsView,
+    MetricsView,
+    PreviewView,
+    ProfileView,
+    ChunkedUploadView,
+    ChunkedUploadDetailView,
+    UploadPartView,
+    CompleteUploadView,
+    SheetListView,
     )
 
 urlpatterns = [
     path('upload/', FileUploadView.as_view(), name='file-upload'),
+    path('sheets/<int:file_id>/', SheetListView.as_view(), name='sheets'),
+    path('uploads/', ChunkedUploadView.as_view(), name='uploads'),
+    path('uploads/<int:upload_id>/',
+         ChunkedUploadDetailView.as_view(),
+         name='upload-detail'
+         ),
+    path('uploads/<int:upload_id>/parts/<int:part_number>/',
+         UploadPartView.as_view(),
+         name='upload-part'
+         ),
+    path('uploads/<int:upload_id>/complete/',
+         CompleteUploadView.as_view(),
+         name='upload-complete'
+         ),
     path(
         'generate-regex/', GenerateRegexView.as_view(), name='generate-regex'
         ),
@@ -24,4 +52,19 @@ urlpatterns = [
     path('apply-filter/', ApplyFilterView.as_view()),
     path('generate-math/', GenerateMathView.as_view(), name='generate-math'),
     path('apply-math/', ApplyMathView.as_view(), name='apply-math'),
+    path('recipes/', RecipeListView.as_view(), name='recipes'),
+    path('apply-recipe/', ApplyRecipeView.as_view(), name='apply-recipe'),
+    path('apply-batch/', BatchApplyView.as_view(), name='apply-batch'),
+    path('checkpoint/<int:file_id>/',
+         CheckpointView.as_view(),
+         name='checkpoint'
+         ),
+    path('preview/<int:file_id>/', PreviewView.as_view(), name='preview'),
+    path('profile/<int:file_id>/', ProfileView.as_view(), name='profile'),
+    path('jobs/<int:job_id>/', JobStatusView.as_view(), name='job-status'),
+    path('llm/cache-stats/',
+         LLMCacheStatsView.as_view(),
+         name='llm-cache-stats'
+         ),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,15 +1,72 @@
-import pandas as pd
-import numpy as np
+import logging
+import time
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
-from .models import UploadedDocument
+from .models import Job, Recipe, UploadedDocument, UploadSession
+from .serializers import RecipeSerializer
+from .services import metrics
 from .services.llm import LLMService
+from .services.download import (
+    DownloadError, DownloadService, RangeNotSatisfiable,
+)
+from .services.batch import BatchApply
+from .services.cache import frame_cache
+from .services.engine import (
+    TransformEngine, preview_columns, preview_records,
+)
+from .services.excel import ExcelReader, InvalidSheet
+from .services.jobs import JobQueue
+from .services.math_engine import MathEngine, MathError
+from .services.profile import profile_columns
+from .services.store import DocumentStore, UnsupportedFileType
+from .services.transforms import (
+    TransformError, build_transform, check_filter,
+)
+from .services.uploads import ChunkedUploadService, UploadError
+from .services.window import InvalidWindow, RowWindow
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.core.files.base import ContentFile
-from io import BytesIO
-from django.http import FileResponse
+from django.http import (
+    HttpResponse, HttpResponseRedirect, StreamingHttpResponse,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _wants_async(request):
+    return request.data.get('async') in (True, 'true', '1')
+
+
+def _preview(request, df):
+    # ?shape=columns: one list per column instead of one dict per row
+    if request.query_params.get('shape') == 'columns':
+        return preview_columns(df)
+    return preview_records(df)
+
+
+def _job_accepted(job, message="Job queued"):
+    # Long operations: hand back a job id right away, the client polls it
+    return Response({
+        "message": message,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": reverse('job-status', args=[job.id]),
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def _request_profile(request):
+    # Generate* views: a file_id gives the LLM the stored column profile
+    file_id = request.data.get('file_id')
+    if not file_id:
+        return None
+    return TransformEngine.profile(
+        get_object_or_404(UploadedDocument, id=file_id)
+    )
 
 
 class FileUploadView(APIView):
@@ -22,51 +79,210 @@ class FileUploadView(APIView):
             return Response({"error": "No file provided"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # 1. Save to S3/Database
-        document = UploadedDocument.objects.create(file=file_obj)
-
         try:
-            # 2. Open the file
-            # (ensure pointer is at start if S3 implementation varies)
-            document.file.open()
-
-            filename = document.file.name.lower()
-
-            # 3. Read Data
-            if filename.endswith('.csv'):
-                df = pd.read_csv(document.file)
-            elif filename.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(document.file)
-            else:
-                return Response({"error": "Unsupported file type"},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            # 4. Data Cleaning for JSON Compliance
-            # Replace NaN, Infinity, and -Infinity with None (JSON null)
-            df = df.replace([np.nan, np.inf, -np.inf], None)
+            # Excel: the requested sheet (default the first)
+            sheets = None
+            sheet = ''
+            if _is_excel(file_obj.name):
+                sheets = ExcelReader.sheet_names(file_obj, file_obj.name)
+                sheet = ExcelReader.pick_sheet(
+                    sheets, request.data.get('sheet')
+                )
 
-            # 5. LIMIT PREVIEW SIZE (Crucial for performance)
-            # Only send the first 200 rows to the frontend for the preview
-            # The full file is safely stored in S3 for later processing
-            preview_df = df.head(200)
+            # 1. Save to S3/Database, 2. Read Data and store the typed
+            # Parquet working copy next to the original
+            document, df = DocumentStore.create_from_upload(
+                file_obj, _stored_sheet(sheet, sheets)
+            )
 
-            # Convert to list of dictionaries
-            data_preview = preview_df.to_dict(orient='records')
+            # 4. LIMIT PREVIEW SIZE (Crucial for performance)
+            # Only send the first 200 rows to the frontend for the preview.
+            # The full file is safely stored in S3 for later processing.
+            # Sliced before converting, NaN / Infinity become None (null)
+            data_preview = _preview(request, df.head(200))
 
             return Response({
                 "message": "File uploaded successfully",
                 "file_id": document.id,
                 "file_url": document.file.url,
                 "data": data_preview,  # Returns the tabular data
-                "total_rows": len(df)  # Useful to show "Displaying 50 of
-                                       # 10,000 rows"
+                "total_rows": len(df),  # Useful to show "Displaying 50 of
+                                        # 10,000 rows"
+                "profile": document.profile,
+                "sheet": sheet or None,
+                "sheets": sheets,
             }, status=status.HTTP_201_CREATED)
 
+        except (UnsupportedFileType, InvalidSheet) as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
             return Response({"error": str(e)},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _is_excel(filename):
+    return filename.lower().endswith(('.xls', '.xlsx'))
+
+
+def _stored_sheet(sheet, sheets):
+    # The first sheet is stored as blank, the default of every reader
+    return '' if not sheets or sheet == sheets[0] else sheet
+
+
+class SheetListView(APIView):
+    """
+    GET: the worksheets of an uploaded workbook.
+    POST {"sheet": name or position}: a new file from another sheet of the
+    same upload, without sending it again.
+    """
+
+    def get(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+        if not document.file or not _is_excel(document.file.name):
+            return Response({"error": "Not an Excel upload"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with DocumentStore.open_ranged(document.file) as handle:
+            sheets = ExcelReader.sheet_names(handle, document.file.name)
+        return Response({
+            "file_id": document.id,
+            "sheet": document.sheet or sheets[0],
+            "sheets": sheets,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+        if not document.file or not _is_excel(document.file.name):
+            return Response({"error": "Not an Excel upload"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with DocumentStore.open_ranged(document.file) as handle:
+                sheets = ExcelReader.sheet_names(handle, document.file.name)
+            sheet = ExcelReader.pick_sheet(sheets, request.data.get('sheet'))
+            new_document, df = DocumentStore.create_from_original(
+                document, document.display_name, _stored_sheet(sheet, sheets)
+            )
+        except InvalidSheet as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response({"error": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "message": "Sheet loaded successfully",
+            "file_id": new_document.id,
+            "data": _preview(request, df.head(200)),
+            "total_rows": len(df),
+            "profile": new_document.profile,
+            "sheet": sheet,
+            "sheets": sheets,
+        }, status=status.HTTP_201_CREATED)
+
+
+def _upload_status(session):
+    return {
+        "upload_id": session.id,
+        "filename": session.filename,
+        "status": session.status,
+        "part_size": settings.UPLOAD_PART_SIZE,
+        # Resuming: send the parts that aren't listed here
+        "parts": {
+            number: part['size'] for number, part in sorted(
+                session.parts.items(), key=lambda item: int(item[0])
+            )
+        },
+        "parsed_parts": session.parsed_parts,
+        "file_id": session.document_id,
+        "complete_url": reverse('upload-complete', args=[session.id]),
+    }
+
+
+class ChunkedUploadView(APIView):
+    """POST {"filename": ...} starts a resumable upload"""
+
+    def post(self, request):
+        try:
+            session = ChunkedUploadService.initiate(
+                request.data.get('filename')
+            )
+        except UnsupportedFileType as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(_upload_status(session),
+                        status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadDetailView(APIView):
+    def get(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id)
+        return Response(_upload_status(session), status=status.HTTP_200_OK)
+
+    def delete(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id)
+        try:
+            ChunkedUploadService.abort(session)
+        except UploadError as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadPartView(APIView):
+    """PUT the raw bytes of one part (numbered from 1)"""
+
+    def put(self, request, upload_id, part_number):
+        session = get_object_or_404(UploadSession, id=upload_id)
+        # Read the body directly: parts are bigger than Django's in-memory
+        # request body limit
+        data = request.stream.read() if request.stream else b''
+
+        try:
+            part = ChunkedUploadService.put_part(session, part_number, data)
+        except UploadError as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "upload_id": session.id,
+            "part_number": part_number,
+            "size": part['size'],
+            "md5": part['md5'],
+        }, status=status.HTTP_200_OK)
+
+
+class CompleteUploadView(APIView):
+    def post(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id)
+
+        try:
+            document = ChunkedUploadService.complete(session)
+            df, total_rows = RowWindow.fetch(document, 0, 200)
+        except UploadError as e:
+            return Response({"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response({"error": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Same shape as FileUploadView
+        return Response({
+            "message": "File uploaded successfully",
+            "file_id": document.id,
+            "file_url": document.file.url,
+            "data": _preview(request, df),
+            "total_rows": total_rows,
+            "profile": document.profile,
+        }, status=status.HTTP_201_CREATED)
+
+
 class GenerateRegexView(APIView):
     def post(self, request):
         prompt = request.data.get('prompt')
@@ -78,9 +294,13 @@ class GenerateRegexView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        profile = _request_profile(request)
+
         try:
             # Call the LLM Service
-            regex_pattern = LLMService.generate_regex(prompt, data_context)
+            regex_pattern = LLMService.generate_regex(
+                prompt, data_context, profile
+            )
 
             return Response({
                 "prompt": prompt,
@@ -90,9 +310,9 @@ class GenerateRegexView(APIView):
                 "message": "Pattern generated successfully"
             }, status=status.HTTP_200_OK)
 
-        except Exception as e:
+        except Exception:
             # Log the actual error
-            print(f"Error generating regex: {str(e)}")
+            logger.exception("Error generating regex")
             return Response(
                 {"error": "Failed to generate regex pattern"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -112,78 +332,49 @@ class ApplyRegexView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
                 )
 
+        spec = {
+            "op": "regex",
+            "regex": regex_pattern,
+            "replacement": replacement_val,
+            "column": target_column,
+        }
+
         try:
             # Load the PREVIOUS file (Chain of custody)
             old_document = get_object_or_404(UploadedDocument, id=file_id)
-            old_document.file.open()
-
-            filename = old_document.file.name.lower()
-
-            # Read file
-            if filename.endswith('.csv'):
-                df = pd.read_csv(old_document.file)
-            elif filename.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(old_document.file, engine='openpyxl')
-            else:
-                return Response(
-                    {"error": "Unsupported file format"},
-                    status=status.HTTP_400_BAD_REQUEST
-                    )
-
-            # --- LOGIC TO APPLY TO SPECIFIC COLUMN ---
-            if target_column:
-                if target_column in df.columns:
-                    # Apply ONLY to this column
-                    df[target_column] = df[target_column].astype(str).replace(
-                        to_replace=regex_pattern,
-                        value=replacement_val,
-                        regex=True
-                    )
-                else:
-                    # If LLM hallucinated a column name, strictly fail or warn?
-                    # For UX, let's fallback to global or return error.
-                    # Returning error is safer so user knows it failed.
-                    return Response(
-                        {"error":
-                         f"Column '{target_column}' not found in file"},
-                        status=status.HTTP_400_BAD_REQUEST
-                        )
-            else:
-                # Apply Globally
-                df = df.astype(str).replace(
-                    to_replace=regex_pattern,
-                    value=replacement_val,
-                    regex=True
-                    )
-            # AVE AS NEW VERSION (Crucial for Undo)
-            buffer = BytesIO()
-            new_filename = f"v_edited_{old_document.file.name.split('/')[-1]}"
-
-            if filename.endswith('.csv'):
-                df.to_csv(buffer, index=False)
-            else:
-                df.to_excel(buffer, index=False)
-
-            # Create a NEW database record for this version
-            new_document = UploadedDocument.objects.create(
-                file=ContentFile(buffer.getvalue(), new_filename)
-            )
-
-            # Prepare Response
-            # Clean data for JSON
-            df = df.replace({'nan': None, 'NaN': None})
-            df = df.where(pd.notnull(df), None)
-
-            updated_data = df.head(200).to_dict(orient='records')
+
+            # Known columns: reject a hallucinated one before any work
+            columns = profile_columns(old_document.profile)
+            if target_column and columns and target_column not in columns:
+                raise TransformError(
+                    f"Column '{target_column}' not found in file"
+                )
+
+            if _wants_async(request):
+                return _job_accepted(JobQueue.enqueue(
+                    old_document, spec, request.data.get('mode')
+                ))
+
+            # SAVE AS NEW VERSION (Crucial for Undo). By default the version
+            # is lazy: only the preview is computed until it is downloaded.
+            new_document, df = TransformEngine.apply(
+                old_document, spec, mode=request.data.get('mode')
+            )
 
             return Response({
                 "message": "Replacement applied",
-                "data": updated_data,
+                "data": _preview(request, df),
                 "new_file_id": new_document.id  # <- Return new ID to Frontend
             }, status=status.HTTP_200_OK)
 
+        except (UnsupportedFileType, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+                )
+
         except Exception as e:
-            print(f"Server Error: {str(e)}")
+            logger.exception("Failed to apply regex")
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -191,44 +382,110 @@ class ApplyRegexView(APIView):
 
 
 class DownloadFileView(APIView):
-    def get(self, request, file_id):
-        try:
-            document = get_object_or_404(UploadedDocument, id=file_id)
+    """
+    GET download/<file_id>/?format=csv|xlsx|parquet
 
-            # Open the file handle
-            file_handle = document.file.open()
+    Stored files (originals, Parquet working copies) support Range
+    requests, and large ones on S3 are redirected to a presigned URL
+    (?redirect=0 to always proxy). Conversions are streamed as they are
+    produced. CSV is compressed for clients accepting zstd or gzip.
 
-            # Determine content type (CSV or Excel)
-            filename = document.file.name.split('/')[-1]  # Remove folder paths
+    Lazy versions aren't computed here: the first request queues a job
+    for it (202 with its job_id, as the async Apply* requests do), and the
+    download works once that job has succeeded.
+    """
 
-            if filename.endswith('.csv'):
-                content_type = 'text/csv'
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the file format here, not a DRF renderer
+        return super().perform_content_negotiation(request, force=True)
 
-            else:
-                content_type = ('application/vnd.'
-                                'openxmlformats-officedocument.'
-                                'spreadsheetml.sheet')
+    def get(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+
+        if not document.is_materialized:
+            # All pending operations in one pass, outside the request
+            return _job_accepted(
+                JobQueue.enqueue_materialize(document),
+                "Computing this version, download it once the job has "
+                "succeeded",
+            )
 
-            # Create the response that forces a download
-            response = FileResponse(file_handle, content_type=content_type)
-            disposition = f'attachment; filename="{filename}"'
-            response['Content-Disposition'] = disposition
+        try:
+            download = DownloadService.prepare(
+                document, request.query_params.get('format')
+            )
 
-            return response
+        except (DownloadError, UnsupportedFileType, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+                )
 
         except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
             return Response(
                 {"error": str(e)},
-                status=status.HTTP_404_NOT_FOUND
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
+        if request.query_params.get('redirect') not in ('0', 'false'):
+            url = download.redirect_url()
+            if url:
+                return HttpResponseRedirect(url)
+
+        byte_range = None
+        encoding = None
+        if download.stored is not None:
+            try:
+                byte_range = DownloadService.parse_range(
+                    request.headers.get('Range'), download.size
+                )
+            except RangeNotSatisfiable:
+                response = HttpResponse(
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+                response['Content-Range'] = f"bytes */{download.size}"
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                download.iter_bytes(start, end),
+                status=status.HTTP_206_PARTIAL_CONTENT,
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{download.size}"
+            response['Content-Length'] = end - start + 1
+        else:
+            encoding = DownloadService.negotiate_encoding(
+                download, request.headers.get('Accept-Encoding')
+            )
+            chunks = download.iter_bytes()
+            if encoding:
+                chunks = DownloadService.encode(chunks, encoding)
+            response = StreamingHttpResponse(chunks)
+            if encoding:
+                response['Content-Encoding'] = encoding
+            elif download.size is not None:
+                response['Content-Length'] = download.size
+
+        response['Content-Type'] = download.content_type
+        response['Content-Disposition'] = (
+            f'attachment; filename="{download.filename}"'
+        )
+        response['Accept-Ranges'] = 'bytes' if download.stored else 'none'
+        if download.compressible:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
 
 class GenerateFilterView(APIView):
     def post(self, request):
         prompt = request.data.get('prompt')
         data_context = request.data.get('data_context')
 
-        query = LLMService.generate_pandas_filter(prompt, data_context)
+        query = LLMService.generate_pandas_filter(
+            prompt, data_context, _request_profile(request)
+        )
 
         return Response({"filter_query": query}, status=status.HTTP_200_OK)
 
@@ -238,55 +495,47 @@ class ApplyFilterView(APIView):
         file_id = request.data.get('file_id')
         filter_query = request.data.get('filter_query')
 
+        spec = {"op": "filter", "filter_query": filter_query}
+
         try:
             old_doc = get_object_or_404(UploadedDocument, id=file_id)
-            old_doc.file.open()
 
-            # Load Data
-            if old_doc.file.name.endswith('.csv'):
-                df = pd.read_csv(old_doc.file)
-            else:
-                df = pd.read_excel(old_doc.file, engine='openpyxl')
-            # --- THE TRANSFORMATION: Filtering ---
-            # Using query() is safer than exec() but still powerful
-            try:
-                # Sanitize column names for query if they have spaces
-                # (Pandas query requires backticks for spaces, LLM usually
-                # handles this, but be aware)
-                df_filtered = df.query(filter_query)
-            except Exception as e:
-                print(f"Filter application error: {str(e)}")
-                return Response(
-                    {"error": f"Invalid Filter Logic: {str(e)}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                    )
-
-            # --- SAVE NEW VERSION (Reusing your logic) ---
-            buffer = BytesIO()
-            new_name = f"v_filtered_{old_doc.file.name.split('/')[-1]}"
-
-            if old_doc.file.name.endswith('.csv'):
-                df_filtered.to_csv(buffer, index=False)
-
-            else:
-                df_filtered.to_excel(buffer, index=False)
-
-            new_doc = UploadedDocument.objects.create(
-                file=ContentFile(buffer.getvalue(), new_name)
-                )
+            # Syntax and column names, before the query is queued or run
+            build_transform(spec)
+            check_filter(filter_query, old_doc.profile)
+
+            if _wants_async(request):
+                return _job_accepted(JobQueue.enqueue(
+                    old_doc, spec, request.data.get('mode')
+                ))
 
-            # Return Data
-            df_filtered = df_filtered.replace(
-                {'nan': None, 'NaN': None}
-                ).where(pd.notnull(df_filtered), None)
+            # --- THE TRANSFORMATION: Filtering ---
+            # --- SAVE NEW VERSION ---
+            new_doc, df_filtered = TransformEngine.apply(
+                old_doc, spec, mode=request.data.get('mode')
+            )
 
             return Response({
                 "message": "Filter applied",
-                "data": df_filtered.head(50).to_dict(orient='records'),
+                "data": _preview(request, df_filtered),
                 "new_file_id": new_doc.id
             })
 
+        except TransformError as e:
+            logger.info("Filter application error: %s", e)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+                )
+
+        except UnsupportedFileType as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+                )
+
         except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -305,7 +554,9 @@ class GenerateMathView(APIView):
                 )
 
         # Call the new LLM method
-        expression = LLMService.generate_math_operation(prompt, data_context)
+        expression = LLMService.generate_math_operation(
+            prompt, data_context, _request_profile(request)
+        )
 
         return Response({"expression": expression}, status=status.HTTP_200_OK)
 
@@ -321,74 +572,362 @@ class ApplyMathView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        spec = {"op": "math", "expression": expression}
+
         try:
             old_doc = get_object_or_404(UploadedDocument, id=file_id)
-            old_doc.file.open()
-
-            # Load Data
-            filename = old_doc.file.name.lower()
-            if filename.endswith('.csv'):
-                df = pd.read_csv(old_doc.file)
-            elif filename.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(old_doc.file, engine='openpyxl')
-            else:
-                return Response(
-                    {"error": "Unsupported file"},
-                    status=status.HTTP_400_BAD_REQUEST
-                    )
 
-            # --- APPLY MATH TRANSFORMATION ---
-            try:
-                # ROBUST FIX: Handle assignment manually to avoid
-                # BACKTICK_QUOTED_STRING error
-                # The LLM returns format: "`New Col` = `Old Col` * 2"
-
-                if "=" in expression:
-                    # Split into Target Column and Formula
-                    target, formula = expression.split("=", 1)
-                    target = target.strip()
-
-                    # Remove backticks from the target column name if present
-                    if target.startswith("`") and target.endswith("`"):
-                        target = target[1:-1]
-
-                    # Calculate the values using the formula only
-                    # We use engine='python' for better string handling in the
-                    # formula
-                    df[target] = df.eval(formula, engine='python').round(2)
-                else:
-                    # Fallback if no '=' found (unlikely given prompts)
-                    df = df.eval(expression, inplace=False, engine='python')
-            except Exception as e:
-                return Response(
-                    {"error": f"Math Operation Failed: {str(e)}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # Parse once up front: bad syntax or unknown columns fail fast
+            columns = profile_columns(old_doc.profile)
+            if columns:
+                try:
+                    MathEngine.validate(expression, columns)
+                except MathError as e:
+                    raise TransformError(f"Math Operation Failed: {str(e)}")
 
+            if _wants_async(request):
+                return _job_accepted(JobQueue.enqueue(
+                    old_doc, spec, request.data.get('mode')
+                ))
+
+            # --- APPLY MATH TRANSFORMATION ---
             # --- SAVE AS NEW VERSION ---
-            buffer = BytesIO()
-            new_name = f"v_math_{old_doc.file.name.split('/')[-1]}"
-            if filename.endswith('.csv'):
-                df.to_csv(buffer, index=False)
-            else:
-                df.to_excel(buffer, index=False)
+            new_doc, df = TransformEngine.apply(
+                old_doc, spec, mode=request.data.get('mode')
+            )
 
-            new_doc = UploadedDocument.objects.create(
-                file=ContentFile(buffer.getvalue(), new_name)
+            return Response({
+                "message": "Math operation applied",
+                "data": _preview(request, df),
+                "new_file_id": new_doc.id
+            }, status=status.HTTP_200_OK)
+
+        except (UnsupportedFileType, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class RecipeListView(APIView):
+    def get(self, request):
+        recipes = Recipe.objects.order_by('-created_at')
+        return Response(RecipeSerializer(recipes, many=True).data)
+
+    def post(self, request):
+        serializer = RecipeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ApplyRecipeView(APIView):
+    """
+    Run an ordered list of operations (the same specs the Apply* views
+    take) in a single pass and store one new version. Either send the
+    operations inline or replay a saved recipe with recipe_id.
+    """
+
+    def post(self, request):
+        file_id = request.data.get('file_id')
+        recipe_id = request.data.get('recipe_id')
+        operations = request.data.get('operations')
+
+        if not file_id or not (operations or recipe_id):
+            return Response(
+                {"error": "Missing file_id, operations or recipe_id"},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            # Prepare Preview
-            df = df.replace({'nan': None, 'NaN': None})
-            df = df.where(pd.notnull(df), None)
+        if recipe_id:
+            recipe = get_object_or_404(Recipe, id=recipe_id)
+            operations = recipe.operations
+
+        spec = {"op": "recipe", "operations": operations}
+
+        try:
+            old_doc = get_object_or_404(UploadedDocument, id=file_id)
+
+            if _wants_async(request):
+                return _job_accepted(JobQueue.enqueue(
+                    old_doc, spec, request.data.get('mode')
+                ))
+
+            new_doc, df = TransformEngine.apply(
+                old_doc, spec, mode=request.data.get('mode')
+            )
 
             return Response({
-                "message": "Math operation applied",
-                "data": df.head(50).to_dict(orient='records'),
+                "message": f"{len(operations)} operations applied",
+                "data": _preview(request, df),
                 "new_file_id": new_doc.id
             }, status=status.HTTP_200_OK)
 
+        except (UnsupportedFileType, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class BatchApplyView(APIView):
+    """
+    The same operation over many files, in parallel: "file_ids" plus either
+    one "operation" (a spec as the Apply* views build it, e.g.
+    {"op": "regex", "regex": ..., "replacement": ...}) or a recipe
+    ("operations" / "recipe_id"). Every file gets its own new version;
+    "results" maps each file id to its new_file_id or error, with timings.
+    """
+
+    def post(self, request):
+        file_ids = request.data.get('file_ids')
+        operation = request.data.get('operation')
+        operations = request.data.get('operations')
+        recipe_id = request.data.get('recipe_id')
+
+        if not isinstance(file_ids, list) or not file_ids \
+                or not (operation or operations or recipe_id):
+            return Response(
+                {"error": "Missing file_ids, operation, operations or "
+                          "recipe_id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(file_ids) > settings.BATCH_MAX_FILES:
+            return Response(
+                {"error": f"At most {settings.BATCH_MAX_FILES} files per "
+                          f"batch"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            file_ids = [int(file_id) for file_id in file_ids]
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "file_ids must be integers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if recipe_id:
+            recipe = get_object_or_404(Recipe, id=recipe_id)
+            operations = recipe.operations
+        spec = operation or {"op": "recipe", "operations": operations}
+        if not isinstance(spec, dict):
+            return Response(
+                {"error": "operation must be an object"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        started = time.perf_counter()
+        try:
+            results = BatchApply.run(
+                file_ids, spec, mode=request.data.get('mode')
+            )
+
+        except TransformError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        succeeded = sum(
+            result['status'] == 'ok' for result in results.values()
+        )
+        return Response({
+            "message": f"{succeeded} of {len(results)} files processed",
+            "results": {
+                str(file_id): result for file_id, result in results.items()
+            },
+            "seconds": round(time.perf_counter() - started, 4),
+        }, status=status.HTTP_200_OK)
+
+
+class CheckpointView(APIView):
+    """
+    POST: store the full working copy of a lazy version. It is computed by
+    a job (202 with its job_id); 200 if it is stored already.
+    """
+
+    def post(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+
+        if not document.is_materialized:
+            return _job_accepted(JobQueue.enqueue_materialize(document))
+
+        return Response({
+            "message": "Version materialized",
+            "file_id": document.id,
+        }, status=status.HTTP_200_OK)
+
+
+class PreviewView(APIView):
+    """
+    GET preview/<file_id>/?offset=0&limit=200&sort=Column
+    Any window of rows of a version; sort=-Column sorts descending.
+    """
+
+    def get(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+
+        try:
+            offset = int(request.query_params.get('offset', 0))
+            limit = int(request.query_params.get('limit', 200))
+        except ValueError:
+            return Response(
+                {"error": "offset and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if offset < 0 or limit < 1:
+            return Response(
+                {"error": "offset must be >= 0 and limit >= 1"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(limit, settings.PREVIEW_MAX_ROWS)
+
+        sort = request.query_params.get('sort') or None
+        descending = bool(sort) and sort.startswith('-')
+        if descending:
+            sort = sort[1:]
+
+        try:
+            df, total_rows = RowWindow.fetch(
+                document, offset, limit, sort=sort, descending=descending
+            )
+
+            return Response({
+                "file_id": document.id,
+                "offset": offset,
+                "limit": limit,
+                "sort": request.query_params.get('sort') or None,
+                "total_rows": total_rows,
+                "data": _preview(request, df),
+            }, status=status.HTTP_200_OK)
+
+        except (InvalidWindow, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ProfileView(APIView):
+    def get(self, request, file_id):
+        document = get_object_or_404(UploadedDocument, id=file_id)
+
+        try:
+            profile = TransformEngine.profile(document)
+        except (UnsupportedFileType, TransformError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
+            logger.exception("Unhandled error in %s", type(self).__name__)
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+        return Response({
+            "file_id": document.id,
+            "profile": profile,
+        }, status=status.HTTP_200_OK)
+
+
+class LLMCacheStatsView(APIView):
+    def get(self, request):
+        return Response(LLMService.cache_stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    GET metrics/: Prometheus metrics of this server process (requests,
+    stages, database, caches), see services/metrics.py
+    """
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            return Response({"error": "Metrics are disabled"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        registry = metrics.registry
+        registry.set('frame_cache_bytes', frame_cache.size_bytes,
+                     help="Bytes of DataFrames in the frame cache")
+        for result, value in (('hit', frame_cache.hits),
+                              ('miss', frame_cache.misses)):
+            registry.set('frame_cache_lookups_total', value,
+                         help="Frame cache lookups", kind='counter',
+                         result=result)
+        llm_stats = LLMService.cache_stats()
+        for result in ('hits', 'misses', 'coalesced'):
+            registry.set('llm_cache_lookups_total', llm_stats[result],
+                         help="LLM cache lookups", kind='counter',
+                         result=result)
+
+        return HttpResponse(
+            registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+
+class JobStatusView(APIView):
+    def get(self, request, job_id):
+        # A job whose worker died shows as queued again (or failed), not
+        # as running forever
+        JobQueue.requeue_stale()
+        job = get_object_or_404(Job, id=job_id)
+
+        progress = None
+        eta_seconds = None
+        if job.total_rows:
+            progress = round(job.rows_processed / job.total_rows, 4)
+
+            # Extrapolate from the throughput so far
+            if job.status == Job.RUNNING and job.rows_processed:
+                elapsed = (timezone.now() - job.started_at).total_seconds()
+                remaining = job.total_rows - job.rows_processed
+                eta_seconds = round(
+                    remaining * elapsed / job.rows_processed, 1
+                )
+
+        return Response({
+            "job_id": job.id,
+            "status": job.status,
+            "operation": job.operation,
+            "rows_processed": job.rows_processed,
+            "total_rows": job.total_rows,
+            "progress": progress,
+            "eta_seconds": eta_seconds,
+            "new_file_id": job.result_id,
+            "data": job.preview,
+            "error": job.error or None,
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,263 @@
+# benchmarks/__main__.py
+"""
+Benchmark of the upload -> generate -> apply -> download pipeline.
+
+    cd backend
+    python -m benchmarks                              # 10k rows, CSV + XLSX
+    python -m benchmarks --rows 10k,1m,10m --formats csv --repeat 5
+    python -m benchmarks --baseline benchmarks/results/<earlier run>.json
+
+Each run uploads a synthetic dataset through FileUploadView, then chains
+the Generate*/Apply* views for regex, filter and math and downloads the
+result, all through Django's test client. Files are stored on the local
+filesystem in a temporary directory, the database is a throwaway test
+database and the LLM is an in-process stub (benchmarks/stub.py), so only
+this code is measured. Every run starts cold (no documents, no cached
+frames).
+
+Per stage it reports latency percentiles, peak RSS and dataset rows per
+second, and writes everything to benchmarks/results/ named after the
+current commit, so runs on two commits can be compared with --baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCHMARKS_DIR.parent
+RESULTS_DIR = BENCHMARKS_DIR / 'results'
+DATA_DIR = BENCHMARKS_DIR / 'data'
+
+# Settings that change what is measured, recorded with the results
+RECORDED_SETTINGS = (
+    'LAZY_VERSIONS', 'DELTA_VERSIONS', 'STREAMING_THRESHOLD_BYTES',
+    'STREAMING_CHUNK_ROWS', 'FRAME_CACHE_MAX_BYTES', 'REGEX_WORKERS',
+    'WORKING_ROW_GROUP_ROWS',
+)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    workdir = Path(tempfile.mkdtemp(prefix='rhombus-bench-'))
+    _configure(workdir)
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import (
+        override_settings, setup_test_environment, teardown_test_environment,
+    )
+
+    from .datasets import SIZES, dataset
+    from .pipeline import STAGES, reset, run_pipeline, summarize
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    overrides = override_settings(
+        DEBUG=False,
+        MEDIA_ROOT=str(workdir / 'media'),
+        STORAGES={
+            **settings.STORAGES,
+            'default': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            },
+        },
+    )
+    overrides.enable()
+
+    results = []
+    try:
+        for size in args.rows:
+            for fmt in args.formats:
+                try:
+                    path = dataset(size, fmt, args.data_dir)
+                except ValueError as e:
+                    print(f"skipping {size} {fmt}: {e}")
+                    continue
+
+                samples = {stage: [] for stage in STAGES}
+                for run in range(args.repeat):
+                    reset()
+                    print(f"{path.name} run {run + 1}/{args.repeat}",
+                          flush=True)
+                    for stage, sample in run_pipeline(path, args.mode) \
+                            .items():
+                        samples[stage].append(sample)
+
+                rows = SIZES[size]
+                results.append({
+                    'dataset': path.name,
+                    'rows': rows,
+                    'bytes': path.stat().st_size,
+                    'stages': {
+                        stage: summarize(samples[stage], rows)
+                        for stage in STAGES
+                    },
+                })
+                reset()
+        record = _record(args, results, settings)
+    finally:
+        overrides.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    _print_results(record)
+    output = args.output or RESULTS_DIR / _result_name(record)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(record, indent=2) + '\n')
+    print(f"\nresults: {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        slower = _compare(record, baseline, args.threshold)
+        if slower and args.fail_on_regression:
+            sys.exit(1)
+
+
+def _parse_args(argv):
+    from .datasets import FORMATS, SIZES
+
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Benchmark upload -> generate -> apply -> download",
+    )
+    parser.add_argument(
+        '--rows', default='10k', type=lambda value: value.split(','),
+        help=f"Comma-separated dataset sizes: {', '.join(SIZES)}",
+    )
+    parser.add_argument(
+        '--formats', default=','.join(FORMATS),
+        type=lambda value: value.split(','),
+        help="Comma-separated upload formats: csv, xlsx",
+    )
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs per dataset")
+    parser.add_argument(
+        '--mode', choices=['lazy', 'memory', 'chunked'],
+        help="Mode sent with the Apply* requests (default: the server's)",
+    )
+    parser.add_argument('--data-dir', type=Path, default=DATA_DIR,
+                        help="Where generated datasets are kept")
+    parser.add_argument('--output', type=Path,
+                        help="Results file (default: benchmarks/results/)")
+    parser.add_argument('--baseline', type=Path,
+                        help="Earlier results file to compare against")
+    parser.add_argument(
+        '--threshold', type=float, default=0.10,
+        help="Relative p50 slowdown reported as a regression",
+    )
+    parser.add_argument(
+        '--fail-on-regression', action='store_true',
+        help="Exit with status 1 if any stage regressed",
+    )
+    args = parser.parse_args(argv)
+
+    unknown = [size for size in args.rows if size not in SIZES] + \
+        [fmt for fmt in args.formats if fmt not in FORMATS]
+    if unknown:
+        parser.error(f"unknown sizes/formats: {unknown}")
+    return args
+
+
+def _configure(workdir):
+    """Settings that must be in place before Django starts"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ['LLM_TRANSPORT'] = 'benchmarks.stub.StubTransport'
+    os.environ['LLM_CACHE_DIR'] = str(workdir / 'llm_cache')
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+
+def _record(args, results, settings):
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'created_at': datetime.now(timezone.utc).isoformat(
+            timespec='seconds'
+        ),
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'options': {
+            'repeat': args.repeat,
+            'mode': args.mode,
+        },
+        'settings': {
+            name: getattr(settings, name) for name in RECORDED_SETTINGS
+        },
+        'results': results,
+    }
+
+
+def _result_name(record):
+    stamp = record['created_at'].replace(':', '').replace('-', '')[:15]
+    commit = (record['commit'] or 'unknown')[:10]
+    dirty = '-dirty' if record['dirty'] else ''
+    return f"{commit}{dirty}-{stamp}.json"
+
+
+def _git(*command):
+    try:
+        return subprocess.run(
+            ['git', *command], cwd=BACKEND_DIR, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(record):
+    for result in record['results']:
+        print(f"\n{result['dataset']} ({result['rows']:,} rows, "
+              f"{result['bytes'] / 2**20:.1f} MiB)")
+        print(f"  {'stage':<16}{'p50 s':>10}{'p95 s':>10}"
+              f"{'peak MiB':>10}{'rows/s':>14}")
+        for stage, stats in result['stages'].items():
+            rate = f"{stats['rows_per_sec']:,}" \
+                if stats['rows_per_sec'] else '-'
+            print(f"  {stage:<16}{stats['p50']:>10.3f}{stats['p95']:>10.3f}"
+                  f"{stats['peak_rss_mb']:>10.1f}{rate:>14}")
+
+
+def _compare(record, baseline, threshold) -> list:
+    """Print p50 changes against the baseline, returns the regressions"""
+    before = {
+        (result['dataset'], stage): stats
+        for result in baseline['results']
+        for stage, stats in result['stages'].items()
+    }
+    print(f"\ncompared with {(baseline.get('commit') or '?')[:10]} "
+          f"(p50, + is slower)")
+    for key in ('options', 'settings', 'machine'):
+        if record[key] != baseline.get(key):
+            print(f"  note: {key} differ from the baseline's")
+    slower = []
+    for result in record['results']:
+        for stage, stats in result['stages'].items():
+            old = before.get((result['dataset'], stage))
+            if not old or not old['p50']:
+                continue
+            change = stats['p50'] / old['p50'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                slower.append((result['dataset'], stage))
+            print(f"  {result['dataset']:<20}{stage:<16}"
+                  f"{old['p50']:>9.3f} -> {stats['p50']:<9.3f}"
+                  f"{change:>+8.1%}{flag}")
+    return slower
+
+
+if __name__ == '__main__':
+    main()
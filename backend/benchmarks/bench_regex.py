@@ -0,0 +1,81 @@
+"""
+Regex replacement throughput: single-core pandas baseline vs RegexEngine
+with an increasing number of worker processes, with and without the
+literal prefilter. Runs without Django settings: every RegexEngine option
+is passed explicitly.
+
+    python benchmarks/bench_regex.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.regex_engine import RegexEngine  # noqa: E402
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    names = np.array(['Nick', 'Anna', 'Ned', 'Olivia', 'Sam', 'Noah'])
+    return pd.DataFrame({
+        'Name': rng.choice(names, rows) + rng.integers(0, 1000, rows)
+        .astype(str),
+        'Email': rng.choice(['a@x.com', 'bob@y.org', 'n/a'], rows),
+        'Units Sold': rng.integers(0, 10_000, rows),
+        'Unit Price': rng.random(rows) * 100,
+        'Status': rng.choice(['Pending', 'Shipped', 'Returned'], rows),
+    })
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--pattern', default=r'^N.*')
+    parser.add_argument('--replacement', default='X')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    cells = df.size
+
+    baseline = timed(lambda: df.astype(str).replace(
+        to_replace=args.pattern, value=args.replacement, regex=True
+    ), args.repeat)
+    print(f"{'pandas astype(str)':<26} {baseline:8.2f}s "
+          f"{cells / baseline:14,.0f} cells/s")
+
+    for prefilter in (False, True):
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            elapsed = timed(lambda: RegexEngine.replace(
+                df, args.pattern, args.replacement,
+                max_workers=workers,
+                min_parallel_cells=0,
+                partition_rows=max(args.rows // (workers * 2), 10_000),
+                time_budget=0,
+                prefilter=prefilter,
+            ), args.repeat)
+            label = f"RegexEngine x{workers}" + \
+                (" prefilter" if prefilter else "")
+            print(f"{label:<26} {elapsed:8.2f}s "
+                  f"{cells / elapsed:14,.0f} cells/s "
+                  f"({baseline / elapsed:.1f}x)")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
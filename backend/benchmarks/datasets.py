@@ -0,0 +1,89 @@
+# benchmarks/datasets.py
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# Dataset sizes by name, e.g. --rows 10k,1m
+SIZES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+FORMATS = ('csv', 'xlsx')
+# A worksheet holds 1,048,576 rows, one of them the header
+EXCEL_MAX_ROWS = 1_048_575
+
+# Rows generated (and written) at a time
+CHUNK_ROWS = 250_000
+SEED = 20240101
+
+CITIES = ['Oslo', 'Rome', 'Lima', 'Pune', 'Kyiv', 'Accra', 'Perth', 'Quito']
+DOMAINS = ['example.com', 'example.net', 'mail.test']
+
+
+def dataset(size: str, fmt: str, directory: Path) -> Path:
+    """
+    Path of the synthetic dataset, generated on first use. The same size
+    always gives the same file, so runs on different commits compare.
+    """
+    rows = SIZES[size]
+    if fmt == 'xlsx' and rows > EXCEL_MAX_ROWS:
+        raise ValueError(f"XLSX holds at most {EXCEL_MAX_ROWS} rows, "
+                         f"{size} has {rows}")
+
+    path = Path(directory) / f"bench-{size}.{fmt}"
+    if path.exists():
+        return path
+
+    directory.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix(path.suffix + '.part')
+    if fmt == 'csv':
+        _write_csv(partial, rows)
+    else:
+        _write_xlsx(partial, rows)
+    partial.rename(path)
+    return path
+
+
+def frame(start: int, stop: int) -> pd.DataFrame:
+    """Rows start..stop-1 of every dataset (deterministic)"""
+    rng = np.random.default_rng([SEED, start])
+    count = stop - start
+    ids = np.arange(start, stop)
+    domains = np.array(DOMAINS, dtype=object)[rng.integers(0, 3, count)]
+    days = rng.integers(0, 365, count)
+    return pd.DataFrame({
+        'name': [f"Name-{i}" for i in ids],
+        'email': [f"user{i}@{domain}" for i, domain in zip(ids, domains)],
+        'city': np.array(CITIES, dtype=object)[rng.integers(0, 8, count)],
+        'price': np.round(rng.uniform(1, 100, count), 2),
+        'qty': rng.integers(1, 100, count),
+        'signup': (np.datetime64('2024-01-01') + days).astype(str),
+    })
+
+
+def _chunks(rows):
+    for start in range(0, rows, CHUNK_ROWS):
+        yield frame(start, min(start + CHUNK_ROWS, rows))
+
+
+def _write_csv(path, rows):
+    with open(path, 'w', newline='') as handle:
+        for index, chunk in enumerate(_chunks(rows)):
+            chunk.to_csv(handle, index=False, header=index == 0)
+
+
+def _write_xlsx(path, rows):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = False
+    for chunk in _chunks(rows):
+        if not header:
+            sheet.append(list(chunk.columns))
+            header = True
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
@@ -0,0 +1,172 @@
+# benchmarks/pipeline.py
+import os
+import resource
+import shutil
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.test import Client
+
+from api.models import UploadedDocument
+from api.services.cache import frame_cache
+from api.services.jobs import JobQueue
+
+# Stages of one pipeline run, in order
+STAGES = (
+    'upload',
+    'generate-regex', 'apply-regex',
+    'generate-filter', 'apply-filter',
+    'generate-math', 'apply-math',
+    'download',
+)
+
+PROMPTS = {
+    'regex': "Move every example.com address to example.org",
+    'filter': "Rows priced over 20 outside Oslo",
+    'math': "Add a total column: price times quantity",
+}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class RssSampler:
+    """
+    Peak resident memory of this process while a stage runs, sampled from
+    /proc every few milliseconds. Elsewhere only the peak of the whole
+    process is known (getrusage). Regex pool workers are not included.
+    """
+
+    INTERVAL = 0.005
+
+    def __init__(self):
+        self._statm = '/proc/self/statm'
+        if not os.path.exists(self._statm):
+            self._statm = None
+        self._peak = 0
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self._peak = self._rss()
+        if self._statm:
+            self._running = True
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._peak = max(self._peak, self._rss())
+
+    @property
+    def peak_bytes(self) -> int:
+        return self._peak
+
+    def _sample(self):
+        while self._running:
+            self._peak = max(self._peak, self._rss())
+            time.sleep(self.INTERVAL)
+
+    def _rss(self) -> int:
+        if self._statm is None:
+            # Kilobytes on Linux, bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if os.uname().sysname == 'Darwin' else peak * 1024
+        with open(self._statm) as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_pipeline(path, mode: str = None) -> dict:
+    """
+    Upload the file at path and chain every generate/apply stage and the
+    download on it. Returns stage -> (seconds, peak RSS bytes).
+    """
+    client = Client()
+    timings = {}
+
+    def stage(name, call):
+        with RssSampler() as sampler:
+            start = time.perf_counter()
+            response = call()
+            body = b''.join(response.streaming_content) \
+                if response.streaming else response.content
+            elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise BenchmarkError(f"{name}: HTTP {response.status_code} "
+                                 f"{body[:500]!r}")
+        timings[name] = (elapsed, sampler.peak_bytes)
+        return response
+
+    with open(path, 'rb') as handle:
+        response = stage('upload', lambda: client.post(
+            '/api/upload/', {'file': handle}
+        ))
+    file_id = response.json()['file_id']
+
+    for op, apply_fields in (
+        ('regex', ('regex', 'replacement', 'column')),
+        ('filter', ('filter_query',)),
+        ('math', ('expression',)),
+    ):
+        generated = stage(f'generate-{op}', lambda: _post(
+            client, f'/api/generate-{op}/',
+            {'prompt': PROMPTS[op], 'file_id': file_id},
+        )).json()
+
+        payload = {'file_id': file_id}
+        payload.update({field: generated[field] for field in apply_fields})
+        if mode:
+            payload['mode'] = mode
+        file_id = stage(f'apply-{op}', lambda: _post(
+            client, f'/api/apply-{op}/', payload
+        )).json()['new_file_id']
+
+    stage('download', lambda: _download(client, file_id))
+    return timings
+
+
+def reset():
+    """Start the next run cold: no documents, files or cached frames"""
+    # Newest first: versions protect the documents they derive from
+    for document in UploadedDocument.objects.order_by('-id'):
+        document.delete()
+    shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+    frame_cache.clear()
+
+
+def summarize(samples: list, rows: int) -> dict:
+    """Latency percentiles, peak RSS and throughput of one stage"""
+    seconds = np.array([elapsed for elapsed, _ in samples])
+    p50 = float(np.percentile(seconds, 50))
+    return {
+        'runs': len(samples),
+        'p50': round(p50, 4),
+        'p95': round(float(np.percentile(seconds, 95)), 4),
+        'min': round(float(seconds.min()), 4),
+        'max': round(float(seconds.max()), 4),
+        'peak_rss_mb': round(max(peak for _, peak in samples) / 2**20, 1),
+        'rows_per_sec': round(rows / p50) if p50 else None,
+    }
+
+
+def _post(client, url, payload):
+    return client.post(url, payload, content_type='application/json')
+
+
+def _download(client, file_id):
+    response = client.get(f'/api/download/{file_id}/')
+    if response.status_code == 202:
+        # Lazy version: its job computes it (run here, there is no worker),
+        # then the download is served
+        job = JobQueue.claim_next()
+        while job is not None:
+            JobQueue.run(job)
+            job = JobQueue.claim_next()
+        response = client.get(f'/api/download/{file_id}/')
+    return response
@@ -0,0 +1,42 @@
+# benchmarks/stub.py
+import json
+
+# Fixed answers for the benchmark dataset (see datasets.py), one per
+# LLMService generator
+REGEX_ANSWER = {
+    "regex": r"@example\.com$",
+    "column": "email",
+    "replacement": "@example.org",
+}
+FILTER_ANSWER = "`price` > 20 and `city` != 'Oslo'"
+MATH_ANSWER = "`total` = `price` * `qty`"
+
+
+class StubTransport:
+    """
+    In-process stand-in for OpenAITransport (set LLM_TRANSPORT to
+    benchmarks.stub.StubTransport), so benchmarks measure this code and not
+    the network or the model.
+    """
+
+    retryable = ()
+
+    def __init__(self, api_key=None, base_url=None):
+        pass
+
+    def complete(self, request: dict, timeout: float) -> str:
+        return _answer(request.get('messages', []))
+
+    async def acomplete(self, request: dict, timeout: float) -> str:
+        return _answer(request.get('messages', []))
+
+
+def _answer(messages):
+    system = next(
+        (m['content'] for m in messages if m['role'] == 'system'), ''
+    )
+    if "'regex', 'column', and 'replacement'" in system:
+        return json.dumps(REGEX_ANSWER)
+    if ".query() method" in system:
+        return FILTER_ANSWER
+    return MATH_ANSWER
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',  # Timings, see 15. below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',  # Admin
 
@@ -160,6 +161,8 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
 AWS_S3_SIGNATURE_VERSION = 's3v4'
+# Spool S3 downloads to disk past this size instead of holding them in memory
+AWS_S3_MAX_MEMORY_SIZE = 32 * 1024 * 1024
 
 # Tell Django to use S3 for FileField storage
 STORAGES = {
@@ -180,3 +183,185 @@ STORAGES = {
 # Even with S3, it's good practice to define these
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# 4. DATAFRAME CACHE
+# Parsed versions are kept in memory so chained operations skip S3 and
+# parsing. Set FRAME_CACHE_SHARED_ALIAS to a CACHES alias (e.g. Redis) to
+# share working copies between workers.
+FRAME_CACHE_MAX_BYTES = int(
+    os.getenv('FRAME_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+)
+FRAME_CACHE_SHARED_ALIAS = os.getenv('FRAME_CACHE_SHARED_ALIAS') or None
+
+# 5. STREAMING TRANSFORMS
+# Working copies at least this big are transformed in row batches of
+# STREAMING_CHUNK_ROWS instead of being loaded into memory at once.
+STREAMING_THRESHOLD_BYTES = int(
+    os.getenv('STREAMING_THRESHOLD_BYTES', 64 * 1024 * 1024)
+)
+STREAMING_CHUNK_ROWS = int(os.getenv('STREAMING_CHUNK_ROWS', 100_000))
+
+# 6. BACKGROUND JOBS
+# Apply* requests sent with "async": true are queued as Job rows, and so is
+# computing a lazy version when it is first downloaded or checkpointed.
+# 'worker': run `python manage.py run_jobs` next to the web server.
+# 'thread': run each job in a background thread of the web process.
+JOB_EXECUTION = os.getenv('JOB_EXECUTION', 'worker')
+# A running job writes a heartbeat every JOB_HEARTBEAT_SECONDS. One without
+# any for JOB_STALE_SECONDS lost its worker: it is queued again, or failed
+# once it has been started JOB_MAX_ATTEMPTS times.
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 15))
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# 7. LAZY VERSIONS
+# Apply* operations only record parent + operation and compute the preview.
+# The full file is materialized by a job, queued when the version is first
+# downloaded or checkpointed.
+LAZY_VERSIONS = os.getenv('LAZY_VERSIONS', 'true').lower() in ('1', 'true')
+
+# 8. PARALLEL REGEX
+# Regex replacements touching at least REGEX_PARALLEL_MIN_CELLS cells are
+# split by column and REGEX_PARTITION_ROWS row ranges across a process pool.
+REGEX_WORKERS = int(os.getenv('REGEX_WORKERS', os.cpu_count() or 1))
+REGEX_PARALLEL_MIN_CELLS = int(
+    os.getenv('REGEX_PARALLEL_MIN_CELLS', 500_000)
+)
+REGEX_PARTITION_ROWS = int(os.getenv('REGEX_PARTITION_ROWS', 250_000))
+# Seconds one regex replacement may run before it is stopped (0: no limit).
+# Patterns with nested repeats like (a+)+ are rejected up front.
+REGEX_TIME_BUDGET = float(os.getenv('REGEX_TIME_BUDGET', 10))
+# Only run the pattern on rows containing the literal text it needs
+REGEX_PREFILTER = os.getenv('REGEX_PREFILTER', 'true').lower() in ('1', 'true')
+
+# 9. CACHES
+# 'llm' persists LLM completions across restarts (TTL + max entries).
+# On read-only hosts point LLM_CACHE_DIR somewhere writable, e.g. /tmp.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('LLM_CACHE_DIR', BASE_DIR / '.llm_cache'),
+        'TIMEOUT': int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10_000)),
+        },
+    },
+}
+
+# 10. LLM CLIENT
+# LLM_TIMEOUT bounds one attempt, LLM_DEADLINE the whole call including
+# retries (keep it below the 60s Vercel function limit). Set LLM_BASE_URL
+# to e.g. http://127.0.0.1:8765/v1 to use `manage.py llm_stub` instead of
+# OpenAI. LLM_TRANSPORT is the dotted path of the transport class.
+LLM_TRANSPORT = os.getenv(
+    'LLM_TRANSPORT', 'api.services.llm_client.OpenAITransport'
+)
+LLM_BASE_URL = os.getenv('LLM_BASE_URL') or None
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 20))
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 45))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+
+# 11. PREVIEW WINDOWS
+# Working copies are written in row groups of WORKING_ROW_GROUP_ROWS rows,
+# so a preview window only reads the row groups it overlaps. Smaller groups
+# make windows cheaper but compress slightly worse.
+WORKING_ROW_GROUP_ROWS = int(os.getenv('WORKING_ROW_GROUP_ROWS', 50_000))
+PREVIEW_MAX_ROWS = int(os.getenv('PREVIEW_MAX_ROWS', 1000))
+
+# 12. DOWNLOADS
+# Stored files on S3 at least this big are served by redirecting to a
+# presigned URL valid for DOWNLOAD_URL_EXPIRY seconds
+DOWNLOAD_REDIRECT_MIN_BYTES = int(
+    os.getenv('DOWNLOAD_REDIRECT_MIN_BYTES', 32 * 1024 * 1024)
+)
+DOWNLOAD_URL_EXPIRY = int(os.getenv('DOWNLOAD_URL_EXPIRY', 300))
+
+# 13. CHUNKED UPLOADS
+# Part size suggested to clients of the uploads/ endpoints. On S3 every part
+# but the last must be at least 5 MiB.
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+
+# 14. DELTA VERSIONS
+# Versions that only rewrite or add some columns (regex on one column, math)
+# store just those columns on top of their parent version, at most
+# DELTA_MAX_DEPTH deltas deep. Reads combine them with the parent.
+DELTA_VERSIONS = os.getenv('DELTA_VERSIONS', 'true').lower() in ('1', 'true')
+DELTA_MAX_DEPTH = int(os.getenv('DELTA_MAX_DEPTH', 8))
+
+# 15. METRICS AND PROFILING
+# Every request is timed per stage (parse, transform, serialize, db, ...):
+# see the Server-Timing header, the api.metrics log (LOG_LEVEL=DEBUG) and
+# the Prometheus metrics at /api/metrics/ (per process).
+# METRICS_TRACE_MEMORY adds the peak Python memory of every stage, if
+# tracemalloc is started (e.g. PYTHONTRACEMALLOC=1), which slows everything
+# down.
+# With PROFILE_REQUESTS on, ?profile=1 on any request saves a profile of it
+# to PROFILE_DIR: pyinstrument HTML if it is installed, else cProfile
+# (?profile=cprofile forces cProfile).
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in (
+    '1', 'true'
+)
+METRICS_TRACE_MEMORY = os.getenv(
+    'METRICS_TRACE_MEMORY', 'false'
+).lower() in ('1', 'true')
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() in (
+    '1', 'true'
+)
+PROFILE_DIR = os.getenv('PROFILE_DIR', BASE_DIR / 'profiles')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# 16. COMPACT DTYPES
+# Frames are held in memory with the smallest dtypes that keep their
+# values: integers are narrowed (int8/16/32) and text columns with at most
+# CATEGORY_MAX_RATIO distinct values per row become categoricals, which
+# regex replacements rewrite per distinct value instead of per row.
+COMPACT_DTYPES = os.getenv('COMPACT_DTYPES', 'true').lower() in ('1', 'true')
+CATEGORY_MAX_RATIO = float(os.getenv('CATEGORY_MAX_RATIO', 0.5))
+
+# 17. JSON RESPONSES
+# orjson (if installed) encodes the responses; previews are sent as row
+# dicts, or with ?shape=columns as {"columns": [...], "values": [...]}
+# (one list per column), which is smaller and faster to encode.
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# 18. BATCH APPLY
+# apply-batch/ runs one operation over many files on a pool of BATCH_WORKERS
+# processes (1: one after the other in the request), at most
+# BATCH_MAX_FILES files per request. Lazy versions, and files holding less
+# than BATCH_PARALLEL_MIN_BYTES together, are run in the request: starting
+# the workers takes seconds.
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 500))
+BATCH_PARALLEL_MIN_BYTES = int(
+    os.getenv('BATCH_PARALLEL_MIN_BYTES', 64 * 1024 * 1024)
+)
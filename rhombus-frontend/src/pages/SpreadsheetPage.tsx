@@ -238,11 +238,26 @@ const SpreadsheetPage: React.FC = () => {
   };
 
   // --- DOWNLOAD HANDLER ---
+  // Versions that haven't been computed yet answer 202 with a job to poll
+  const waitForJob = async (statusUrl: string) => {
+    for (;;) {
+      const { data: job } = await apiClient.get(statusUrl);
+      if (job.status === 'succeeded') return;
+      if (job.status === 'failed') throw new Error(job.error);
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleDownload = async () => {
     if (!currentFileId) return;
 
     try {
-      const response = await apiClient.get(`/api/download/${currentFileId}/`, { responseType: 'blob' });
+      let response = await apiClient.get(`/api/download/${currentFileId}/`, { responseType: 'blob' });
+      if (response.status === 202) {
+        const job = JSON.parse(await response.data.text());
+        await waitForJob(job.status_url);
+        response = await apiClient.get(`/api/download/${currentFileId}/`, { responseType: 'blob' });
+      }
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
       link.href = url;